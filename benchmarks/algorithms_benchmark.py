@@ -0,0 +1,58 @@
+"""
+Running time of word count, inverted index and pmi graphs over generated documents,
+and of Reduce and Join over sorted rows alone, best of several runs
+"""
+import random
+import sys
+import time
+import typing as tp
+
+from compgraph import algorithms, operations as ops
+from compgraph.graph import Graph
+
+DOCS = 500
+WORDS_PER_DOC = 200
+VOCABULARY = 5000
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+REPEATS = 3
+
+
+def make_docs(n: int) -> list[ops.TRow]:
+    generator = random.Random(0)
+    words = ["".join(generator.choices(LETTERS, k=generator.randint(3, 10))) for _ in range(VOCABULARY)]
+    return [{"doc_id": i, "text": " ".join(generator.choices(words, k=WORDS_PER_DOC))} for i in range(n)]
+
+
+def best(run: tp.Callable[[], int]) -> tuple[float, int]:
+    times, rows = [], 0
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        rows = run()
+        times.append(time.perf_counter() - start)
+    return min(times), rows
+
+
+def main(n: int) -> None:
+    docs = make_docs(n)
+    graphs: dict[str, tp.Callable[[str], Graph]] = {
+        "word_count": algorithms.word_count_graph,
+        "inverted_index": algorithms.inverted_index_graph,
+        "pmi": algorithms.pmi_graph,
+    }
+    for name, make_graph in graphs.items():
+        graph = make_graph("docs")
+        elapsed, rows = best(lambda: sum(1 for _ in graph.run(docs=lambda: iter(docs))))
+        print(f"{name:>14}: {elapsed:6.2f}s, {rows} rows")
+
+    words = sorted(({"doc_id": doc["doc_id"], "text": word} for doc in docs for word in doc["text"].split()),
+                   key=lambda row: (row["text"], row["doc_id"]))
+    reduce = ops.Reduce(ops.Count("count"), ["text", "doc_id"])
+    elapsed, rows = best(lambda: sum(1 for _ in reduce(iter(words))))
+    print(f"{'reduce':>14}: {elapsed:6.2f}s, {rows} rows")
+    join = ops.Join(ops.InnerJoiner(), ["text", "doc_id"])
+    elapsed, rows = best(lambda: sum(1 for _ in join(iter(words), reduce(iter(words)))))
+    print(f"{'join':>14}: {elapsed:6.2f}s, {rows} rows")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DOCS)
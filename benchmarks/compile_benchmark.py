@@ -0,0 +1,24 @@
+"""Latency of many runs of word count graph over small documents: graph run vs compiled plan run"""
+import sys
+import time
+
+from compgraph import algorithms
+
+RUNS = 200
+TEXT = "Hello, little World! The quick brown fox jumps over the lazy dog; don't panic..."
+
+
+def main(n: int) -> None:
+    docs = [{"doc_id": 1, "text": TEXT}]
+    graph = algorithms.word_count_graph("docs")
+    plan = graph.compile()
+    for name, run in [("graph run", graph.run), ("compiled run", plan.run)]:
+        start = time.perf_counter()
+        for _ in range(n):
+            list(run(docs=lambda: iter(docs)))
+        elapsed = time.perf_counter() - start
+        print(f"{name:>12}: {elapsed / n * 1e3:8.3f} ms per run ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else RUNS)
@@ -0,0 +1,40 @@
+"""Word count of generated file by one process vs several workers shuffling rows over TCP"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+from compgraph import algorithms
+from compgraph.distributed import run_distributed
+
+DOCS = 20000
+WORDS = ["hello", "little", "world", "quick", "brown", "fox", "jumps", "over", "lazy", "dog"]
+
+
+def make_file(path: str, n: int) -> None:
+    with open(path, "w") as f:
+        for i in range(n):
+            text = " ".join(f"{WORDS[(i * j) % len(WORDS)]}{j % 97}" for j in range(20))
+            f.write(json.dumps({"doc_id": i, "text": text}) + "\n")
+
+
+def main(n: int, workers: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "docs.jsonl")
+        make_file(path, n)
+        graph = algorithms.word_count_graph(path, "text", "count", json.loads)
+
+        start = time.perf_counter()
+        expected = list(graph.run())
+        print(f"{'local':>10}: {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        result = list(run_distributed(graph, workers=workers))
+        print(f"{workers:>2} workers: {time.perf_counter() - start:.2f}s")
+        assert result == expected
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DOCS,
+         int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 2)
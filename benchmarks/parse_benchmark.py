@@ -0,0 +1,37 @@
+"""Throughput of reading JSON lines file: plain reads, reads ahead by background thread, pool of parse workers"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+from compgraph.graph import Graph
+
+ROWS = 200000
+
+
+def make_file(path: str, n: int) -> None:
+    with open(path, "w") as f:
+        for i in range(n):
+            row = {"doc_id": i, "text": "Hello, little World! The quick brown fox jumps over the lazy dog",
+                   "tags": [f"tag{j}" for j in range(i % 8)], "score": i / 7}
+            f.write(json.dumps(row) + "\n")
+
+
+def main(n: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "rows.jsonl")
+        make_file(path, n)
+        start = time.perf_counter()
+        rows = sum(1 for _ in Graph.graph_from_file(path, json.loads, read_ahead=8).run())
+        elapsed = time.perf_counter() - start
+        print(f"read ahead     : {rows / elapsed:12.0f} rows/s ({elapsed:.2f}s)")
+        for workers in [1, 2, 4]:
+            start = time.perf_counter()
+            rows = sum(1 for _ in Graph.graph_from_file(path, json.loads, parse_workers=workers).run())
+            elapsed = time.perf_counter() - start
+            print(f"{workers} parse workers: {rows / elapsed:12.0f} rows/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
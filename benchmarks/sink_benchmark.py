@@ -0,0 +1,41 @@
+"""Throughput of writing result rows: print of every row vs buffered sinks, plain, compressed and sharded"""
+import os
+import sys
+import tempfile
+import time
+
+from compgraph import operations as ops
+from compgraph.graph import Graph
+
+ROWS = 200000
+
+
+def make_rows(n: int) -> ops.TRowsGenerator:
+    for i in range(n):
+        yield {"doc_id": i, "text": f"word{i % 1000}", "tf_idf": i / 7}
+
+
+def print_rows(graph: Graph, path: str, n: int) -> None:
+    with open(path, "w") as out:
+        for row in graph.run(rows=lambda: make_rows(n)):
+            print(row, file=out)
+
+
+def main(n: int) -> None:
+    graph = Graph.graph_from_iter("rows")
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        print_rows(graph, os.path.join(directory, "print.txt"), n)
+        elapsed = time.perf_counter() - start
+        print(f"{'print':>14}: {n / elapsed:12.0f} rows/s ({elapsed:.2f}s)")
+
+        for name, shards in [("out.jsonl", 1), ("out.csv", 1), ("out.jsonl.gz", 1), ("out-{shard}.jsonl.gz", 4)]:
+            start = time.perf_counter()
+            stats = graph.write_to_file(os.path.join(directory, name), shards=shards, rows=lambda: make_rows(n))
+            elapsed = time.perf_counter() - start
+            print(f"{name:>14}: {stats.rows / elapsed:12.0f} rows/s ({elapsed:.2f}s), "
+                  f"{stats.bytes / 2 ** 20:.1f} MiB serialized, {stats.file_bytes / 2 ** 20:.1f} MiB on disk")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
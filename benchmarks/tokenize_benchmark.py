@@ -0,0 +1,43 @@
+"""Throughput of text tokenization: FilterPunctuation, LowerCase and Split chain vs single Tokenize"""
+import sys
+import time
+import typing as tp
+
+from compgraph import operations as ops
+from compgraph.graph import Graph
+
+ROWS = 50000
+TEXT = "Hello, little World! The quick brown fox jumps over the lazy dog; don't panic..."
+
+
+def make_rows(n: int) -> ops.TRowsGenerator:
+    for i in range(n):
+        yield {"doc_id": i, "title": f"document {i}", "text": TEXT}
+
+
+def chain_graph() -> Graph:
+    return Graph.graph_from_iter("docs") \
+        .map(ops.FilterPunctuation("text")) \
+        .map(ops.LowerCase("text")) \
+        .map(ops.Split("text"))
+
+
+def tokenize_graph() -> Graph:
+    return Graph.graph_from_iter("docs").map(ops.Tokenize("text", ["doc_id"]))
+
+
+def bench(graph: Graph, n: int) -> tuple[float, int]:
+    start = time.perf_counter()
+    tokens = sum(1 for _ in graph.run(docs=lambda: make_rows(n)))
+    return time.perf_counter() - start, tokens
+
+
+def main(n: int) -> None:
+    graphs: dict[str, tp.Callable[[], Graph]] = {"chain": chain_graph, "tokenize": tokenize_graph}
+    for name, make_graph in graphs.items():
+        elapsed, tokens = bench(make_graph(), n)
+        print(f"{name:>8}: {n / elapsed:12.0f} rows/s, {tokens / elapsed:12.0f} tokens/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
@@ -0,0 +1,69 @@
+"""Throughput of row streaming to a child process: multiprocessing.Pipe vs shared memory ring"""
+import sys
+import time
+import typing as tp
+
+from multiprocessing import Pipe, Process, connection
+
+from compgraph import operations as ops
+from compgraph.shared_memory import RingBuffer, iter_rows, send_rows
+
+ROWS = 500000
+
+
+def make_rows(n: int) -> ops.TRowsGenerator:
+    for i in range(n):
+        yield {"doc_id": i, "text": "hello little world", "count": i % 17}
+
+
+def consume_pipe(endpoint: connection.Connection) -> None:
+    count = 0
+    while endpoint.recv() is not None:
+        count += 1
+    endpoint.send(count)
+
+
+def consume_ring(ring: RingBuffer, result: RingBuffer) -> None:
+    count = sum(1 for _ in iter_rows(ring))
+    send_rows(result, [{"count": count}])
+    ring.close()
+    result.close()
+
+
+def bench_pipe(n: int) -> float:
+    local_endpoint, remote_endpoint = Pipe()
+    process = Process(target=consume_pipe, args=(remote_endpoint,))
+    process.start()
+    start = time.perf_counter()
+    for row in make_rows(n):
+        local_endpoint.send(row)
+    local_endpoint.send(None)
+    assert local_endpoint.recv() == n
+    elapsed = time.perf_counter() - start
+    process.join()
+    return elapsed
+
+
+def bench_ring(n: int) -> float:
+    ring, result = RingBuffer(), RingBuffer()
+    process = Process(target=consume_ring, args=(ring, result))
+    process.start()
+    start = time.perf_counter()
+    send_rows(ring, make_rows(n))
+    assert list(iter_rows(result)) == [{"count": n}]
+    elapsed = time.perf_counter() - start
+    process.join()
+    ring.close()
+    result.close()
+    return elapsed
+
+
+def main(n: int) -> None:
+    benches: dict[str, tp.Callable[[int], float]] = {"pipe": bench_pipe, "shm": bench_ring}
+    for name, bench in benches.items():
+        elapsed = bench(n)
+        print(f"{name:>5}: {n / elapsed:12.0f} rows/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
@@ -1,5 +1,4 @@
 import math
-from copy import deepcopy
 import typing as tp
 from . import Graph, operations
 
@@ -28,15 +27,15 @@ def inverted_index_graph(input_stream_name: str, doc_column: str = "doc_id", tex
     else:
         graph = Graph.graph_from_iter(input_stream_name)
 
-    split_word = deepcopy(graph) \
+    split_word = graph \
         .map(operations.FilterPunctuation(text_column)) \
         .map(operations.LowerCase(text_column)) \
         .map(operations.Split(text_column))
 
-    count_docs = deepcopy(graph) \
+    count_docs = graph \
         .reduce(operations.Count("count_docs"), [])
 
-    count_idf = deepcopy(split_word) \
+    count_idf = split_word \
         .sort([text_column, doc_column]) \
         .reduce(operations.FirstReducer(), [text_column, doc_column]) \
         .sort([text_column]) \
@@ -46,7 +45,7 @@ def inverted_index_graph(input_stream_name: str, doc_column: str = "doc_id", tex
         .map(operations.Product(["words_count", "count_docs"], "idf")) \
         .map(operations.Function("idf", math.log))
 
-    tf = deepcopy(split_word) \
+    tf = split_word \
         .sort([doc_column]) \
         .reduce(operations.TermFrequency(text_column, "tf"), [doc_column]) \
         .sort([text_column])
@@ -76,10 +75,10 @@ def pmi_graph(input_stream_name: str, doc_column: str = "doc_id", text_column: s
     filtered = split_word \
         .sort([doc_column, text_column]) \
         .reduce(operations.Count("word_count"), [doc_column, text_column]) \
-        .map(operations.Filter(lambda row: len(row[text_column]) > 4)) \
-        .map(operations.Filter(lambda row: row["word_count"] >= 2))
+        .map(operations.Filter(lambda row: len(row[text_column]) > 4, [text_column])) \
+        .map(operations.Filter(lambda row: row["word_count"] >= 2, ["word_count"]))
 
-    tf_in_doc = deepcopy(filtered) \
+    tf_in_doc = filtered \
         .reduce(operations.TermFrequency(text_column, "tf_in_doc", "word_count"), [doc_column])
 
     tf_in_all_docs = filtered \
@@ -90,9 +89,7 @@ def pmi_graph(input_stream_name: str, doc_column: str = "doc_id", text_column: s
         .map(operations.Product(["tf_in_doc", "tf_in_all_docs"], result_column)) \
         .map(operations.Function(result_column, lambda x: math.log(x))) \
         .map(operations.Project([result_column, doc_column, text_column])) \
-        .sort([text_column]) \
-        .sort([result_column], reverse=True) \
-        .sort([doc_column]) \
+        .sort([doc_column, result_column, text_column], reverse=[False, True, False]) \
         .reduce(operations.TopN(result_column, 10), [doc_column])
 
     return pmi
@@ -126,3 +123,30 @@ def yandex_maps_graph(input_stream_name_time: str, input_stream_name_length: str
         .sort([weekday_result_column, hour_result_column])
 
     return average_speed
+
+
+def yandex_maps_window_graph(input_stream_name_time: str, input_stream_name_length: str,
+                             window_seconds: float = 3600, delay_seconds: float = 60,
+                             enter_time_column: str = "enter_time", leave_time_column: str = "leave_time",
+                             edge_id_column: str = "edge_id", start_coord_column: str = "start",
+                             end_coord_column: str = "end", speed_result_column: str = "speed",
+                             idle_timeout: float | None = None, *args: tp.Any) -> Graph:
+    """Constructs graph which measures average speed in km/h in windows of enter time without sorting,
+    so speeds are given while travel times keep coming (file of travel times is followed for new lines).
+    The whole table of edge lengths is kept in memory: joining with endless travel times can not fall back
+    to sorting them, so memory grows with number of edges, not with number of travel times"""
+
+    if args:
+        graph_time = Graph.graph_from_followed_file(input_stream_name_time, args[0], idle_timeout=idle_timeout)
+        graph_length = Graph.graph_from_file(input_stream_name_length, args[0])
+    else:
+        graph_time = Graph.graph_from_iter(input_stream_name_time)
+        graph_length = Graph.graph_from_iter(input_stream_name_length)
+
+    dist = graph_length \
+        .map(operations.HaversineDistance(start_coord_column, end_coord_column, "haversine"))
+
+    return graph_time \
+        .hash_join(operations.InnerJoiner(), dist, [edge_id_column], max_rows=None) \
+        .window(operations.AverageSpeed("haversine", enter_time_column, leave_time_column, speed_result_column),
+                enter_time_column, window_seconds, delay=delay_seconds, timestamp=operations.timestamp)
@@ -0,0 +1,318 @@
+"""
+Execution of graph by several worker processes exchanging rows over TCP.
+
+Coordinator splits source file into byte ranges and sends every worker its splits and plan fragments:
+operations up to the first grouping one (sort or reduce) run over splits, their rows are partitioned by
+hash of keys of that operation and shuffled between workers, the rest of operations runs over partition
+of every worker. Results are collected by coordinator and merged by keys of the final sort if there is one.
+Workers may run on other hosts: start them with "python -m compgraph.distributed HOST:PORT".
+Plan fragments are sent to every worker pickled, local processes included, so parser and all operations
+of graph must be picklable (functions of modules, not lambdas or local functions).
+"""
+import argparse
+import heapq
+import os
+import pickle
+import queue
+import socket
+import struct
+import threading
+import traceback
+import typing as tp
+from dataclasses import dataclass
+from itertools import chain, islice
+from multiprocessing import Process
+
+from . import operations as ops
+from .executor import Pipe
+from .external_sort import ExternalSort
+from .graph import Graph
+from .keys import key_encoder
+from .shared_memory import DEFAULT_BLOCK_ROWS
+from .sketches import stable_hash
+
+_LENGTH = struct.Struct("!Q")
+
+
+def _send(sock: socket.socket, message: tp.Any) -> None:
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_LENGTH.pack(len(payload)))
+    sock.sendall(payload)
+
+
+def _recv(stream: tp.BinaryIO) -> tp.Any:
+    header = stream.read(_LENGTH.size)
+    if len(header) < _LENGTH.size:
+        raise EOFError("Connection closed")
+    size = _LENGTH.unpack(header)[0]
+    payload = stream.read(size)
+    if len(payload) < size:
+        raise EOFError("Connection closed")
+    return pickle.loads(payload)
+
+
+def file_splits(filename: str, n: int) -> list[tuple[int, int]]:
+    """
+    :param filename: file to split
+    :param n: number of splits
+    :return: byte ranges of splits, lines belong to split they start in
+    """
+    size = os.path.getsize(filename)
+    bounds = [size * i // n for i in range(n + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def read_split(filename: str, parser: tp.Callable[[str], ops.TRow], start: int, end: int) -> ops.TRowsGenerator:
+    """
+    :param filename: file to read from
+    :param parser: parser from string to Row
+    :param start: first byte of split
+    :param end: byte after the last one of split
+    """
+    with open(filename, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield parser(line.decode())
+
+
+@dataclass
+class _Task:
+    """Plan fragments of one worker"""
+    index: int
+    peers: list[tuple[str, int]]
+    filename: str
+    parser: tp.Callable[[str], ops.TRow]
+    splits: list[tuple[int, int]]
+    prefix: list[ops.Operation]
+    partition_keys: tp.Sequence[str] | None
+    suffix: list[ops.Operation]
+    block_rows: int
+
+
+def _apply(operations: tp.Iterable[ops.Operation], rows: ops.TRowsIterable) -> ops.TRowsIterable:
+    for operation in operations:
+        rows = operation(rows)
+    return rows
+
+
+_Inbox = queue.Queue  # of row blocks, None when peer sent all rows, exception when peer failed
+
+
+def _receive(listener: socket.socket, peers: int, inbox: _Inbox) -> None:
+    def drain(connection: socket.socket) -> None:
+        with connection, connection.makefile("rb") as stream:
+            try:
+                while (block := _recv(stream)) is not None:
+                    inbox.put(block)
+            except EOFError:
+                inbox.put(ConnectionError("Worker stopped before sending all rows"))
+            else:
+                inbox.put(None)
+
+    for _ in range(peers):
+        connection, _ = listener.accept()
+        threading.Thread(target=drain, args=(connection,), daemon=True).start()
+
+
+def _shuffle(task: _Task, rows: ops.TRowsIterable, listener: socket.socket) -> ops.TRowsGenerator:
+    """Send rows to workers owning their partitions, yield rows of own partition got from all workers"""
+    n = len(task.peers)
+    # receivers drain sockets all the time, so sending never waits for own partition to be processed
+    inbox: _Inbox = queue.Queue()
+    threading.Thread(target=_receive, args=(listener, n, inbox), daemon=True).start()
+
+    get_key = ops.key_getter(task.partition_keys or ())
+    outgoing = [socket.create_connection(peer) for peer in task.peers]
+    try:
+        blocks: list[list[ops.TRow]] = [[] for _ in range(n)]
+        for row in rows:
+            worker = stable_hash(get_key(row)) % n
+            blocks[worker].append(row)
+            if len(blocks[worker]) >= task.block_rows:
+                _send(outgoing[worker], blocks[worker])
+                blocks[worker] = []
+        for connection, block in zip(outgoing, blocks):
+            if block:
+                _send(connection, block)
+            _send(connection, None)
+    finally:
+        for connection in outgoing:
+            connection.close()
+
+    finished = 0
+    while finished < n:
+        block = inbox.get()
+        if block is None:
+            finished += 1
+        elif isinstance(block, Exception):
+            raise block
+        else:
+            yield from block
+
+
+def _run_task(task: _Task, listener: socket.socket, control: socket.socket) -> int:
+    rows = _apply(task.prefix, chain.from_iterable(
+        read_split(task.filename, task.parser, start, end) for start, end in task.splits))
+    if task.partition_keys is not None:
+        rows = _apply(task.suffix, _shuffle(task, rows, listener))
+
+    count = 0
+    block: list[ops.TRow] = []
+    for row in rows:
+        block.append(row)
+        if len(block) >= task.block_rows:
+            _send(control, ("rows", block))
+            count += len(block)
+            block = []
+    if block:
+        _send(control, ("rows", block))
+        count += len(block)
+    return count
+
+
+def worker(coordinator: tuple[str, int]) -> None:
+    """
+    Connect to coordinator, run plan fragments it sends and send results back
+    :param coordinator: address of coordinator
+    """
+    with socket.create_connection(coordinator) as control, control.makefile("rb") as stream:
+        with socket.create_server((control.getsockname()[0], 0)) as listener:
+            _send(control, ("hello", listener.getsockname()[:2]))
+            task = _recv(stream)
+            try:
+                _send(control, ("done", _run_task(task, listener, control)))
+            except Exception:
+                _send(control, ("error", traceback.format_exc()))
+
+
+def _operations(graph: Graph) -> list[ops.Operation]:
+    stage = graph._to_stage({})
+    operations = [stage.operation]
+    while stage.inputs:
+        if len(stage.inputs) > 1:
+            raise ValueError("Only graphs without joins can be run distributed")
+        stage = stage.inputs[0]
+        operations.append(stage.operation)
+    return operations[::-1]
+
+
+def plan_fragments(graph: Graph) -> tuple[ops.Read, list[ops.Operation], tp.Sequence[str] | None,
+                                          list[ops.Operation]]:
+    """
+    Split graph into fragments run by workers
+    :param graph: graph reading file without joins, only row by row operations (maps) go before the first
+        grouping operation, every reduce after it has to group by its keys (or more), so groups don't cross partitions
+        Limit may go last only: every worker gives at most n rows, coordinator passes the first n of them
+    :return: source, operations before shuffle, keys to partition by (None if there is no shuffle),
+        operations after shuffle
+    """
+    source, *operations = _operations(graph)
+    if type(source) is not ops.Read:
+        raise ValueError("Distributed graph has to read file")
+    limit = operations.pop() if operations and isinstance(operations[-1], ops.Limit) else None
+
+    grouping = (ExternalSort, ops.Reduce, ops.HashReduce)
+    first = next((i for i, operation in enumerate(operations) if isinstance(operation, grouping)), len(operations))
+    prefix, suffix = operations[:first], operations[first:]
+    if not all(isinstance(operation, (ops.Map, Pipe)) for operation in prefix):
+        raise ValueError("Only maps can go before the first grouping operation, they run over splits of file")
+    if not suffix:
+        return source, (prefix + [limit] if limit is not None else prefix), None, []
+    if not all(isinstance(operation, (ops.Map, *grouping)) for operation in suffix):
+        raise ValueError("Only maps, sorts and reduces can go after the first grouping operation")
+
+    partition_keys = suffix[0].keys  # type: ignore[attr-defined]
+    for operation in suffix:
+        if isinstance(operation, (ops.Reduce, ops.HashReduce)) and not set(partition_keys) <= set(operation.keys):
+            raise ValueError(f"Reduce by {operation.keys} crosses partitions by {partition_keys}")
+    return source, prefix, partition_keys, (suffix + [limit] if limit is not None else suffix)
+
+
+def _results(stream: tp.BinaryIO) -> ops.TRowsGenerator:
+    while True:
+        kind, payload = _recv(stream)
+        if kind == "rows":
+            yield from payload
+        elif kind == "done":
+            return
+        else:
+            raise RuntimeError(f"Worker failed:\n{payload}")
+
+
+def run_distributed(graph: Graph, workers: int = 2, host: str = "127.0.0.1", port: int = 0, spawn: bool = True,
+                    splits_per_worker: int = 1, block_rows: int = DEFAULT_BLOCK_ROWS) -> ops.TRowsGenerator:
+    """
+    Run graph by several workers (see plan_fragments for graphs which can be run)
+    :param graph: graph to run
+    :param workers: number of workers
+    :param host: address to wait for workers at
+    :param port: port to wait for workers at, any free one if 0
+    :param spawn: start workers as local processes, otherwise wait for workers started elsewhere
+    :param splits_per_worker: number of source file splits every worker reads
+    :param block_rows: number of rows sent together
+    :return: result rows, ordered by keys of the final sort if graph ends with sort
+    """
+    source, prefix, partition_keys, suffix = plan_fragments(graph)
+    last = (suffix or prefix)[-1:]
+    limit = last[0].n if last and isinstance(last[0], ops.Limit) else None
+    ordering = [operation for operation in suffix if not isinstance(operation, ops.Limit)]
+    final_sort = ordering[-1] if ordering and isinstance(ordering[-1], ExternalSort) else None
+    try:
+        pickle.dumps((source.parser, prefix, suffix), protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise ValueError(f"Operations of distributed graph have to be picklable: {e}") from e
+
+    with socket.create_server((host, port)) as server:
+        processes = [Process(target=worker, args=(server.getsockname()[:2],)) for _ in range(workers if spawn else 0)]
+        for process in processes:
+            process.start()
+        connections: list[socket.socket] = []
+        try:
+            for _ in range(workers):
+                connections.append(server.accept()[0])
+            streams = [connection.makefile("rb") for connection in connections]
+            peers = [_recv(stream)[1] for stream in streams]
+
+            splits = file_splits(source.filename, workers * splits_per_worker)
+            for i, connection in enumerate(connections):
+                _send(connection, _Task(i, peers, source.filename, source.parser, splits[i::workers],
+                                        prefix, partition_keys, suffix, block_rows))
+
+            results = [_results(stream) for stream in streams]
+            merged: tp.Iterable[ops.TRow]
+            if final_sort is None:
+                merged = chain.from_iterable(results)
+            elif isinstance(final_sort.reverse, bool):
+                merged = heapq.merge(*results, key=ops.key_getter(final_sort.keys), reverse=final_sort.reverse)
+            else:
+                merged = heapq.merge(*results, key=key_encoder(final_sort.keys, final_sort.reverse))
+            if limit is not None:
+                # workers still sending rows past the first n are terminated below
+                yield from islice(merged, limit)
+                return
+            yield from merged
+            for process in processes:
+                process.join()
+        finally:
+            for connection in connections:
+                connection.close()
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+
+
+def _address(value: str) -> tuple[str, int]:
+    host, _, port = value.rpartition(":")
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run compgraph worker for coordinator at HOST:PORT")
+    parser.add_argument("coordinator", type=_address)
+    worker(parser.parse_args().coordinator)
@@ -0,0 +1,412 @@
+import copy
+import pickle
+import queue
+import tempfile
+import threading
+import typing as tp
+from collections import Counter, deque
+from dataclasses import dataclass, field
+
+from . import operations as ops
+from .external_sort import ExternalSort
+from .registry import REGISTRY
+
+FORK_BUFFER_ROWS = 100000
+PIPE_BATCH_ROWS = 256
+PIPE_DEPTH = 8
+PIPE_JOIN_SECONDS = 1.0
+
+
+@dataclass(eq=False)
+class Stage:
+    """Node of execution DAG: operation applied to streams of input stages"""
+    operation: ops.Operation
+    inputs: list["Stage"] = field(default_factory=list)
+
+
+def _operation_key(operation: ops.Operation) -> tp.Hashable:
+    """
+    Operations with equal keys applied to the same inputs give the same rows:
+    sources of the same data read the same way, the same mapper/reducer/joiner object with the same keys,
+    sorts by the same keys
+    """
+    if isinstance(operation, (ops.ReadIterFactory, ops.ReadAsyncIterFactory)):
+        return type(operation), operation.name
+    if isinstance(operation, ops.ReadFollow):
+        return (ops.ReadFollow, operation.filename, id(operation.parser), operation.poll_interval,
+                operation.idle_timeout)
+    if isinstance(operation, ops.ReadAhead):
+        return ops.ReadAhead, operation.filename, id(operation.parser), operation.block_bytes, operation.depth
+    if isinstance(operation, ops.ReadParallel):
+        return (ops.ReadParallel, operation.filename, id(operation.parser), operation.workers,
+                operation.block_lines, operation.read_ahead)
+    if type(operation) is ops.Read:
+        return ops.Read, operation.filename, id(operation.parser)
+    if isinstance(operation, ops.Map):
+        return ops.Map, id(operation.mapper)
+    if isinstance(operation, ops.Reduce):
+        return ops.Reduce, id(operation.reducer), tuple(operation.keys)
+    if isinstance(operation, ops.Join):
+        return ops.Join, id(operation.joiner), tuple(operation.keys)
+    if isinstance(operation, ExternalSort):
+        return ExternalSort, tuple(operation.keys), operation.reverse, operation.limit
+    return id(operation)
+
+
+def make_stage(operation: ops.Operation, inputs: list[Stage], stages: dict[tp.Hashable, Stage]) -> Stage:
+    """
+    Get stage for operation over inputs, reusing already built equal one
+    :param operation: operation of stage
+    :param inputs: input stages
+    :param stages: built stages by identity
+    """
+    key = (_operation_key(operation), tuple(id(stage) for stage in inputs))
+    if key not in stages:
+        stages[key] = Stage(operation, inputs)
+    return stages[key]
+
+
+class _SpillBuffer:
+    """FIFO of rows which keeps at most limit rows in memory and the rest in temporary file"""
+
+    def __init__(self, limit: int) -> None:
+        self._limit = limit
+        self._memory: deque[ops.TRow] = deque()
+        self._file: tp.IO[bytes] | None = None
+        self._read_position = 0
+        self._spilled = 0
+
+    def __bool__(self) -> bool:
+        return bool(self._memory) or self._spilled > 0
+
+    def push(self, row: ops.TRow) -> None:
+        if self._file is None and len(self._memory) < self._limit:
+            self._memory.append(row)
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+            self._read_position = 0
+        self._file.seek(0, 2)
+        data = pickle.dumps(row, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(data)
+        self._spilled += 1
+        REGISTRY.add_spill_bytes("fork", len(data))
+
+    def pop(self) -> ops.TRow:
+        if self._memory:
+            return self._memory.popleft()
+        assert self._file is not None
+        self._file.seek(self._read_position)
+        row = pickle.load(self._file)
+        self._read_position = self._file.tell()
+        self._spilled -= 1
+        if not self._spilled:
+            self._file.close()
+            self._file = None
+        return row
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Fork:
+    """
+    Feed one stream to several consumers reading it at their own pace.
+    Rows which one consumer is ahead by are buffered for the others (see _SpillBuffer),
+    every consumer but the one which pulled the row gets a copy of it, as mappers change rows in place
+    """
+
+    def __init__(self, rows: ops.TRowsIterable, consumers: int, buffer_rows: int = FORK_BUFFER_ROWS) -> None:
+        self._rows = iter(rows)
+        self._buffers = [_SpillBuffer(buffer_rows) for _ in range(consumers)]
+        self._given = 0
+        # consumers may run on different threads (see Pipe)
+        self._lock = threading.Lock()
+
+    def branch(self) -> ops.TRowsGenerator:
+        """Stream for next consumer"""
+        buffer = self._buffers[self._given]
+        self._given += 1
+        return self._branch(buffer)
+
+    def _branch(self, buffer: _SpillBuffer) -> ops.TRowsGenerator:
+        try:
+            while True:
+                with self._lock:
+                    if buffer:
+                        row = buffer.pop()
+                    else:
+                        row = next(self._rows, None)
+                        if row is None:
+                            return
+                        for other in self._buffers:
+                            if other is not buffer:
+                                other.push(row.copy())
+                yield row
+        finally:
+            with self._lock:
+                self._buffers.remove(buffer)
+                buffer.close()
+
+
+class Pipe(ops.Operation):
+    """
+    Pass rows through unchanged, computing them on separate thread: stages before pipe run on its thread
+    (up to other pipes), stages after it run on consumer thread. Rows go between threads in batches through
+    bounded queue, so producer waits when consumer lags behind. Error of either side stops the other one.
+    Closed consumer waits for producer at most PIPE_JOIN_SECONDS: producer blocked by stages before pipe
+    closes them as soon as they give the next row
+    """
+
+    _END = None
+
+    def __init__(self, batch_rows: int = PIPE_BATCH_ROWS, depth: int = PIPE_DEPTH) -> None:
+        """
+        :param batch_rows: number of rows passed together
+        :param depth: number of batches producer may be ahead by
+        """
+        self.batch_rows = batch_rows
+        self.depth = depth
+
+    def _produce(self, rows: ops.TRowsIterable, batches: queue.Queue[tp.Any], stopped: threading.Event) -> None:
+        def put(item: tp.Any) -> bool:
+            while not stopped.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        iterator = iter(rows)
+        try:
+            batch: list[ops.TRow] = []
+            for row in iterator:
+                if stopped.is_set():
+                    return
+                batch.append(row)
+                if len(batch) >= self.batch_rows:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch and not put(batch):
+                return
+            put(self._END)
+        except BaseException as e:
+            put(e)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        batches: queue.Queue[tp.Any] = queue.Queue(maxsize=self.depth)
+        REGISTRY.pipe_queues.add(batches)
+        stopped = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(rows, batches, stopped), daemon=True,
+                                    name="compgraph-pipe")
+        producer.start()
+        try:
+            while (batch := batches.get()) is not self._END:
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield from batch
+        finally:
+            stopped.set()
+            producer.join(PIPE_JOIN_SECONDS)
+
+
+def pipeline(outputs: tp.Mapping[str, Stage], threaded: tp.Callable[[Stage], bool],
+             batch_rows: int = PIPE_BATCH_ROWS, depth: int = PIPE_DEPTH) -> dict[str, Stage]:
+    """
+    Build DAG where output of chosen stages is computed on their own threads (see Pipe),
+    original stages are left intact
+    :param outputs: output stages by name
+    :param threaded: whether stage has to run on its own thread
+    :param batch_rows: see Pipe
+    :param depth: see Pipe
+    """
+    built: dict[Stage, Stage] = {}
+
+    def visit(stage: Stage) -> Stage:
+        if stage not in built:
+            new_stage = Stage(stage.operation, [visit(stage_input) for stage_input in stage.inputs])
+            if threaded(stage) and not isinstance(stage.operation, Pipe):
+                new_stage = Stage(Pipe(batch_rows, depth), [new_stage])
+            built[stage] = new_stage
+        return built[stage]
+
+    return {name: visit(stage) for name, stage in outputs.items()}
+
+
+def count_consumers(outputs: tp.Iterable[Stage]) -> Counter[Stage]:
+    consumers: Counter[Stage] = Counter()
+    visited: set[Stage] = set()
+    stack = list(outputs)
+    for stage in stack:
+        consumers[stage] += 1
+    while stack:
+        stage = stack.pop()
+        if stage in visited:
+            continue
+        visited.add(stage)
+        for stage_input in stage.inputs:
+            consumers[stage_input] += 1
+            stack.append(stage_input)
+    return consumers
+
+
+def execute(outputs: tp.Mapping[str, Stage], **kwargs: tp.Any) -> dict[str, ops.TRowsIterable]:
+    """
+    Build row streams for output stages so that every stage runs once,
+    streams of stages with several consumers are forked
+    :param outputs: output stages by name
+    :param kwargs: data sources
+    """
+    consumers = count_consumers(outputs.values())
+    forks: dict[Stage, Fork] = {}
+
+    def stream(stage: Stage) -> ops.TRowsIterable:
+        if stage in forks:
+            return forks[stage].branch()
+        if stage.inputs:
+            rows = stage.operation(*[stream(stage_input) for stage_input in stage.inputs])
+        else:
+            rows = stage.operation(**kwargs)
+        if consumers[stage] == 1:
+            return rows
+        forks[stage] = Fork(rows, consumers[stage])
+        return forks[stage].branch()
+
+    return {name: stream(stage) for name, stage in outputs.items()}
+
+
+def ordered_stages(outputs: tp.Iterable[Stage]) -> list[Stage]:
+    """
+    All stages of DAG, inputs go before stages consuming them
+    :param outputs: output stages
+    """
+    ordered: list[Stage] = []
+    visited: set[Stage] = set()
+
+    def visit(stage: Stage) -> None:
+        if stage not in visited:
+            visited.add(stage)
+            for stage_input in stage.inputs:
+                visit(stage_input)
+            ordered.append(stage)
+
+    for output in outputs:
+        visit(output)
+    return ordered
+
+
+class Plan:
+    """Execution DAG of graph prepared to run"""
+
+    def __init__(self, output: Stage, statistics_store: tp.Any = None, statistics_key: Stage | None = None) -> None:
+        """
+        :param output: stage which gives result rows
+        :param statistics_store: statistics.StatisticsStore to save statistics of stages collected while running
+        :param statistics_key: output stage of graph before optimization, statistics are saved under it
+            so that the next optimization of the same graph finds them; output if None
+        """
+        self.output = output
+        self.statistics_store = statistics_store
+        self.statistics_key = output if statistics_key is None else statistics_key
+
+    def stages(self) -> list[Stage]:
+        """All stages of plan, inputs go before stages consuming them"""
+        return ordered_stages([self.output])
+
+    def run(self, **kwargs: tp.Any) -> ops.TRowsIterable:
+        """Single method to start execution; data sources passed as kwargs"""
+        if self.statistics_store is not None:
+            return self._run_collecting(**kwargs)
+        return execute({"result": self.output}, **kwargs)["result"]
+
+    def _run_collecting(self, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        from .statistics import instrument
+        output, statistics = instrument(self.output)
+        yield from execute({"result": output}, **kwargs)["result"]
+        self.statistics_store.save(self.statistics_key, statistics)
+
+
+SMALL_SORT_ROWS = 10000
+
+_SOURCES = (ops.Read, ops.ReadIterFactory, ops.ReadAsyncIterFactory)
+_BINARY = (ops.Join, ops.HashJoin, ops.BloomSemiJoin)
+
+
+class CompiledPlan:
+    """
+    Execution DAG validated and wired once for many runs: stages are kept in order, inputs first, with indexes
+    of their inputs and numbers of their consumers, key extractors of operations are built beforehand,
+    so run only calls operations. Runs share no mutable state of plan, so one plan may run from several threads
+    at once
+    """
+
+    def __init__(self, outputs: tp.Mapping[str, Stage], sort_in_memory_rows: int = SMALL_SORT_ROWS) -> None:
+        """
+        :param outputs: output stages by name, the first one is result of run
+        :param sort_in_memory_rows: sorts of at most that many rows are done in place without starting process
+        """
+        copies: dict[Stage, Stage] = {}
+
+        def prepare(stage: Stage) -> Stage:
+            if stage not in copies:
+                operation = stage.operation
+                if isinstance(operation, ExternalSort) and not operation.in_memory_rows:
+                    operation = copy.copy(operation)
+                    operation.in_memory_rows = sort_in_memory_rows
+                copies[stage] = Stage(operation, [prepare(stage_input) for stage_input in stage.inputs])
+            return copies[stage]
+
+        roots = {name: prepare(stage) for name, stage in outputs.items()}
+        stages = ordered_stages(roots.values())
+        index = {stage: i for i, stage in enumerate(stages)}
+        consumers = count_consumers(roots.values())
+        for stage in stages:
+            _validate(stage)
+            keys = getattr(stage.operation, "keys", None)
+            if keys is not None:
+                ops.key_getter(keys)  # built once and shared by runs
+
+        self._operations = tuple(stage.operation for stage in stages)
+        self._inputs = tuple(tuple(index[stage_input] for stage_input in stage.inputs) for stage in stages)
+        self._consumers = tuple(consumers[stage] for stage in stages)
+        self._outputs = tuple((name, index[stage]) for name, stage in roots.items())
+        self.sources = frozenset(stage.operation.name for stage in stages
+                                 if isinstance(stage.operation, (ops.ReadIterFactory, ops.ReadAsyncIterFactory)))
+
+    def execute(self, **kwargs: tp.Any) -> dict[str, ops.TRowsIterable]:
+        """
+        Build row streams of all outputs; data sources passed as kwargs
+        """
+        missing = self.sources - kwargs.keys()
+        if missing:
+            raise ValueError(f"Data sources are not passed: {', '.join(sorted(missing))}")
+        streams: list[tp.Any] = []
+
+        def take(i: int) -> ops.TRowsIterable:
+            return streams[i].branch() if self._consumers[i] > 1 else streams[i]
+
+        for operation, inputs, consumers in zip(self._operations, self._inputs, self._consumers):
+            if inputs:
+                rows = operation(*[take(i) for i in inputs])
+            else:
+                rows = operation(**kwargs)
+            streams.append(Fork(rows, consumers) if consumers > 1 else rows)
+        return {name: take(i) for name, i in self._outputs}
+
+    def run(self, **kwargs: tp.Any) -> ops.TRowsIterable:
+        """Single method to start execution of the first output; data sources passed as kwargs"""
+        return self.execute(**kwargs)[self._outputs[0][0]]
+
+
+def _validate(stage: Stage) -> None:
+    operation = stage.operation
+    expected = 0 if isinstance(operation, _SOURCES) else 2 if isinstance(operation, _BINARY) else 1
+    if len(stage.inputs) != expected:
+        raise ValueError(f"{type(operation).__name__} needs {expected} inputs, got {len(stage.inputs)}")
@@ -1,50 +1,207 @@
+import heapq
 import typing as tp
 
+from bisect import bisect_right
+from itertools import chain, islice, takewhile
 from multiprocessing import Pipe, Process, connection
-from operator import itemgetter
 
 from . import operations as ops
+from .keys import directions, key_encoder, sort_rows
+from .registry import REGISTRY
+from .shared_memory import DEFAULT_BLOCK_ROWS, RingBuffer, iter_rows, send_rows, write_block
 
+SAMPLE_ROWS = 10000
 
-def do_sort(endpoint: connection.Connection, keys: tuple[str, ...], reverse: bool) -> None:
+
+def do_sort(endpoint: connection.Connection, keys: tuple[str, ...], reverse: bool | tuple[bool, ...]) -> None:
     rows = []
     while True:
         row = endpoint.recv()
         if row is None:
             break
         rows.append(row)
-    rows.sort(key=itemgetter(*keys), reverse=reverse)
+    sort_rows(rows, keys, reverse)
     for row in rows:
         endpoint.send(row)
     endpoint.send(None)
 
 
+def do_sort_shared(inbox: RingBuffer, outbox: RingBuffer, keys: tuple[str, ...],
+                   reverse: bool | tuple[bool, ...]) -> None:
+    rows = list(iter_rows(inbox))
+    sort_rows(rows, keys, reverse)
+    send_rows(outbox, rows)
+    inbox.close()
+    outbox.close()
+
+
 class ExternalSort(ops.Operation):
     """
     In order to not account materialization during sorting in main process memory consumption, we delegate
     sorting to a separate process.
     This class illustrates cross-process streaming.
+    Rows are either pickled one by one through multiprocessing.Pipe (transport="pipe") or
+    written in blocks to shared memory ring buffers (transport="shm").
+    With several workers rows are range partitioned between sorting processes by splitters chosen from
+    sample of first rows, outputs of workers are concatenated in order of their ranges (always through
+    shared memory). Rows with equal keys go to the same worker, so the sort stays stable.
+    Keys may have different directions, all of them are sorted by in one pass.
+    Input of at most in_memory_rows rows is sorted in place without starting process.
+    Sort with limit gives only the first limit rows, keeping no more than limit rows in memory
     """
 
-    def __init__(self, keys: tp.Sequence[str], reverse: bool):
+    def __init__(self, keys: tp.Sequence[str], reverse: bool | tp.Sequence[bool], transport: str = "pipe",
+                 workers: int = 1, sample_rows: int = SAMPLE_ROWS, in_memory_rows: int = 0,
+                 limit: int | None = None):
+        """
+        :param keys: sorting keys
+        :param reverse: reversed sort, either by all keys or by every key
+        :param transport: "pipe" or "shm", how rows are passed to sorting process
+        :param workers: number of sorting processes
+        :param sample_rows: number of first rows to choose ranges of workers by, smaller input is sorted in place
+        :param in_memory_rows: number of rows small enough to sort in place, input is always sent to process if 0
+        :param limit: number of first rows to give, all rows if None
+        """
+        if transport not in ("pipe", "shm"):
+            raise ValueError(f"Unknown transport {transport}")
+        if workers < 1:
+            raise ValueError("Number of workers must be positive")
         self.keys = keys
-        self.reverse = reverse
+        self.descending = tuple(directions(keys, reverse))
+        # the same direction of all keys is kept as one flag
+        self.reverse: bool | tuple[bool, ...] = self.descending if len(set(self.descending)) > 1 \
+            else self.descending[0] if self.descending else False
+        self.transport = transport
+        self.workers = workers
+        self.sample_rows = sample_rows
+        self.in_memory_rows = in_memory_rows
+        self.limit = limit
 
     def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        if self.limit is not None:
+            yield from self._top(rows)
+            return
+        if self.in_memory_rows:
+            rows = iter(rows)
+            head = list(islice(rows, self.in_memory_rows + 1))
+            if len(head) <= self.in_memory_rows:
+                sort_rows(head, self.keys, self.reverse)
+                yield from head
+                return
+            rows = chain(head, rows)
+        if self.workers > 1:
+            yield from self._sort_parallel(rows)
+            return
+        if self.transport == "shm":
+            yield from self._sort_shared(rows)
+            return
         local_endpoint, remote_endpoint = Pipe()
         process = Process(target=do_sort, args=(remote_endpoint, self.keys, self.reverse))
         process.start()
-        row_count_before = 0
-        for row in rows:
-            local_endpoint.send(row)
-            row_count_before += 1
-        local_endpoint.send(None)
-        row_count_after = 0
-        while True:
-            local_endpoint_row = local_endpoint.recv()
-            if local_endpoint_row is None:
-                break
-            yield local_endpoint_row
-            row_count_after += 1
-        assert row_count_before == row_count_after
-        process.join()
+        REGISTRY.add_sort_workers(1)
+        try:
+            row_count_before = 0
+            for row in rows:
+                local_endpoint.send(row)
+                row_count_before += 1
+            local_endpoint.send(None)
+            row_count_after = 0
+            while True:
+                local_endpoint_row = local_endpoint.recv()
+                if local_endpoint_row is None:
+                    break
+                yield local_endpoint_row
+                row_count_after += 1
+            assert row_count_before == row_count_after
+            process.join()
+        finally:
+            # consumer may stop reading early, sorting process would wait to send the rest forever
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            REGISTRY.add_sort_workers(-1)
+            local_endpoint.close()
+            remote_endpoint.close()
+
+    def _top(self, rows: ops.TRowsIterable) -> ops.TRowsGenerator:
+        # nsmallest and nlargest are stable, as sort is
+        assert self.limit is not None
+        if isinstance(self.reverse, bool):
+            select = heapq.nlargest if self.reverse else heapq.nsmallest
+            yield from select(self.limit, rows, key=ops.key_getter(self.keys))
+        else:
+            yield from heapq.nsmallest(self.limit, rows, key=key_encoder(self.keys, self.reverse))
+
+    def _sort_shared(self, rows: ops.TRowsIterable) -> ops.TRowsGenerator:
+        inbox, outbox = RingBuffer(), RingBuffer()
+        process = Process(target=do_sort_shared, args=(inbox, outbox, tuple(self.keys), self.reverse))
+        process.start()
+        REGISTRY.add_sort_workers(1)
+        try:
+            row_count_before = send_rows(inbox, rows)
+            row_count_after = 0
+            for row in iter_rows(outbox):
+                yield row
+                row_count_after += 1
+            assert row_count_before == row_count_after
+            process.join()
+        finally:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            REGISTRY.add_sort_workers(-1)
+            inbox.close()
+            outbox.close()
+
+    def _sort_parallel(self, rows: ops.TRowsIterable) -> ops.TRowsGenerator:
+        # ranges are taken by leading keys sorted in the same direction as the first one
+        leading = len(list(takewhile(lambda descending: descending == self.descending[0], self.descending)))
+        key = ops.key_getter(self.keys[:leading])
+        rows = iter(rows)
+        sample = list(islice(rows, self.sample_rows))
+        if len(sample) < self.sample_rows:
+            sort_rows(sample, self.keys, self.reverse)
+            yield from sample
+            return
+
+        sample_keys = sorted(map(key, sample))
+        splitters = [sample_keys[len(sample_keys) * i // self.workers] for i in range(1, self.workers)]
+        rings = [(RingBuffer(), RingBuffer()) for _ in range(self.workers)]
+        processes = [Process(target=do_sort_shared, args=(inbox, outbox, tuple(self.keys), self.reverse))
+                     for inbox, outbox in rings]
+        for process in processes:
+            process.start()
+        REGISTRY.add_sort_workers(len(processes))
+        try:
+            blocks: list[list[ops.TRow]] = [[] for _ in range(self.workers)]
+            row_count_before = 0
+            for row in chain(sample, rows):
+                worker = bisect_right(splitters, key(row))
+                block = blocks[worker]
+                block.append(row)
+                if len(block) >= DEFAULT_BLOCK_ROWS:
+                    write_block(rings[worker][0], block)
+                    blocks[worker] = []
+                row_count_before += 1
+            for (inbox, _), block in zip(rings, blocks):
+                if block:
+                    write_block(inbox, block)
+                inbox.close_writer()
+
+            row_count_after = 0
+            for _, outbox in reversed(rings) if self.descending[0] else rings:
+                for row in iter_rows(outbox):
+                    yield row
+                    row_count_after += 1
+            assert row_count_before == row_count_after
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            REGISTRY.add_sort_workers(-len(processes))
+            for inbox, outbox in rings:
+                inbox.close()
+                outbox.close()
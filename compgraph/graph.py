@@ -1,16 +1,102 @@
-from copy import deepcopy
+import asyncio
+import copy
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 import typing as tp
 
 from . import operations as ops
+from .executor import PIPE_BATCH_ROWS, PIPE_DEPTH, SMALL_SORT_ROWS, CompiledPlan, Pipe, Plan, Stage, execute, \
+    make_stage, pipeline
 from .external_sort import ExternalSort
+from .metrics import MetricsExporter
+from .optimizer import DEFAULT_MEMORY_ROWS, Planner
+from .sinks import SINK_BLOCK_ROWS, WriteStats, write_rows
+from .statistics import Estimate, StatisticsStore
+
+ASYNC_READ_AHEAD = 4096
+ASYNC_BATCH_SIZE = 256
+RUN_MANY_BATCH_SIZE = 1024
+
+
+class _AsyncSourceBridge:
+    """
+    Synchronous iterator over async source. Rows are read ahead on the event loop into bounded queue
+    while graph stages consume them on executor thread
+    """
+
+    _END = object()
+
+    def __init__(self, source: tp.AsyncIterator[ops.TRow], loop: asyncio.AbstractEventLoop) -> None:
+        self._source = source
+        self._queue: queue.Queue[tp.Any] = queue.Queue(maxsize=ASYNC_READ_AHEAD)
+        self._stopped = False
+        self._pump: Future[None] = asyncio.run_coroutine_threadsafe(self._read_ahead(), loop)
+
+    async def _put(self, item: tp.Any) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            await asyncio.to_thread(self._queue.put, item)
+
+    async def _read_ahead(self) -> None:
+        try:
+            async for row in self._source:
+                if self._stopped:
+                    break
+                await self._put(row)
+        except Exception as e:
+            await self._put(e)
+        else:
+            await self._put(self._END)
+
+    def __iter__(self) -> "_AsyncSourceBridge":
+        return self
+
+    def __next__(self) -> ops.TRow:
+        if self._stopped:
+            raise StopIteration
+        item = self._queue.get()
+        if item is self._END:
+            self._stopped = True
+            raise StopIteration
+        if isinstance(item, Exception):
+            self._stopped = True
+            raise item
+        return item
+
+    def close(self) -> None:
+        self._stopped = True
+        self._pump.cancel()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._queue.put_nowait(self._END)
+
+
+def _take(rows: tp.Iterator[ops.TRow], n: int) -> list[ops.TRow]:
+    return list(islice(rows, n))
 
 
 class Graph:
-    """Computational graph implementation"""
+    """
+    Computational graph implementation.
+    Every graph is a node holding one operation and pointing at the graph it extends,
+    so builder methods return new graphs and branches share their common prefix
+    """
 
-    def __init__(self) -> None:
-        self.__operations: list["ops.Operation"] = []
-        self.__graphs_for_join: list["Graph"] = []
+    def __init__(self, operation: ops.Operation | None = None, parent: tp.Optional["Graph"] = None,
+                 join_graph: tp.Optional["Graph"] = None) -> None:
+        """
+        :param operation: last operation of graph
+        :param parent: graph which rows operation is applied to
+        :param join_graph: graph which rows are the second input of join operation
+        """
+        self.__operation = operation
+        self.__parent = parent
+        self.__join_graph = join_graph
 
     @staticmethod
     def graph_from_iter(name: str) -> "Graph":
@@ -19,43 +105,111 @@ class Graph:
         Use ops.ReadIterFactory
         :param name: name of kwarg to use as data source
         """
-        graph = Graph()
-        graph.__operations = [deepcopy(ops.ReadIterFactory(name))]
-        return graph
+        return Graph(ops.ReadIterFactory(name))
+
+    @staticmethod
+    def graph_from_async_iter(name: str) -> "Graph":
+        """Construct new graph which reads data from async row iterator (in form of async generator
+        from "kwargs" passed to "arun" or "run" method) into graph data-flow
+        Use ops.ReadAsyncIterFactory
+        :param name: name of kwarg to use as data source
+        """
+        return Graph(ops.ReadAsyncIterFactory(name))
 
     @staticmethod
-    def graph_from_file(filename: str, parser: tp.Callable[[str], ops.TRow]) -> "Graph":
+    def graph_from_file(filename: str, parser: tp.Callable[[str], ops.TRow], parse_workers: int = 1,
+                        read_ahead: int = 0) -> "Graph":
         """Construct new graph extended with operation for reading rows from file
-        Use ops.Read
+        Use ops.Read, ops.ReadParallel if there are several parse workers or ops.ReadAhead if blocks are read ahead
+        :param filename: filename to read from
+        :param parser: parser from string to Row
+        :param parse_workers: number of processes parsing lines, parser has to be picklable if more than 1
+        :param read_ahead: number of blocks read ahead by background thread, no thread if 0
+        """
+        if parse_workers > 1 and read_ahead:
+            raise ValueError("Blocks are read ahead by parse workers already")
+        if read_ahead:
+            return Graph(ops.ReadAhead(filename, parser, depth=read_ahead))
+        if parse_workers > 1:
+            return Graph(ops.ReadParallel(filename, parser, parse_workers))
+        return Graph(ops.Read(filename, parser))
+
+    @staticmethod
+    def graph_from_followed_file(filename: str, parser: tp.Callable[[str], ops.TRow], poll_interval: float = 0.5,
+                                 idle_timeout: float | None = None) -> "Graph":
+        """Construct new graph reading rows from file which keeps growing, waiting for new lines at its end
+        Use ops.ReadFollow
         :param filename: filename to read from
         :param parser: parser from string to Row
+        :param poll_interval: seconds to wait before checking file for new lines
+        :param idle_timeout: stop after that many seconds without new lines, never stop if None
         """
-        graph = Graph()
-        graph.__operations = [deepcopy(ops.Read(filename, parser))]
-        return graph
+        return Graph(ops.ReadFollow(filename, parser, poll_interval, idle_timeout))
 
     def map(self, mapper: ops.Mapper) -> "Graph":
         """Construct new graph extended with map operation with particular mapper
         :param mapper: mapper to use
         """
-        self.__operations.append(ops.Map(mapper=mapper))
-        return self
+        return Graph(ops.Map(mapper=mapper), self)
 
     def reduce(self, reducer: ops.Reducer, keys: tp.Sequence[str]) -> "Graph":
         """Construct new graph extended with reduce operation with particular reducer
         :param reducer: reducer to use
         :param keys: keys for grouping
         """
-        self.__operations.append(ops.Reduce(keys=keys, reducer=reducer))
-        return self
+        return Graph(ops.Reduce(keys=keys, reducer=reducer), self)
+
+    def aggregate(self, reducer: ops.Aggregator, keys: tp.Sequence[str],
+                  max_groups: int = DEFAULT_MEMORY_ROWS) -> "Graph":
+        """Construct new graph extended with reduce operation which needs no sort (see ops.HashReduce)
+        :param reducer: aggregator to use
+        :param keys: keys for grouping
+        :param max_groups: number of groups to keep in memory, the rest is aggregated by sorting
+        """
+        return Graph(ops.HashReduce(reducer=reducer, keys=keys, max_groups=max_groups), self)
+
+    def window(self, reducer: ops.Aggregator, time_column: str, size: float, slide: float | None = None,
+               keys: tp.Sequence[str] = (), delay: float = 0, allowed_lateness: float = 0,
+               timestamp: tp.Callable[[tp.Any], float] | None = None) -> "Graph":
+        """Construct new graph extended with aggregation by event time windows which needs no sort (see ops.Window)
+        :param reducer: aggregator to use
+        :param time_column: column with event time
+        :param size: window length
+        :param slide: distance between starts of consecutive windows, size by default
+        :param keys: keys for grouping inside window
+        :param delay: how far event time of rows may go back without them being late
+        :param allowed_lateness: how long window is updated by late rows after its result is emitted
+        :param timestamp: function of time column value giving event time as number, value itself by default
+        """
+        return Graph(ops.Window(reducer, time_column, size, slide, keys, delay, allowed_lateness, timestamp), self)
 
-    def sort(self, keys: tp.Sequence[str], reverse: bool = False) -> "Graph":
+    def sort(self, keys: tp.Sequence[str], reverse: bool | tp.Sequence[bool] = False, workers: int = 1) -> "Graph":
         """Construct new graph extended with sort operation
         :param keys: sorting keys (typical is tuple of strings)
-        :param reverse: reversed sort
+        :param reverse: reversed sort, either by all keys or by every key (e.g. [False, True])
+        :param workers: number of processes to sort ranges of keys in parallel
         """
-        self.__operations.append(ExternalSort(keys=keys, reverse=reverse))
-        return self
+        return Graph(ExternalSort(keys=keys, reverse=reverse, workers=workers), self)
+
+    def thread(self, batch_rows: int = PIPE_BATCH_ROWS, depth: int = PIPE_DEPTH) -> "Graph":
+        """Construct new graph whose operations so far run on their own thread, pipelined with the following ones
+        Use executor.Pipe
+        :param batch_rows: number of rows passed between threads together
+        :param depth: number of batches the thread may compute ahead
+        """
+        return Graph(Pipe(batch_rows, depth), self)
+
+    def limit(self, n: int) -> "Graph":
+        """Construct new graph extended with operation passing only the first n rows and stopping computation
+        of the rest (see ops.Limit). Sort right before limit becomes top-n sort keeping only n rows in memory
+        :param n: number of rows to pass
+        """
+        operation = self.__operation
+        if isinstance(operation, ExternalSort):
+            sort = copy.copy(operation)
+            sort.limit = n if operation.limit is None else min(n, operation.limit)
+            return Graph(ops.Limit(n), Graph(sort, self.__parent))
+        return Graph(ops.Limit(n), self)
 
     def join(self, joiner: ops.Joiner, join_graph: "Graph", keys: tp.Sequence[str]) -> "Graph":
         """Construct new graph extended with join operation with another graph
@@ -63,22 +217,161 @@ class Graph:
         :param join_graph: other graph to join with
         :param keys: keys for grouping
         """
-        self.__operations.append(ops.Join(joiner=joiner, keys=keys))
-        self.__graphs_for_join.append(join_graph)
-        return self
+        return Graph(ops.Join(joiner=joiner, keys=keys), self, join_graph)
+
+    def hash_join(self, joiner: ops.Joiner, join_graph: "Graph", keys: tp.Sequence[str], build: str = "right",
+                  max_rows: int | None = DEFAULT_MEMORY_ROWS) -> "Graph":
+        """Construct new graph extended with join operation which needs no sort of inputs (see ops.HashJoin)
+        :param joiner: join strategy to use
+        :param join_graph: other graph to join with
+        :param keys: keys for grouping
+        :param build: which side to keep in memory, "left" or "right"
+        :param max_rows: number of build rows to keep in memory, both sides are sorted if there are more;
+            all of them are kept if None
+        """
+        return Graph(ops.HashJoin(joiner=joiner, keys=keys, build=build, max_rows=max_rows), self, join_graph)
 
     def run(self, **kwargs: tp.Any) -> ops.TRowsIterable:
-        """Single method to start execution; data sources passed as kwargs"""
-        operations = iter(self.__operations)
-        graph = next(operations)(**kwargs)
-        i = 0
-        for operation in operations:
-            if type(operation) == ops.Join:
-                if len(self.__graphs_for_join):
-                    table = self.__graphs_for_join[i].run(**kwargs)
-                    graph = operation(graph, table)
-                    i += 1
-            else:
-                graph = operation(graph)
-
-        return graph
+        """Single method to start execution; data sources passed as kwargs.
+        Common prefix of joined branches is executed once
+        """
+        return execute({"result": self._to_stage({})}, **kwargs)["result"]
+
+    def write_to_file(self, filename: str, format: str | None = None, compression: str | None = None,
+                      shards: int = 1, columns: tp.Sequence[str] | None = None,
+                      block_rows: int = SINK_BLOCK_ROWS, **kwargs: tp.Any) -> WriteStats:
+        """Run graph and write result rows to file (see sinks.write_rows); data sources passed as kwargs
+        :param filename: name of output file, "{shard}" in it is replaced with shard number
+        :param format: "jsonl" or "csv", by extension of filename if None
+        :param compression: "gzip", "bz2" or "xz", by extension of filename if None
+        :param shards: number of files to write in parallel
+        :param columns: columns to write
+        :param block_rows: number of rows serialized together
+        :return: numbers of rows and bytes written
+        """
+        return write_rows(self.run(**kwargs), filename, format, compression, shards, columns, block_rows)
+
+    def compile(self, sort_in_memory_rows: int = SMALL_SORT_ROWS) -> CompiledPlan:
+        """Construct plan which is validated and wired once and then run many times, also concurrently
+        (see executor.CompiledPlan); run it the same way as graph
+        :param sort_in_memory_rows: sorts of at most that many rows are done in place without starting process
+        """
+        return CompiledPlan({"result": self._to_stage({})}, sort_in_memory_rows)
+
+    def pipelined(self, threaded: tp.Callable[[Stage], bool], batch_rows: int = PIPE_BATCH_ROWS,
+                  depth: int = PIPE_DEPTH) -> Plan:
+        """Construct execution plan where output of chosen stages is computed on their own threads
+        (see executor.pipeline); run it the same way as graph
+        :param threaded: whether stage has to run on its own thread
+        :param batch_rows: number of rows passed between threads together
+        :param depth: number of batches a thread may compute ahead
+        """
+        return Plan(pipeline({"result": self._to_stage({})}, threaded, batch_rows, depth)["result"])
+
+    def run_with_metrics(self, exporter: MetricsExporter, **kwargs: tp.Any) -> ops.TRowsIterable:
+        """Start execution publishing rows and rates of every stage by exporter (see metrics.MetricsExporter);
+        data sources passed as kwargs
+        :param exporter: exporter to publish metrics by; it publishes them only while it is started,
+            so start it beforehand and stop it when done, e.g. by "with MetricsExporter(port=...) as exporter:"
+        """
+        return exporter.run(self, **kwargs)
+
+    def _to_stage(self, stages: dict[tp.Hashable, Stage]) -> Stage:
+        """Convert graph to execution DAG, stages equal to already built ones are shared"""
+        chain: list[Graph] = []
+        graph: Graph | None = self
+        while graph is not None:
+            chain.append(graph)
+            graph = graph.__parent
+
+        stage: Stage | None = None
+        for graph in reversed(chain):
+            if graph.__operation is None:
+                continue
+            inputs = [] if stage is None else [stage]
+            if graph.__join_graph is not None:
+                inputs.append(graph.__join_graph._to_stage(stages))
+            stage = make_stage(graph.__operation, inputs, stages)
+        if stage is None:
+            raise ValueError("Graph has no operations")
+        return stage
+
+    def optimize(self, size_hints: tp.Mapping[str, int] | None = None,
+                 statistics: tp.Mapping[str, Estimate] | None = None,
+                 memory_rows: int = DEFAULT_MEMORY_ROWS,
+                 statistics_store: StatisticsStore | None = None) -> Plan:
+        """Construct execution plan with join and aggregation strategies chosen by expected input sizes
+        (see optimizer.Planner); run it the same way as graph
+        :param size_hints: number of rows by source name (kwarg name or filename)
+        :param statistics: estimates by source name, override size hints
+        :param memory_rows: number of rows hash operations are allowed to keep in memory
+        :param statistics_store: plan with statistics of previous runs from store and collect them while running
+        """
+        output = self._to_stage({})
+        stage_statistics = statistics_store.load(output) if statistics_store is not None else None
+        planner = Planner(size_hints, statistics, memory_rows, stage_statistics)
+        return Plan(planner.optimize({"result": output})["result"], statistics_store, output)
+
+    @staticmethod
+    def run_many(outputs: tp.Mapping[str, "Graph"],
+                 sinks: tp.Mapping[str, tp.Callable[[ops.TRow], tp.Any]] | None = None,
+                 planner: Planner | None = None, /,
+                 **kwargs: tp.Any) -> dict[str, list[ops.TRow]]:
+        """Run several graphs together in one pass over their inputs; data sources passed as kwargs.
+        Stages shared by graphs (same data sources, same operation objects over them) are executed once
+        :param outputs: graphs by output name
+        :param sinks: functions called with every result row of output by its name
+        :param planner: planner to optimize execution with
+        :return: result rows of outputs without sink
+        """
+        sinks = sinks or {}
+        stages: dict[tp.Hashable, Stage] = {}
+        outputs_stages = {name: graph._to_stage(stages) for name, graph in outputs.items()}
+        if planner is not None:
+            outputs_stages = planner.optimize(outputs_stages)
+        streams = execute(outputs_stages, **kwargs)
+
+        results: dict[str, list[ops.TRow]] = {name: [] for name in outputs if name not in sinks}
+        writers = {name: sinks[name] if name in sinks else results[name].append for name in outputs}
+        active = {name: iter(rows) for name, rows in streams.items()}
+        while active:
+            for name, rows in list(active.items()):
+                batch = _take(rows, RUN_MANY_BATCH_SIZE)
+                if len(batch) < RUN_MANY_BATCH_SIZE:
+                    del active[name]
+                write = writers[name]
+                for row in batch:
+                    write(row)
+        return results
+
+    async def arun(self, **kwargs: tp.Any) -> tp.AsyncIterator[ops.TRow]:
+        """Start execution without blocking event loop; data sources passed as kwargs.
+        Async sources are read ahead on the loop while graph stages run in executor thread,
+        result rows are passed back in batches
+        """
+        loop = asyncio.get_running_loop()
+        bridges: list[_AsyncSourceBridge] = []
+
+        def bridged(factory: tp.Callable[[], tp.Any]) -> tp.Callable[[], tp.Any]:
+            def source() -> tp.Any:
+                rows = factory()
+                if hasattr(rows, "__anext__"):
+                    rows = _AsyncSourceBridge(rows, loop)
+                    bridges.append(rows)
+                return rows
+            return source
+
+        sources = {name: bridged(value) if callable(value) else value for name, value in kwargs.items()}
+        # generators must be driven by one thread at a time
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compgraph")
+        rows = await loop.run_in_executor(executor, lambda: iter(self.run(**sources)))
+        try:
+            while batch := await loop.run_in_executor(executor, _take, rows, ASYNC_BATCH_SIZE):
+                for row in batch:
+                    yield row
+        finally:
+            for bridge in bridges:
+                bridge.close()
+            if hasattr(rows, "close"):
+                await loop.run_in_executor(executor, rows.close)
+            executor.shutdown(wait=False)
@@ -0,0 +1,127 @@
+import struct
+import typing as tp
+from itertools import groupby
+from operator import itemgetter
+
+from . import operations as ops
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None  # type: ignore[assignment]
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+_NONE, _NUMBER, _STR, _BYTES = b"\x00", b"\x01", b"\x02", b"\x03"
+_DOUBLE = struct.Struct(">d")
+_UINT64 = struct.Struct(">Q")
+_SIGN = 1 << 63
+_MASK = (1 << 64) - 1
+_INVERT = bytes(range(255, -1, -1))
+
+
+def _encode_number(value: int | float) -> bytes:
+    as_float = float(value) if value != 0 else 0.0
+    bits = _UINT64.unpack(_DOUBLE.pack(as_float))[0]
+    bits = bits ^ _MASK if bits & _SIGN else bits | _SIGN
+    # integers which don't fit into double keep the rest of their value after the rounded one
+    rest = value - int(as_float) if isinstance(value, int) else 0
+    return _NUMBER + _UINT64.pack(bits) + _UINT64.pack(rest + _SIGN)
+
+
+def _escape(data: bytes) -> bytes:
+    return data.replace(b"\x00", b"\x00\xff") + b"\x00\x00"
+
+
+def encode_value(value: tp.Any) -> bytes:
+    """
+    Byte string which compares as value does: numbers with numbers, strings with strings.
+    None goes before numbers, numbers before strings, strings before bytes.
+    Encodings are prefix free, so concatenated encodings compare as tuples of values
+    :param value: None, bool, int, float, str or bytes
+    """
+    if value is None:
+        return _NONE
+    if isinstance(value, (int, float)):
+        return _encode_number(value)
+    if isinstance(value, str):
+        return _STR + _escape(value.encode("utf-8", "surrogatepass"))
+    if isinstance(value, bytes):
+        return _BYTES + _escape(value)
+    raise TypeError(f"Can not encode sort key of type {type(value).__name__}")
+
+
+def encode_key(values: tp.Iterable[tp.Any]) -> bytes:
+    """
+    Order preserving encoding of tuple of values (see encode_value)
+    :param values: values of key columns
+    """
+    return b"".join(map(encode_value, values))
+
+
+def key_encoder(keys: tp.Sequence[str], reverse: bool | tp.Sequence[bool] = False) -> tp.Callable[[ops.TRow], bytes]:
+    """
+    :param keys: key columns
+    :param reverse: descending order of all keys or of every key, bytes of descending keys are inverted
+    :return: function giving encoded key of row, encoded keys of rows compare in sort order
+    """
+    getters = [itemgetter(key) for key in keys]
+    descending = directions(keys, reverse)
+    if not any(descending):
+        return lambda row: b"".join([encode_value(getter(row)) for getter in getters])
+    parts = list(zip(getters, descending))
+    return lambda row: b"".join([encode_value(getter(row)).translate(_INVERT) if desc else encode_value(getter(row))
+                                 for getter, desc in parts])
+
+
+def _int64_columns(rows: list[ops.TRow], keys: tp.Sequence[str]) -> list[list[int]] | None:
+    columns = []
+    for key in keys:
+        column = [row[key] for row in rows]
+        if not all(type(value) is int and INT64_MIN <= value <= INT64_MAX for value in column):
+            return None
+        columns.append(column)
+    return columns
+
+
+def directions(keys: tp.Sequence[str], reverse: bool | tp.Sequence[bool]) -> list[bool]:
+    """
+    :param keys: key columns
+    :param reverse: descending order of all keys or of every key
+    :return: whether order is descending for every key
+    """
+    if isinstance(reverse, bool):
+        return [reverse] * len(keys)
+    if len(reverse) != len(keys):
+        raise ValueError("Sort direction must be given for every key")
+    return list(reverse)
+
+
+def sort_rows(rows: list[ops.TRow], keys: tp.Sequence[str], reverse: bool | tp.Sequence[bool] = False) -> None:
+    """
+    Stable in place sort of rows by keys.
+    Several keys which are all 64-bit integers are sorted as numpy arrays by stable lexsort if numpy
+    is installed. Other keys are compared as tuples of values: for a single key or keys of other types
+    this is faster than encoding them in python. Keys with different directions are sorted by stable
+    sorts of runs of keys with the same direction, the least significant run first
+    :param rows: rows to sort
+    :param keys: key columns
+    :param reverse: descending order of all keys or of every key
+    """
+    descending = directions(keys, reverse)
+    columns = _int64_columns(rows, keys) if np is not None and len(keys) > 1 and len(rows) > 1 else None
+    if columns is None:
+        runs, start = [], 0
+        for run_descending, run in groupby(descending):
+            end = start + len(list(run))
+            runs.append((keys[start:end], run_descending))
+            start = end
+        for run_keys, run_descending in reversed(runs):
+            rows.sort(key=ops.key_getter(run_keys), reverse=run_descending)
+        return
+    # lexsort sorts by the last key first; bitwise not reverses order of signed integers
+    arrays = [~array if desc else array
+              for array, desc in zip((np.array(column, dtype=np.int64) for column in columns), descending)]
+    order = np.lexsort(arrays[::-1])
+    rows[:] = [rows[i] for i in order.tolist()]
@@ -0,0 +1,283 @@
+"""
+Live metrics of graph runs: rows produced by every stage and their rate, rows waiting in pipe queues,
+bytes spilled to disk, running sort processes and time consumers waited for read-ahead files.
+MetricsExporter serves them over HTTP in Prometheus text format and/or writes JSON snapshots to file periodically
+"""
+import json
+import os
+import threading
+import time
+import typing as tp
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import operations as ops
+from .registry import REGISTRY, Registry
+
+if tp.TYPE_CHECKING:
+    from .executor import Stage
+    from .graph import Graph
+
+SNAPSHOT_INTERVAL = 5.0
+RUNS_KEPT = 16
+
+
+@dataclass
+class StageMetrics:
+    """Rows produced by stage of running graph"""
+    stage: str
+    operation: str
+    rows: int = 0
+    started: float | None = None
+    finished: float | None = None
+
+    def rows_per_second(self, now: float) -> float:
+        if self.started is None:
+            return 0.0
+        elapsed = (self.finished or now) - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def state(self) -> str:
+        return "waiting" if self.started is None else "running" if self.finished is None else "finished"
+
+
+class CountRows(ops.Operation):
+    """Pass rows through unchanged, counting them into stage metrics"""
+
+    def __init__(self, metrics: StageMetrics) -> None:
+        self.metrics = metrics
+
+    def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        metrics = self.metrics
+        metrics.started = time.time()
+        try:
+            for row in rows:
+                metrics.rows += 1
+                yield row
+        finally:
+            metrics.finished = time.time()
+
+
+def _describe(operation: tp.Any) -> str:
+    inner = getattr(operation, "mapper", None) or getattr(operation, "reducer", None) \
+        or getattr(operation, "joiner", None)
+    name = type(operation).__name__
+    return f"{name}({type(inner).__name__})" if inner is not None else name
+
+
+def instrument(output: "Stage") -> tuple["Stage", list[StageMetrics]]:
+    """
+    Build DAG which counts rows of every stage while running
+    :param output: output stage of DAG to instrument
+    :return: instrumented output stage and metrics of stages, inputs first
+    """
+    from .executor import Stage, ordered_stages
+
+    metrics: list[StageMetrics] = []
+    instrumented: dict[Stage, Stage] = {}
+    for i, stage in enumerate(ordered_stages([output])):
+        metrics.append(StageMetrics(str(i), _describe(stage.operation)))
+        new_stage = Stage(stage.operation, [instrumented[stage_input] for stage_input in stage.inputs])
+        instrumented[stage] = Stage(CountRows(metrics[-1]), [new_stage])
+    return instrumented[output], metrics
+
+
+@dataclass
+class _Run:
+    number: int
+    started: float
+    stages: list[StageMetrics]
+    previous: dict[str, tuple[float, int]] = field(default_factory=dict)  # time and rows of the last sample
+    recent: dict[str, float] = field(default_factory=dict)  # rates of rows between the last two samples
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+class MetricsExporter:
+    """
+    Publish metrics of graph runs started by run: over HTTP at /metrics in Prometheus text format
+    if port is given and as JSON snapshot written to snapshot_path every interval seconds if it is given.
+    Metrics of the last runs_kept runs are published. Recent rates are sampled every interval seconds
+    by thread of started exporter, so scrapes and snapshots read the same rates and don't change them
+    """
+
+    def __init__(self, port: int | None = None, host: str = "127.0.0.1", snapshot_path: str | None = None,
+                 interval: float = SNAPSHOT_INTERVAL, registry: Registry = REGISTRY,
+                 runs_kept: int = RUNS_KEPT) -> None:
+        """
+        :param port: port of HTTP endpoint, any free one if 0, no endpoint if None
+        :param host: address of HTTP endpoint
+        :param snapshot_path: file to write JSON snapshots to, none are written if None
+        :param interval: seconds between snapshots, also period rates of recent rows are computed over
+        :param registry: process wide metrics to publish along with stages metrics
+        :param runs_kept: number of the last runs to publish metrics of
+        """
+        self.port = port
+        self.host = host
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+        self.registry = registry
+        self.runs_kept = runs_kept
+        self._runs: list[_Run] = []
+        self._run_count = 0
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+        self._stopped = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    @property
+    def address(self) -> tuple[str, int] | None:
+        """Address HTTP endpoint listens at, None if it is not started"""
+        return None if self._server is None else tp.cast(tuple[str, int], self._server.server_address[:2])
+
+    def start(self) -> "MetricsExporter":
+        """Start HTTP endpoint and snapshot thread"""
+        if self._threads:
+            return self
+        self._stopped.clear()
+        if self.port is not None:
+            exporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self) -> None:  # noqa: N802
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = exporter.prometheus().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format: str, *args: tp.Any) -> None:
+                    pass
+
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self._server.daemon_threads = True
+            self._threads.append(threading.Thread(target=self._server.serve_forever, daemon=True,
+                                                  name="compgraph-metrics-http"))
+        self._threads.append(threading.Thread(target=self._sample_periodically, daemon=True,
+                                              name="compgraph-metrics-sample"))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop HTTP endpoint and sampling thread, the last sample is taken and the last snapshot is written"""
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.sample()
+        if self.snapshot_path is not None:
+            self.write_snapshot()
+
+    def __enter__(self) -> "MetricsExporter":
+        return self.start()
+
+    def __exit__(self, *args: tp.Any) -> None:
+        self.stop()
+
+    def run(self, graph: "Graph", **kwargs: tp.Any) -> ops.TRowsGenerator:
+        """
+        Run graph counting rows of its stages; data sources passed as kwargs
+        :param graph: graph to run
+        """
+        from .executor import execute
+        output, stages = instrument(graph._to_stage({}))
+        with self._lock:
+            self._runs.append(_Run(self._run_count, time.time(), stages))
+            self._run_count += 1
+            del self._runs[:-self.runs_kept]
+        yield from execute({"result": output}, **kwargs)["result"]
+
+    def sample(self) -> None:
+        """Compute recent rates of stages: rows produced since the previous sample per second"""
+        now = time.time()
+        with self._lock:
+            for run in self._runs:
+                for stage in run.stages:
+                    previous_time, previous_rows = run.previous.get(stage.stage, (run.started, 0))
+                    elapsed = now - previous_time
+                    run.recent[stage.stage] = (stage.rows - previous_rows) / elapsed if elapsed > 0 else 0.0
+                    run.previous[stage.stage] = (now, stage.rows)
+
+    def snapshot(self) -> dict[str, tp.Any]:
+        """Current metrics: stages of every run with rows, average and recent rates, and process wide metrics"""
+        now = time.time()
+        runs = []
+        with self._lock:
+            for run in self._runs:
+                stages = []
+                for stage in run.stages:
+                    stages.append({"stage": stage.stage, "operation": stage.operation, "state": stage.state(),
+                                   "rows": stage.rows, "rows_per_second": stage.rows_per_second(now),
+                                   "recent_rows_per_second": run.recent.get(stage.stage, 0.0)})
+                runs.append({"run": run.number, "started": run.started, "stages": stages})
+        return {"time": now, "runs": runs, "pipe_queue_batches": self.registry.pipe_queue_batches(),
+                "spill_bytes": self.registry.spilled(), "sort_workers": self.registry.sort_workers,
+                "read_ahead": self.registry.read_ahead_totals()}
+
+    def write_snapshot(self) -> None:
+        """Write current metrics to snapshot file"""
+        assert self.snapshot_path is not None
+        with open(self.snapshot_path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(self.snapshot_path + ".tmp", self.snapshot_path)
+
+    def _sample_periodically(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.sample()
+            if self.snapshot_path is not None:
+                self.write_snapshot()
+
+    def prometheus(self) -> str:
+        """Current metrics in Prometheus text exposition format"""
+        now = time.time()
+        lines = ["# HELP compgraph_stage_rows_total Rows produced by stage",
+                 "# TYPE compgraph_stage_rows_total counter"]
+        rates = ["# HELP compgraph_stage_rows_per_second Average rate of rows produced by stage",
+                 "# TYPE compgraph_stage_rows_per_second gauge"]
+        recent = ["# HELP compgraph_stage_recent_rows_per_second Rate of rows produced by stage "
+                  "between the last two samples",
+                  "# TYPE compgraph_stage_recent_rows_per_second gauge"]
+        running = ["# HELP compgraph_stage_running Whether stage has started and not finished",
+                   "# TYPE compgraph_stage_running gauge"]
+        with self._lock:
+            for run in self._runs:
+                for stage in run.stages:
+                    labels = f'run="{run.number}",stage="{stage.stage}",operation="{_escape(stage.operation)}"'
+                    lines.append(f"compgraph_stage_rows_total{{{labels}}} {stage.rows}")
+                    rates.append(f"compgraph_stage_rows_per_second{{{labels}}} {stage.rows_per_second(now):.3f}")
+                    recent.append(f"compgraph_stage_recent_rows_per_second{{{labels}}} "
+                                  f"{run.recent.get(stage.stage, 0.0):.3f}")
+                    running.append(f"compgraph_stage_running{{{labels}}} {int(stage.state() == 'running')}")
+        lines += rates + recent + running
+        lines += ["# HELP compgraph_pipe_queue_batches Batches of rows waiting in pipe queues",
+                  "# TYPE compgraph_pipe_queue_batches gauge",
+                  f"compgraph_pipe_queue_batches {self.registry.pipe_queue_batches()}",
+                  "# HELP compgraph_spill_bytes_total Bytes spilled to disk",
+                  "# TYPE compgraph_spill_bytes_total counter"]
+        lines += [f'compgraph_spill_bytes_total{{kind="{kind}"}} {n}'
+                  for kind, n in sorted(self.registry.spilled().items())]
+        lines += ["# HELP compgraph_sort_workers Running sort processes",
+                  "# TYPE compgraph_sort_workers gauge",
+                  f"compgraph_sort_workers {self.registry.sort_workers}"]
+        read_ahead = self.registry.read_ahead_totals()
+        lines += ["# HELP compgraph_read_ahead_bytes_total Bytes read by read-ahead threads",
+                  "# TYPE compgraph_read_ahead_bytes_total counter",
+                  f"compgraph_read_ahead_bytes_total {read_ahead['bytes']}",
+                  "# HELP compgraph_read_ahead_stalls_total Times consumer of read-ahead file waited for block",
+                  "# TYPE compgraph_read_ahead_stalls_total counter",
+                  f"compgraph_read_ahead_stalls_total {read_ahead['stalls']}",
+                  "# HELP compgraph_read_ahead_stall_seconds_total Time consumers of read-ahead files waited",
+                  "# TYPE compgraph_read_ahead_stall_seconds_total counter",
+                  f"compgraph_read_ahead_stall_seconds_total {read_ahead['stall_seconds']:.6f}"]
+        return "\n".join(lines) + "\n"
@@ -1,19 +1,63 @@
+import os
 import math
+import time
 import heapq
+import queue
+import pickle
 import string
 import calendar
-from itertools import groupby
-from datetime import datetime
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain, groupby, islice
+from operator import itemgetter
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from math import acos, sin, cos
 from abc import abstractmethod, ABC
 
 import re
+import asyncio
+import unicodedata
 import typing as tp
 
+from .registry import REGISTRY
+from .sketches import BloomFilter, CountMinSketch, HyperLogLog, TDigest
+
 TRow = dict[str, tp.Any]
 TRowsIterable = tp.Iterable[TRow]
 TRowsGenerator = tp.Generator[TRow, None, None]
 
+_PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+_WORD_PATTERN = re.compile(r"[A-Za-z']+")
+_COMBINING_MARKS = re.compile("[\u0300-\u036f]")
+
+MAX_WORDS = 1000000
+PARSE_BLOCK_LINES = 2048
+READ_BLOCK_BYTES = 1 << 20
+READ_AHEAD_BLOCKS = 8
+_SPILL_BLOCK = 1024
+
+
+def _empty_key(row: TRow) -> tuple[()]:
+    return ()
+
+
+@lru_cache(maxsize=None)
+def _key_getter(keys: tuple[str, ...]) -> tp.Callable[[TRow], tp.Any]:
+    return itemgetter(*keys) if keys else _empty_key
+
+
+def key_getter(keys: tp.Sequence[str]) -> tp.Callable[[TRow], tp.Any]:
+    """
+    Function giving key rows are grouped, compared and hashed by: value of the only key column
+    or tuple of values of several ones. It is built once for every combination of keys and shared by operations
+    :param keys: key columns
+    """
+    return _key_getter(tuple(keys))
+
 
 class Operation(ABC):
     @abstractmethod
@@ -32,6 +76,194 @@ class Read(Operation):
                 yield self.parser(line)
 
 
+class ReadFollow(Read):
+    """
+    Read rows from file which keeps growing, like "tail -f": at the end of file wait for new lines.
+    Only complete lines are parsed, reading starts over if file gets truncated
+    """
+
+    def __init__(self, filename: str, parser: tp.Callable[[str], TRow], poll_interval: float = 0.5,
+                 idle_timeout: float | None = None) -> None:
+        """
+        :param filename: filename to read from
+        :param parser: parser from string to Row
+        :param poll_interval: seconds to wait before checking file for new lines
+        :param idle_timeout: stop after that many seconds without new lines, never stop if None
+        """
+        super().__init__(filename, parser)
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+
+    def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        idle = 0.0
+        partial = ""
+        with open(self.filename) as f:
+            while True:
+                line = f.readline()
+                if line.endswith("\n"):
+                    idle = 0.0
+                    yield self.parser(partial + line)
+                    partial = ""
+                    continue
+                if line:
+                    idle = 0.0
+                    partial += line
+                elif os.path.getsize(self.filename) < f.tell():
+                    f.seek(0)
+                    partial = ""
+                elif self.idle_timeout is not None and idle >= self.idle_timeout:
+                    if partial:
+                        yield self.parser(partial)
+                    return
+                else:
+                    time.sleep(self.poll_interval)
+                    idle += self.poll_interval
+
+
+@dataclass
+class ReadStats:
+    """What reader thread has read and how long consumer waited for it"""
+    blocks: int = 0
+    bytes: int = 0
+    read_seconds: float = 0.0  # spent by reader thread in reads
+    stalls: int = 0  # times consumer found queue empty
+    stall_seconds: float = 0.0  # spent by consumer waiting for blocks
+
+
+class ReadAhead(Read):
+    """
+    Read rows from file which is read by background thread: it fills bounded queue with raw blocks
+    while rows of already read blocks are parsed and processed. Runs keep no state in operation:
+    statistics of a run are given by run_with_stats, totals of all runs go to registry.REGISTRY
+    """
+
+    _END = None
+
+    def __init__(self, filename: str, parser: tp.Callable[[str], TRow], block_bytes: int = READ_BLOCK_BYTES,
+                 depth: int = READ_AHEAD_BLOCKS) -> None:
+        """
+        :param filename: filename to read from
+        :param parser: parser from string to Row
+        :param block_bytes: size of block read at once
+        :param depth: number of blocks read ahead of consumer
+        """
+        super().__init__(filename, parser)
+        self.block_bytes = block_bytes
+        self.depth = depth
+
+    def _read(self, blocks: queue.Queue[tp.Any], stopped: threading.Event, stats: ReadStats) -> None:
+        try:
+            with open(self.filename, "rb", buffering=0) as f:
+                while not stopped.is_set():
+                    start = time.perf_counter()
+                    block = f.read(self.block_bytes)
+                    stats.read_seconds += time.perf_counter() - start
+                    if not block:
+                        break
+                    stats.blocks += 1
+                    stats.bytes += len(block)
+                    REGISTRY.add_read_ahead(bytes=len(block))
+                    while not stopped.is_set():
+                        try:
+                            blocks.put(block, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+        except Exception as e:
+            blocks.put(e)
+        else:
+            blocks.put(self._END)
+
+    def _blocks(self, stats: ReadStats) -> tp.Generator[bytes, None, None]:
+        blocks: queue.Queue[tp.Any] = queue.Queue(maxsize=self.depth)
+        stopped = threading.Event()
+        reader = threading.Thread(target=self._read, args=(blocks, stopped, stats), daemon=True)
+        reader.start()
+        try:
+            while True:
+                try:
+                    block = blocks.get_nowait()
+                except queue.Empty:
+                    start = time.perf_counter()
+                    block = blocks.get()
+                    stall_seconds = time.perf_counter() - start
+                    stats.stalls += 1
+                    stats.stall_seconds += stall_seconds
+                    REGISTRY.add_read_ahead(stalls=1, stall_seconds=stall_seconds)
+                if block is self._END:
+                    return
+                if isinstance(block, Exception):
+                    raise block
+                yield block
+        finally:
+            stopped.set()
+            while reader.is_alive():
+                try:
+                    blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        return self._rows(ReadStats())
+
+    def run_with_stats(self) -> tuple[TRowsGenerator, ReadStats]:
+        """
+        :return: rows of file and statistics of reading them, filled in while rows are consumed
+        """
+        stats = ReadStats()
+        return self._rows(stats), stats
+
+    def _rows(self, stats: ReadStats) -> TRowsGenerator:
+        partial = b""
+        for block in self._blocks(stats):
+            lines = (partial + block).split(b"\n")
+            partial = lines.pop()
+            for line in lines:
+                yield self.parser(line.decode() + "\n")
+        if partial:
+            yield self.parser(partial.decode())
+
+
+def _parse_block(parser: tp.Callable[[str], TRow], lines: list[str]) -> list[TRow]:
+    return [parser(line) for line in lines]
+
+
+class ReadParallel(Read):
+    """
+    Read rows from file parsing blocks of lines by pool of processes, rows come in order of lines.
+    At most read_ahead blocks are read and not yet consumed at a time, so memory does not grow
+    with file size. Parser has to be picklable (e.g. json.loads or function of module)
+    """
+
+    def __init__(self, filename: str, parser: tp.Callable[[str], TRow], workers: int | None = None,
+                 block_lines: int = PARSE_BLOCK_LINES, read_ahead: int | None = None) -> None:
+        """
+        :param filename: filename to read from
+        :param parser: parser from string to Row
+        :param workers: number of parsing processes, number of CPUs if None
+        :param block_lines: number of lines sent to process together
+        :param read_ahead: number of blocks being parsed ahead of consumer, twice the number of workers if None
+        """
+        super().__init__(filename, parser)
+        self.workers = workers or os.cpu_count() or 1
+        self.block_lines = block_lines
+        self.read_ahead = read_ahead or 2 * self.workers
+
+    def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        pending: deque[Future[list[TRow]]] = deque()
+        with ProcessPoolExecutor(self.workers) as pool, open(self.filename) as f:
+            try:
+                while block := list(islice(f, self.block_lines)):
+                    pending.append(pool.submit(_parse_block, self.parser, block))
+                    if len(pending) >= self.read_ahead:
+                        yield from pending.popleft().result()
+                while pending:
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
 class ReadIterFactory(Operation):
     def __init__(self, name: str) -> None:
         self.name = name
@@ -41,6 +273,35 @@ class ReadIterFactory(Operation):
             yield row
 
 
+class ReadAsyncIterFactory(Operation):
+    """
+    Read rows from async iterator. Graph.arun passes the source already bridged to the event loop,
+    plain run drives the async iterator on a private event loop
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        source = kwargs[self.name]()
+        if not hasattr(source, "__anext__"):
+            yield from source
+            return
+
+        loop = asyncio.new_event_loop()
+        try:
+            while True:
+                try:
+                    row = loop.run_until_complete(source.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield row
+        finally:
+            if hasattr(source, "aclose"):
+                loop.run_until_complete(source.aclose())
+            loop.close()
+
+
 # Operations
 
 
@@ -54,6 +315,14 @@ class Mapper(ABC):
         """
         pass
 
+    def reads(self) -> tp.Collection[str] | None:
+        """Columns which result depends on, None if unknown"""
+        return None
+
+    def writes(self) -> tp.Collection[str] | None:
+        """Columns which values mapper may change or add, None if unknown"""
+        return None
+
 
 class Map(Operation):
     """
@@ -85,6 +354,10 @@ class Reducer(ABC):
         """
         pass
 
+    def reads(self) -> tp.Collection[str] | None:
+        """Columns besides keys which result depends on, None if result rows carry columns of input rows"""
+        return None
+
 
 class Reduce(Operation):
     """
@@ -103,8 +376,215 @@ class Reduce(Operation):
         """
         :param rows: table rows
         """
-        for _, v in groupby(rows, key=lambda x: [x[i] for i in self.keys]):
-            yield from self.reducer(tuple(self.keys), v)
+        keys = tuple(self.keys)
+        for _, v in groupby(rows, key=key_getter(keys)):
+            yield from self.reducer(keys, v)
+
+
+class Aggregator(Reducer):
+    """
+    Base class for reducers which fold rows of group into mergeable state.
+    Such groups can be aggregated by hashing without sort and partial states can be combined
+    """
+
+    @abstractmethod
+    def start(self) -> tp.Any:
+        """State of empty group"""
+        pass
+
+    @abstractmethod
+    def update(self, state: tp.Any, row: TRow) -> tp.Any:
+        """
+        :param state: state of group
+        :param row: next row of group
+        :return: new state
+        """
+        pass
+
+    @abstractmethod
+    def merge(self, state_a: tp.Any, state_b: tp.Any) -> tp.Any:
+        """
+        :param state_a: state of one part of group
+        :param state_b: state of other part of group
+        :return: state of whole group
+        """
+        pass
+
+    @abstractmethod
+    def finish(self, group_key: tuple[str, ...], key_row: TRow, state: tp.Any) -> TRowsGenerator:
+        """
+        :param group_key: saved keys
+        :param key_row: row with values of group keys
+        :param state: state of whole group
+        """
+        pass
+
+    def __call__(self, group_key: tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
+        state = self.start()
+        key_row = None
+        for row in rows:
+            if key_row is None:
+                key_row = row
+            state = self.update(state, row)
+        if key_row is not None:
+            yield from self.finish(group_key, key_row, state)
+
+
+class HashReduce(Operation):
+    """
+    Reduce with aggregator over unsorted rows: groups are kept in dict and yielded in order of appearance.
+    If there turn out to be more than max_groups groups, the rest of rows are sorted and aggregated
+    by key, then merged with states in dict
+    """
+
+    def __init__(self, reducer: Aggregator, keys: tp.Sequence[str], max_groups: int) -> None:
+        """
+        :param reducer: aggregator to apply
+        :param keys: keys for grouping
+        :param max_groups: number of groups to keep in memory
+        """
+        self.reducer = reducer
+        self.keys = keys
+        self.max_groups = max_groups
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        keys = tuple(self.keys)
+        get_key = key_getter(keys)
+        states: dict[tp.Any, tp.Any] = {}
+        key_rows: dict[tp.Any, TRow] = {}
+        rows = iter(rows)
+        overflow = None
+        for row in rows:
+            key = get_key(row)
+            if key not in states:
+                if len(states) >= self.max_groups:
+                    overflow = chain([row], rows)
+                    break
+                states[key] = self.reducer.start()
+                key_rows[key] = row
+            states[key] = self.reducer.update(states[key], row)
+
+        if overflow is not None:
+            from .external_sort import ExternalSort
+            for key, group in groupby(ExternalSort(keys, reverse=False)(overflow), key=get_key):
+                group = iter(group)
+                key_row = next(group)
+                state = self.reducer.update(self.reducer.start(), key_row)
+                for row in group:
+                    state = self.reducer.update(state, row)
+                if key in states:
+                    state = self.reducer.merge(states.pop(key), state)
+                    key_row = key_rows.pop(key)
+                yield from self.reducer.finish(keys, key_row, state)
+
+        for key, state in states.items():
+            yield from self.reducer.finish(keys, key_rows[key], state)
+
+
+class Window(Operation):
+    """
+    Aggregate rows by event time windows as they come, without sorting.
+    Windows are [start, start + size) with start multiple of slide (tumbling if slide equals size).
+    Watermark is the latest event time seen minus delay; window result is emitted once watermark passes its end.
+    Window state is kept for allowed lateness more, late rows within it update the window and its result
+    is emitted again; rows later than that are dropped. Windows left at the end of stream are emitted in order
+    Example for size=10, time_column='t', reducer=Count('n')
+        {'t': 1}
+        {'t': 4}
+        {'t': 12}
+        =>
+        {'n': 2, 'window_start': 0, 'window_end': 10}
+        {'n': 1, 'window_start': 10, 'window_end': 20}
+    """
+
+    def __init__(self, reducer: Aggregator, time_column: str, size: float, slide: float | None = None,
+                 keys: tp.Sequence[str] = (), delay: float = 0, allowed_lateness: float = 0,
+                 timestamp: tp.Callable[[tp.Any], float] | None = None,
+                 start_column: str = "window_start", end_column: str = "window_end") -> None:
+        """
+        :param reducer: aggregator to apply to rows of window by keys
+        :param time_column: column with event time
+        :param size: window length
+        :param slide: distance between starts of consecutive windows, size by default
+        :param keys: keys for grouping inside window
+        :param delay: how far event time of rows may go back without them being late
+        :param allowed_lateness: how long window is updated by late rows after its result is emitted
+        :param timestamp: function of time column value giving event time as number, value itself by default
+        :param start_column: name for result column with window start
+        :param end_column: name for result column with window end
+        """
+        slide = size if slide is None else slide
+        if size <= 0 or slide <= 0:
+            raise ValueError("Window size and slide must be positive")
+        self.reducer = reducer
+        self.time_column = time_column
+        self.size = size
+        self.slide = slide
+        self.keys = keys
+        self.delay = delay
+        self.allowed_lateness = allowed_lateness
+        self.timestamp = timestamp
+        self.start_column = start_column
+        self.end_column = end_column
+
+    def _windows(self, event_time: float) -> tp.Iterator[int]:
+        """Numbers of windows which contain event time, window n starts at n * slide"""
+        n = math.floor(event_time / self.slide)
+        while n * self.slide + self.size > event_time:
+            yield n
+            n -= 1
+
+    def _emit(self, n: int, groups: tp.Mapping[tp.Any, list[tp.Any]]) -> TRowsGenerator:
+        keys = tuple(self.keys)
+        start = n * self.slide
+        for key_row, state in groups.values():
+            for row in self.reducer.finish(keys, key_row, state):
+                yield {**row, self.start_column: start, self.end_column: start + self.size}
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        reducer, keys = self.reducer, tuple(self.keys)
+        get_key = key_getter(keys)
+        windows: dict[int, dict[tp.Any, list[tp.Any]]] = {}
+        pending: list[int] = []  # heap of windows which result is not emitted yet
+        emitted: list[int] = []  # heap of windows which result is emitted, kept for late rows
+        is_emitted: set[int] = set()
+        watermark = -math.inf
+
+        def end(n: int) -> float:
+            return n * self.slide + self.size
+
+        for row in rows:
+            value = row[self.time_column]
+            event_time = value if self.timestamp is None else self.timestamp(value)
+            group_key = get_key(row)
+            for n in self._windows(event_time):
+                if end(n) + self.allowed_lateness <= watermark:
+                    continue
+                if n not in windows:
+                    windows[n] = {}
+                    heapq.heappush(pending, n)
+                entry = windows[n].get(group_key)
+                if entry is None:
+                    entry = windows[n][group_key] = [{k: row[k] for k in keys}, reducer.start()]
+                entry[1] = reducer.update(entry[1], row)
+                if n in is_emitted:
+                    yield from self._emit(n, {group_key: entry})
+
+            if event_time - self.delay > watermark:
+                watermark = event_time - self.delay
+                while pending and end(pending[0]) <= watermark:
+                    n = heapq.heappop(pending)
+                    yield from self._emit(n, windows[n])
+                    heapq.heappush(emitted, n)
+                    is_emitted.add(n)
+                while emitted and end(emitted[0]) + self.allowed_lateness <= watermark:
+                    n = heapq.heappop(emitted)
+                    del windows[n]
+                    is_emitted.discard(n)
+
+        while pending:
+            n = heapq.heappop(pending)
+            yield from self._emit(n, windows[n])
 
 
 class Joiner(ABC):
@@ -114,6 +594,19 @@ class Joiner(ABC):
         self._a_suffix = suffix_a
         self._b_suffix = suffix_b
 
+    def reads(self, columns: tp.Collection[str]) -> set[str]:
+        """
+        Columns of joined rows which give columns of result,
+        columns of both sides are kept together so that clashing names still get suffixes
+        :param columns: columns of result
+        """
+        result = set(columns)
+        for column in columns:
+            for suffix in (self._a_suffix, self._b_suffix):
+                if suffix and column.endswith(suffix):
+                    result.add(column[:-len(suffix)])
+        return result
+
     @abstractmethod  # tp.Iterator[tp.List[None]] doesn't work instead of Any :(
     def __call__(self, keys: tp.Sequence[str], rows_a: TRowsIterable | tp.Any,
                  rows_b: TRowsIterable | tp.Any) -> TRowsGenerator:
@@ -142,8 +635,9 @@ class Join(Operation):
         :param rows: table1 rows
         :param args: table2 rows
         """
-        rows1 = groupby(rows, key=lambda x: [x[k] for k in self.keys])
-        rows2 = groupby(args[0], key=lambda x: [x[k] for k in self.keys])
+        get_key = key_getter(self.keys)
+        rows1 = groupby(rows, key=get_key)
+        rows2 = groupby(args[0], key=get_key)
 
         key1, value1 = self._next_iter(rows1)
         key2, value2 = self._next_iter(rows2)
@@ -186,19 +680,167 @@ class Join(Operation):
             yield from self.joiner(tuple(self.keys), iter([None]), value2)
 
 
+class HashJoin(Operation):
+    """
+    Join which keeps one side (build side) in dict by keys and streams the other one (probe side),
+    so build side needs no sort. Output keeps order of probe side, unmatched build rows go last.
+    If build side turns out to have more than max_rows rows, both sides are sorted and merge Join is used
+    """
+
+    def __init__(self, joiner: Joiner, keys: tp.Sequence[str], build: str = "right",
+                 max_rows: int | None = 100000):
+        """
+        :param joiner: join strategy to use
+        :param keys: keys for join
+        :param build: which side to keep in memory, "left" or "right"
+        :param max_rows: number of build rows to keep in memory, the whole build side is kept if None,
+            so probe side is never sorted and may be endless
+        """
+        if build not in ("left", "right"):
+            raise ValueError(f"Unknown build side {build}")
+        self.keys = keys
+        self.joiner = joiner
+        self.build = build
+        self.max_rows = max_rows
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        """
+        :param rows: table1 rows
+        :param args: table2 rows
+        """
+        keys = tuple(self.keys)
+        build_rows, probe_rows = (rows, args[0]) if self.build == "left" else (args[0], rows)
+
+        get_key = key_getter(keys)
+        table: dict[tp.Any, list[TRow]] = {}
+        build_iter = iter(build_rows)
+        count = 0
+        max_rows = self.max_rows
+        for row in build_iter:
+            table.setdefault(get_key(row), []).append(row)
+            count += 1
+            if max_rows is not None and count > max_rows:
+                yield from self._merge_join(chain(chain.from_iterable(table.values()), build_iter), probe_rows)
+                return
+
+        matched = set()
+        for key, group in groupby(probe_rows, key=get_key):
+            found = table.get(key)
+            if found is not None:
+                matched.add(key)
+            yield from self._join(group, iter(found) if found is not None else iter([None]))
+
+        for key, found in table.items():
+            if key not in matched:
+                yield from self._join(iter([None]), iter(found))
+
+    def _join(self, probe: TRowsIterable, build: TRowsIterable) -> TRowsGenerator:
+        if self.build == "left":
+            return self.joiner(tuple(self.keys), build, probe)
+        return self.joiner(tuple(self.keys), probe, build)
+
+    def _merge_join(self, build: TRowsIterable, probe: TRowsIterable) -> TRowsGenerator:
+        from .external_sort import ExternalSort
+        build, probe = ExternalSort(self.keys, reverse=False)(build), ExternalSort(self.keys, reverse=False)(probe)
+        rows_a, rows_b = (build, probe) if self.build == "left" else (probe, build)
+        return Join(self.joiner, self.keys)(rows_a, rows_b)
+
+
+class BloomSemiJoin(Operation):
+    """
+    Drop rows which can not have a match in other table: keys of other table are collected into Bloom filter
+    before the first row passes. Some rows without match may pass, rows with match always do
+    """
+
+    def __init__(self, keys: tp.Sequence[str], capacity: int, error_rate: float = 0.01) -> None:
+        """
+        :param keys: join keys
+        :param capacity: expected number of rows of other table
+        :param error_rate: share of rows without match which pass
+        """
+        self.keys = keys
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        """
+        :param rows: rows to filter
+        :param args: rows of other table
+        """
+        from .keys import key_encoder
+
+        # keys are hashed by their normalized encoding: 1, 1.0 and True are equal keys and must share bits
+        encode = key_encoder(self.keys)
+        get_key = key_getter(self.keys)
+
+        def bloom_key(row: TRow) -> tp.Any:
+            try:
+                return encode(row)
+            except TypeError:
+                return get_key(row)
+
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        for row in args[0]:
+            bloom.add(bloom_key(row))
+        for row in rows:
+            if bloom_key(row) in bloom:
+                yield row
+
+
+class Limit(Operation):
+    """
+    Pass only the first n rows. Input is closed right after them, so operations before limit stop
+    computing the rest: their generators are finalized and sort processes are stopped
+    """
+
+    def __init__(self, n: int) -> None:
+        """
+        :param n: number of rows to pass
+        """
+        if n < 0:
+            raise ValueError("Limit must not be negative")
+        self.n = n
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        rows = iter(rows)
+        try:
+            yield from islice(rows, self.n)
+        finally:
+            if hasattr(rows, "close"):
+                rows.close()
+
+
 # Dummy operators
 
 
 class DummyMapper(Mapper):
     """Yield exactly the row passed"""
 
+    def reads(self) -> tp.Collection[str]:
+        return ()
+
+    def writes(self) -> tp.Collection[str]:
+        return ()
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         yield row
 
 
-class FirstReducer(Reducer):
+class FirstReducer(Aggregator):
     """Yield only first row from passed ones"""
 
+    def start(self) -> tp.Any:
+        return None
+
+    def update(self, state: tp.Any, row: TRow) -> tp.Any:
+        return row if state is None else state
+
+    def merge(self, state_a: tp.Any, state_b: tp.Any) -> tp.Any:
+        return state_b if state_a is None else state_a
+
+    def finish(self, group_key: tuple[str, ...], key_row: TRow, state: tp.Any) -> TRowsGenerator:
+        yield state
+
     def __call__(self, group_key: tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
         for row in rows:
             yield row
@@ -217,8 +859,14 @@ class FilterPunctuation(Mapper):
         """
         self.column = column
 
+    def reads(self) -> tp.Collection[str]:
+        return (self.column,)
+
+    def writes(self) -> tp.Collection[str]:
+        return (self.column,)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
-        row[self.column] = row[self.column].translate(str.maketrans("", "", string.punctuation))
+        row[self.column] = row[self.column].translate(_PUNCTUATION_TABLE)
         yield row
 
 
@@ -235,6 +883,12 @@ class LowerCase(Mapper):
     def _lower_case(txt: str) -> str:
         return txt.lower()
 
+    def reads(self) -> tp.Collection[str]:
+        return (self.column,)
+
+    def writes(self) -> tp.Collection[str]:
+        return (self.column,)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         row[self.column] = self._lower_case(row[self.column])
         yield row
@@ -253,7 +907,13 @@ class Split(Mapper):
 
     @staticmethod
     def split_iter(line: str) -> tp.Generator[str, None, None]:
-        return (x.group(0) for x in re.finditer(r"[A-Za-z']+", line))
+        return (x.group(0) for x in _WORD_PATTERN.finditer(line))
+
+    def reads(self) -> tp.Collection[str]:
+        return (self.column,)
+
+    def writes(self) -> tp.Collection[str]:
+        return (self.column,)
 
     def __call__(self, row: TRow) -> TRowsGenerator:
         for line in self.split_iter(row[self.column]):
@@ -262,6 +922,87 @@ class Split(Mapper):
             yield row_new
 
 
+class Tokenize(Mapper):
+    """
+    Split text into normalized tokens (or n-grams of them), one compact row per token.
+    Configured once and done in one pass, by default gives the same tokens as
+    FilterPunctuation, LowerCase and Split applied one after another
+    Example for column='text', columns=('doc_id',), stopwords=('a',), ngrams=2
+        {'doc_id': 1, 'text': 'A Quick, brown fox', 'title': 'Fox'}
+        =>
+        {'doc_id': 1, 'text': 'quick brown'}
+        {'doc_id': 1, 'text': 'brown fox'}
+    """
+
+    def __init__(self, column: str, columns: tp.Sequence[str] = (), result_column: str | None = None,
+                 lowercase: bool = True, punctuation: bool = True, fold_unicode: bool = False,
+                 stopwords: tp.Iterable[str] = (), min_length: int = 1, ngrams: int = 1,
+                 pattern: str = r"[A-Za-z']+", separator: str = " ") -> None:
+        """
+        :param column: name of column with text
+        :param columns: columns copied from input row to token rows
+        :param result_column: name for column with token, column by default
+        :param lowercase: lower case text
+        :param punctuation: remove punctuation symbols (string.punctuation) before splitting
+        :param fold_unicode: replace accented letters with base ones (e.g. 'é' with 'e')
+        :param stopwords: tokens to skip, compared with normalized tokens
+        :param min_length: skip tokens shorter than that
+        :param ngrams: number of consecutive tokens joined into one
+        :param pattern: regular expression of token
+        :param separator: string to join tokens of n-gram with
+        """
+        if ngrams < 1:
+            raise ValueError("Number of tokens in n-gram must be positive")
+        self.column = column
+        self.columns = columns
+        self.result_column = result_column or column
+        self.lowercase = lowercase
+        self.punctuation = punctuation
+        self.fold_unicode = fold_unicode
+        self.stopwords = frozenset(stopwords)
+        self.min_length = min_length
+        self.ngrams = ngrams
+        self.separator = separator
+        self._pattern = re.compile(pattern)
+
+    def normalize(self, text: str) -> str:
+        """
+        :param text: text to normalize before splitting
+        """
+        if self.fold_unicode:
+            text = _COMBINING_MARKS.sub("", unicodedata.normalize("NFKD", text))
+        if self.lowercase:
+            text = text.lower()
+        if self.punctuation:
+            text = text.translate(_PUNCTUATION_TABLE)
+        return text
+
+    def tokens(self, text: str) -> tp.Iterator[str]:
+        """
+        :param text: text to split
+        """
+        tokens: tp.Iterable[str] = self._pattern.findall(self.normalize(text))
+        if self.stopwords or self.min_length > 1:
+            stopwords, min_length = self.stopwords, self.min_length
+            tokens = [token for token in tokens if len(token) >= min_length and token not in stopwords]
+        if self.ngrams == 1:
+            return iter(tokens)
+        words = list(tokens)
+        return (self.separator.join(words[i:i + self.ngrams]) for i in range(len(words) - self.ngrams + 1))
+
+    def reads(self) -> tp.Collection[str]:
+        return (self.column, *self.columns)
+
+    def writes(self) -> tp.Collection[str]:
+        return (self.result_column,)
+
+    def __call__(self, row: TRow) -> TRowsGenerator:
+        base = {column: row[column] for column in self.columns}
+        result_column = self.result_column
+        for token in self.tokens(row[self.column]):
+            yield {**base, result_column: token}
+
+
 class Product(Mapper):
     """Calculates product of multiple columns"""
 
@@ -273,6 +1014,12 @@ class Product(Mapper):
         self.columns = columns
         self.result_column = result_column
 
+    def reads(self) -> tp.Collection[str]:
+        return self.columns
+
+    def writes(self) -> tp.Collection[str]:
+        return (self.result_column,)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         result = 1
         for column in self.columns:
@@ -284,11 +1031,19 @@ class Product(Mapper):
 class Filter(Mapper):
     """Remove records that don't satisfy some condition"""
 
-    def __init__(self, condition: tp.Callable[[TRow], bool]) -> None:
+    def __init__(self, condition: tp.Callable[[TRow], bool], columns: tp.Sequence[str] | None = None) -> None:
         """
         :param condition: if condition is not true - remove record
+        :param columns: columns condition reads, lets optimizer apply filter earlier
         """
         self.condition = condition
+        self.columns = columns
+
+    def reads(self) -> tp.Collection[str] | None:
+        return self.columns
+
+    def writes(self) -> tp.Collection[str]:
+        return ()
 
     def __call__(self, row: TRow) -> TRowsGenerator:
         if self.condition(row):
@@ -304,6 +1059,12 @@ class Project(Mapper):
         """
         self.columns = columns
 
+    def reads(self) -> tp.Collection[str]:
+        return self.columns
+
+    def writes(self) -> tp.Collection[str]:
+        return ()
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         new_row = {}
         for column in self.columns:
@@ -311,6 +1072,20 @@ class Project(Mapper):
         yield new_row
 
 
+class KeepColumns(Project):
+    """Leave only mentioned columns which row has, in their order in row"""
+
+    def __init__(self, columns: tp.Collection[str]) -> None:
+        """
+        :param columns: names of columns
+        """
+        super().__init__(sorted(columns))
+        self._columns = frozenset(columns)
+
+    def __call__(self, row: TRow) -> TRowsGenerator:
+        yield {column: value for column, value in row.items() if column in self._columns}
+
+
 # Reducers
 
 
@@ -342,43 +1117,107 @@ class TopN(Reducer):
             yield row
 
 
+class _SpillingCounter:
+    """
+    Counts of values which keeps at most limit values in memory.
+    When there are more, counts are written to temporary file as run sorted by value,
+    runs are merged summing counts of the same value
+    """
+
+    def __init__(self, limit: int) -> None:
+        self._limit = limit
+        self._counts: dict[tp.Any, tp.Any] = {}
+        self._runs: list[tp.IO[bytes]] = []
+
+    def add(self, value: tp.Any, count: tp.Any) -> None:
+        counts = self._counts
+        if value in counts:
+            counts[value] += count
+            return
+        if len(counts) >= self._limit:
+            self._spill()
+            counts = self._counts
+        counts[value] = count
+
+    def _spill(self) -> None:
+        run = tempfile.TemporaryFile()
+        items = sorted(self._counts.items(), key=itemgetter(0))
+        for i in range(0, len(items), _SPILL_BLOCK):
+            pickle.dump(items[i:i + _SPILL_BLOCK], run, protocol=pickle.HIGHEST_PROTOCOL)
+        REGISTRY.add_spill_bytes("term_frequency", run.tell())
+        run.seek(0)
+        self._runs.append(run)
+        self._counts = {}
+
+    @staticmethod
+    def _read(run: tp.IO[bytes]) -> tp.Generator[tuple[tp.Any, tp.Any], None, None]:
+        while True:
+            try:
+                yield from pickle.load(run)
+            except EOFError:
+                return
+
+    def items(self) -> tp.Generator[tuple[tp.Any, tp.Any], None, None]:
+        """Values with their counts: in order of appearance if nothing was spilled, otherwise sorted by value"""
+        if not self._runs:
+            yield from self._counts.items()
+            return
+        self._spill()
+        try:
+            merged = heapq.merge(*(self._read(run) for run in self._runs), key=itemgetter(0))
+            for value, group in groupby(merged, key=itemgetter(0)):
+                total = next(group)[1]
+                for _, count in group:
+                    total += count
+                yield value, total
+        finally:
+            for run in self._runs:
+                run.close()
+            self._runs = []
+
+
 class TermFrequency(Reducer):
-    """Calculate frequency of values in column"""
+    """
+    Calculate frequency of values in column.
+    At most max_words distinct values of group are counted in memory, partial counts of the rest
+    are spilled to disk and merged, then rows are yielded sorted by value instead of order of appearance
+    """
 
-    def __init__(self, words_column: str, result_column: str = "tf", count_column: str | None = None) -> None:
+    def __init__(self, words_column: str, result_column: str = "tf", count_column: str | None = None,
+                 max_words: int = MAX_WORDS) -> None:
         """
         :param words_column: name for column with words
         :param result_column: name for result column
+        :param count_column: name for column with number of occurrences of word, 1 if None
+        :param max_words: number of distinct words to keep in memory
         """
         self.words_column = words_column
         self.result_column = result_column
         self.count_column = count_column
+        self.max_words = max_words
+
+    def reads(self) -> tp.Collection[str]:
+        return (self.words_column,) if self.count_column is None else (self.words_column, self.count_column)
 
     def __call__(self, group_key: tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
-        r_rows = {}
+        counts = _SpillingCounter(self.max_words)
+        key_row: TRow | None = None
         n = 0
         for row in rows:
-            if row[self.words_column] not in r_rows:
-                new_row = {}
-                for t in group_key:
-                    new_row[t] = row[t]
-                new_row[self.words_column] = row[self.words_column]
-                new_row[self.result_column] = 0
-                r_rows[row[self.words_column]] = new_row
+            if key_row is None:
+                key_row = {t: row[t] for t in group_key}
+            count = row[self.count_column] if self.count_column else 1
+            counts.add(row[self.words_column], count)
+            n += count
 
-            if self.count_column:
-                r_rows[row[self.words_column]][self.result_column] += row[self.count_column]
-                n += row[self.count_column]
-            else:
-                r_rows[row[self.words_column]][self.result_column] += 1
-                n += 1
-
-        for w, row in r_rows.items():
-            row[self.result_column] /= n
-            yield row
+        for word, count in counts.items():
+            new_row = dict(tp.cast(TRow, key_row))
+            new_row[self.words_column] = word
+            new_row[self.result_column] = count / n
+            yield new_row
 
 
-class Count(Reducer):
+class Count(Aggregator):
     """
     Count records by key
     Example for group_key=('a',) and column='d'
@@ -394,6 +1233,9 @@ class Count(Reducer):
         """
         self.column = column
 
+    def reads(self) -> tp.Collection[str]:
+        return ()
+
     def __call__(self, group_key: tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
         new_row = {self.column: 1}
         row = next(iter(rows))
@@ -405,8 +1247,23 @@ class Count(Reducer):
 
         yield new_row
 
+    def start(self) -> int:
+        return 0
+
+    def update(self, state: int, row: TRow) -> int:
+        return state + 1
+
+    def merge(self, state_a: int, state_b: int) -> int:
+        return state_a + state_b
+
+    def finish(self, group_key: tuple[str, ...], key_row: TRow, state: int) -> TRowsGenerator:
+        new_row = {self.column: state}
+        for t in group_key:
+            new_row[t] = key_row[t]
+        yield new_row
+
 
-class Sum(Reducer):
+class Sum(Aggregator):
     """
     Sum values aggregated by key
     Example for key=('a',) and column='b'
@@ -422,6 +1279,9 @@ class Sum(Reducer):
         """
         self.column = column
 
+    def reads(self) -> tp.Collection[str]:
+        return (self.column,)
+
     def __call__(self, group_key: tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
         r_rows = {}
         for row in rows:
@@ -441,6 +1301,21 @@ class Sum(Reducer):
         for k, row in r_rows.items():
             yield row
 
+    def start(self) -> tp.Any:
+        return 0
+
+    def update(self, state: tp.Any, row: TRow) -> tp.Any:
+        return state + row[self.column]
+
+    def merge(self, state_a: tp.Any, state_b: tp.Any) -> tp.Any:
+        return state_a + state_b
+
+    def finish(self, group_key: tuple[str, ...], key_row: TRow, state: tp.Any) -> TRowsGenerator:
+        new_row = {self.column: state}
+        for t in group_key:
+            new_row[t] = key_row[t]
+        yield new_row
+
 
 # Joiners
 
@@ -553,6 +1428,12 @@ class Function(Mapper):
         self.column = column
         self.function = function
 
+    def reads(self) -> tp.Collection[str]:
+        return (self.column,)
+
+    def writes(self) -> tp.Collection[str]:
+        return (self.column,)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         row[self.column] = self.function(row[self.column])
         yield row
@@ -573,11 +1454,35 @@ class HaversineDistance(Mapper):
         lon_1, lat_1, lon_2, lat_2 = map(math.radians, [*row[self.start_column], *row[self.end_column]])
         return self.EARTH_RADIUS_KM * acos(sin(lat_1) * sin(lat_2) + cos(lat_1) * cos(lat_2) * cos(lon_2 - lon_1))
 
+    def reads(self) -> tp.Collection[str]:
+        return self.start_column, self.end_column
+
+    def writes(self) -> tp.Collection[str]:
+        return (self.result_column,)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         row[self.result_column] = self.calculate(row)
         yield row
 
 
+def parse_time(value: str) -> datetime:
+    """
+    :param value: time like 20171020T112238.723000 (fraction of second is optional)
+    """
+    try:
+        return datetime.strptime(value, "%Y%m%dT%H%M%S.%f")
+    except ValueError:
+        return datetime.strptime(value, "%Y%m%dT%H%M%S")
+
+
+def timestamp(value: str) -> float:
+    """
+    Seconds since epoch, time is taken as UTC
+    :param value: time like 20171020T112238.723000 (see parse_time)
+    """
+    return parse_time(value).replace(tzinfo=timezone.utc).timestamp()
+
+
 class Date(Mapper):
     """
     Transform date to human-readable format
@@ -588,17 +1493,20 @@ class Date(Mapper):
         self.weekday_result_column = weekday_result_column
         self.hour_result_column = hour_result_column
 
+    def reads(self) -> tp.Collection[str]:
+        return (self.enter_time_column,)
+
+    def writes(self) -> tp.Collection[str]:
+        return self.weekday_result_column, self.hour_result_column
+
     def __call__(self, row: TRow) -> TRowsGenerator:
-        try:
-            date = datetime.strptime(row[self.enter_time_column], "%Y%m%dT%H%M%S.%f")
-        except ValueError:
-            date = datetime.strptime(row[self.enter_time_column], "%Y%m%dT%H%M%S")
+        date = parse_time(row[self.enter_time_column])
         row[self.weekday_result_column] = calendar.day_name[date.weekday()][:3]
         row[self.hour_result_column] = date.hour
         yield row
 
 
-class AverageSpeed(Reducer):
+class AverageSpeed(Aggregator):
     """
     Calculate average speed by the distances and times
     """
@@ -610,6 +1518,9 @@ class AverageSpeed(Reducer):
         self.leave_time_column = leave_time_column
         self.speed_result_column = speed_result_column
 
+    def reads(self) -> tp.Collection[str]:
+        return self.distance_column, self.enter_time_column, self.leave_time_column
+
     def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
         time_: float = 0
         dist_: float = 0
@@ -621,12 +1532,154 @@ class AverageSpeed(Reducer):
                     new_row[t] = row[t]
 
             dist_ += row[self.distance_column]
-            try:
-                time_ += (datetime.strptime(row[self.leave_time_column], "%Y%m%dT%H%M%S.%f") -
-                          datetime.strptime(row[self.enter_time_column], "%Y%m%dT%H%M%S.%f")).total_seconds() / 3600
-            except ValueError:
-                time_ += (datetime.strptime(row[self.leave_time_column], "%Y%m%dT%H%M%S") -
-                          datetime.strptime(row[self.enter_time_column], "%Y%m%dT%H%M%S")).total_seconds() / 3600
+            time_ += (parse_time(row[self.leave_time_column]) -
+                      parse_time(row[self.enter_time_column])).total_seconds() / 3600
 
         new_row[self.speed_result_column] = dist_ / time_
         yield new_row
+
+    def start(self) -> tuple[float, float]:
+        return 0.0, 0.0
+
+    def update(self, state: tuple[float, float], row: TRow) -> tuple[float, float]:
+        hours = (parse_time(row[self.leave_time_column]) -
+                 parse_time(row[self.enter_time_column])).total_seconds() / 3600
+        return state[0] + row[self.distance_column], state[1] + hours
+
+    def merge(self, state_a: tuple[float, float], state_b: tuple[float, float]) -> tuple[float, float]:
+        return state_a[0] + state_b[0], state_a[1] + state_b[1]
+
+    def finish(self, group_key: tuple[str, ...], key_row: TRow, state: tuple[float, float]) -> TRowsGenerator:
+        new_row: TRow = {t: key_row[t] for t in group_key}
+        new_row[self.speed_result_column] = state[0] / state[1]
+        yield new_row
+
+
+# Approximate reducers
+
+
+class HeavyHitters(Aggregator):
+    """
+    Approximate top n most frequent values of column in fixed memory (Count-Min sketch),
+    counts are never underestimated
+    Example for group_key=() and column='text', n=1
+        {'text': 'a'}
+        {'text': 'b'}
+        {'text': 'a'}
+        =>
+        {'text': 'a', 'count': 2}
+    """
+
+    def __init__(self, column: str, n: int, count_column: str = "count", width: int = 2048, depth: int = 4) -> None:
+        """
+        :param column: column to count values of
+        :param n: number of most frequent values to yield
+        :param count_column: name for result column with count
+        :param width: counters per row of sketch
+        :param depth: rows of sketch
+        """
+        self.column = column
+        self.n = n
+        self.count_column = count_column
+        self.width = width
+        self.depth = depth
+
+    def _prune(self, candidates: dict[tp.Any, int]) -> dict[tp.Any, int]:
+        if len(candidates) <= 4 * self.n:
+            return candidates
+        return dict(heapq.nlargest(2 * self.n, candidates.items(), key=lambda item: item[1]))
+
+    def reads(self) -> tp.Collection[str]:
+        return (self.column,)
+
+    def start(self) -> tuple[CountMinSketch, dict[tp.Any, int]]:
+        return CountMinSketch(self.width, self.depth), {}
+
+    def update(self, state: tuple[CountMinSketch, dict[tp.Any, int]], row: TRow) -> tp.Any:
+        sketch, candidates = state
+        candidates[row[self.column]] = sketch.add(row[self.column])
+        return sketch, self._prune(candidates)
+
+    def merge(self, state_a: tp.Any, state_b: tp.Any) -> tp.Any:
+        sketch = state_a[0].merge(state_b[0])
+        return sketch, self._prune({value: sketch.estimate(value) for value in {**state_a[1], **state_b[1]}})
+
+    def finish(self, group_key: tuple[str, ...], key_row: TRow, state: tp.Any) -> TRowsGenerator:
+        for value, count in heapq.nlargest(self.n, state[1].items(), key=lambda item: item[1]):
+            new_row = {self.column: value, self.count_column: count}
+            for t in group_key:
+                new_row[t] = key_row[t]
+            yield new_row
+
+
+class ApproxCountDistinct(Aggregator):
+    """Approximate number of distinct values of column in group in fixed memory (HyperLogLog)"""
+
+    def __init__(self, column: str, result_column: str, precision: int = 12) -> None:
+        """
+        :param column: column to count distinct values of
+        :param result_column: name for result column
+        :param precision: sketch precision, relative error is about 1.04 / sqrt(2 ** precision)
+        """
+        self.column = column
+        self.result_column = result_column
+        self.precision = precision
+
+    def reads(self) -> tp.Collection[str]:
+        return (self.column,)
+
+    def start(self) -> HyperLogLog:
+        return HyperLogLog(self.precision)
+
+    def update(self, state: HyperLogLog, row: TRow) -> HyperLogLog:
+        state.add(row[self.column])
+        return state
+
+    def merge(self, state_a: HyperLogLog, state_b: HyperLogLog) -> HyperLogLog:
+        return state_a.merge(state_b)
+
+    def finish(self, group_key: tuple[str, ...], key_row: TRow, state: HyperLogLog) -> TRowsGenerator:
+        new_row: TRow = {t: key_row[t] for t in group_key}
+        new_row[self.result_column] = round(state.count())
+        yield new_row
+
+
+class ApproxQuantiles(Aggregator):
+    """
+    Approximate quantiles of column in group in fixed memory (t-digest)
+    Example for group_key=('hour',), column='speed', quantiles={'p50': 0.5}
+        {'hour': 1, 'speed': 10}
+        {'hour': 1, 'speed': 30}
+        {'hour': 1, 'speed': 20}
+        =>
+        {'hour': 1, 'p50': 20}
+    """
+
+    def __init__(self, column: str, quantiles: tp.Mapping[str, float], compression: float = 100) -> None:
+        """
+        :param column: column with numeric values
+        :param quantiles: quantile levels by result column name
+        :param compression: bigger value means more accurate quantiles
+        """
+        self.column = column
+        self.quantiles = quantiles
+        self.compression = compression
+
+    def reads(self) -> tp.Collection[str]:
+        return (self.column,)
+
+    def start(self) -> TDigest:
+        return TDigest(self.compression)
+
+    def update(self, state: TDigest, row: TRow) -> TDigest:
+        state.add(row[self.column])
+        return state
+
+    def merge(self, state_a: TDigest, state_b: TDigest) -> TDigest:
+        return state_a.merge(state_b)
+
+    def finish(self, group_key: tuple[str, ...], key_row: TRow, state: TDigest) -> TRowsGenerator:
+        new_row: TRow = {t: key_row[t] for t in group_key}
+        for result_column, q in self.quantiles.items():
+            new_row[result_column] = state.quantile(q)
+        yield new_row
@@ -0,0 +1,312 @@
+import math
+import typing as tp
+from itertools import takewhile
+
+from . import operations as ops
+from .executor import Pipe, Stage, count_consumers
+from .external_sort import ExternalSort
+from .statistics import Estimate, StageStatistics, fingerprint
+
+DEFAULT_MEMORY_ROWS = 100000
+DEFAULT_BLOOM_ROWS = 1000000
+UNKNOWN_ROWS = math.inf
+
+# Mappers which neither change values of columns nor add rows, so they keep order of rows
+_ORDER_PRESERVING_MAPPERS = (ops.DummyMapper, ops.Filter, ops.KeepColumns)
+
+
+def _source_name(operation: ops.Operation) -> str | None:
+    if isinstance(operation, (ops.ReadIterFactory, ops.ReadAsyncIterFactory)):
+        return operation.name
+    if isinstance(operation, ops.Read):
+        return operation.filename
+    return None
+
+
+def _union(a: set[str] | None, b: set[str] | None) -> set[str] | None:
+    return None if a is None or b is None else a | b
+
+
+def _input_columns(stage: Stage, columns: set[str] | None) -> list[set[str] | None]:
+    """
+    Columns of every input stage needs to give columns of its output, None if all of them
+    :param stage: consuming stage
+    :param columns: columns of stage output used downstream, None if all of them
+    """
+    operation = stage.operation
+    if isinstance(operation, ops.Map):
+        mapper = operation.mapper
+        if isinstance(mapper, ops.Project):
+            return [set(mapper.columns)]
+        reads, writes = mapper.reads(), mapper.writes()
+        if columns is None or reads is None or writes is None:
+            return [None]
+        return [columns - set(writes) | set(reads)]
+    if isinstance(operation, (ops.Reduce, ops.HashReduce)):
+        reads = operation.reducer.reads()
+        return [None if reads is None else set(operation.keys) | set(reads)]
+    if isinstance(operation, ExternalSort):
+        return [_union(columns, set(operation.keys))]
+    if isinstance(operation, (ops.Join, ops.HashJoin)):
+        needed = None if columns is None else operation.joiner.reads(columns) | set(operation.keys)
+        return [needed, needed]
+    return [None] * len(stage.inputs)
+
+
+def _is_prefix(prefix: tp.Sequence[str], keys: tp.Sequence[str]) -> bool:
+    return list(keys[:len(prefix)]) == list(prefix)
+
+
+class Planner:
+    """
+    Cost-based choice of physical operations for execution DAG.
+    Joins with small enough side become HashJoin with that side as build side, sort of build side is dropped.
+    Sorted Reduce with aggregator becomes HashReduce without sort if its result is sorted again anyway.
+    Sorts of rows which are already in that order are dropped.
+    Rows of the bigger side of join which can not find a match are dropped by Bloom filter of the smaller side
+    keys before they are sorted.
+    Filters which declare columns they read are applied before sorts, mappers not changing these columns
+    and reduces grouping by them.
+    Columns not used downstream are dropped from rows before they are sorted or joined.
+    Hash operations fall back to sorting at run time if they get more rows than planned for.
+    """
+
+    def __init__(self, size_hints: tp.Mapping[str, int] | None = None,
+                 statistics: tp.Mapping[str, Estimate] | None = None,
+                 memory_rows: int = DEFAULT_MEMORY_ROWS,
+                 stage_statistics: tp.Mapping[str, StageStatistics] | None = None,
+                 bloom_rows: int = DEFAULT_BLOOM_ROWS) -> None:
+        """
+        :param size_hints: number of rows by source name (kwarg name or filename)
+        :param statistics: estimates by source name, override size hints
+        :param memory_rows: number of rows hash operations are allowed to keep in memory
+        :param stage_statistics: statistics observed by previous runs by stage fingerprint, override estimates
+        :param bloom_rows: max expected rows of smaller side of join to build Bloom filter of
+        """
+        self.statistics = {name: Estimate(rows) for name, rows in (size_hints or {}).items()}
+        self.statistics.update(statistics or {})
+        self.memory_rows = memory_rows
+        self.stage_statistics = stage_statistics or {}
+        self.bloom_rows = bloom_rows
+        self._fingerprints: dict[Stage, str] = {}
+        self._origins: dict[Stage, Stage] = {}
+
+    def estimate(self, stage: Stage) -> Estimate:
+        """
+        Propagate estimates from sources through stage inputs
+        :param stage: stage to estimate output of
+        """
+        if self.stage_statistics:
+            observed = self.stage_statistics.get(fingerprint(stage, self._fingerprints))
+            if observed is not None:
+                return observed.estimate()
+
+        operation = stage.operation
+        if not stage.inputs:
+            name = _source_name(operation)
+            return self.statistics.get(name, Estimate(UNKNOWN_ROWS)) if name is not None else Estimate(UNKNOWN_ROWS)
+
+        inputs = [self.estimate(stage_input) for stage_input in stage.inputs]
+        if isinstance(operation, (ops.Reduce, ops.HashReduce)):
+            groups = inputs[0].groups(operation.keys)
+            return Estimate(groups, {k: min(v, groups) for k, v in inputs[0].distinct.items()})
+        if isinstance(operation, (ops.Join, ops.HashJoin)):
+            return Estimate(max(estimate.rows for estimate in inputs))
+        return inputs[0]
+
+    def order(self, stage: Stage) -> list[str]:
+        """
+        Keys rows of stage output are known to be ascending by
+        :param stage: stage to check
+        """
+        operation = stage.operation
+        if isinstance(operation, ExternalSort):
+            return [key for key, _ in takewhile(lambda item: not item[1], zip(operation.keys, operation.descending))]
+        if isinstance(operation, ops.Map) and isinstance(operation.mapper, _ORDER_PRESERVING_MAPPERS) \
+                or isinstance(operation, (ops.BloomSemiJoin, ops.Limit, Pipe)):
+            return self.order(stage.inputs[0])
+        if isinstance(operation, ops.Reduce) and _is_prefix(operation.keys, self.order(stage.inputs[0])):
+            return list(operation.keys)
+        return []
+
+    def optimize(self, outputs: tp.Mapping[str, Stage]) -> dict[str, Stage]:
+        """
+        Build optimized DAG, original stages are left intact
+        :param outputs: output stages by name
+        """
+        outputs = self._project_early(self._push_filters(outputs))
+        consumers = count_consumers(outputs.values())
+        consumer_of = {stage_input: stage for stage in consumers for stage_input in stage.inputs}
+        optimized: dict[Stage, Stage] = {}
+
+        def rewrite(stage: Stage) -> Stage:
+            if stage not in optimized:
+                inputs = [rewrite(stage_input) for stage_input in stage.inputs]
+                optimized[stage] = self._rewrite(stage, inputs, consumers, consumer_of)
+                self._origins.setdefault(optimized[stage], stage)
+            return optimized[stage]
+
+        return {name: rewrite(stage) for name, stage in outputs.items()}
+
+    @staticmethod
+    def _push_filters(outputs: tp.Mapping[str, Stage]) -> dict[str, Stage]:
+        """Move filters upstream past single-consumer stages which keep values of filtered columns"""
+        consumers = count_consumers(outputs.values())
+        moved: dict[Stage, Stage] = {}
+        single: set[Stage] = set()
+
+        def passes(operation: ops.Operation, reads: tp.Collection[str]) -> bool:
+            if isinstance(operation, ExternalSort):
+                return operation.limit is None  # top n rows before filter are not top n after it
+            if isinstance(operation, ops.Map):
+                writes = operation.mapper.writes()
+                return writes is not None and not set(writes) & set(reads)
+            if isinstance(operation, (ops.Reduce, ops.HashReduce)):
+                return set(reads) <= set(operation.keys)
+            return False
+
+        def visit(stage: Stage) -> Stage:
+            if stage in moved:
+                return moved[stage]
+            operation = stage.operation
+            new_stage = Stage(operation, [visit(stage_input) for stage_input in stage.inputs])
+            reads = operation.mapper.reads() \
+                if isinstance(operation, ops.Map) and isinstance(operation.mapper, ops.Filter) else None
+            if reads is not None:
+                passed: list[ops.Operation] = []
+                below = new_stage.inputs[0]
+                while below in single and passes(below.operation, reads):
+                    passed.append(below.operation)
+                    below = below.inputs[0]
+                new_stage = Stage(operation, [below])
+                for passed_operation in reversed(passed):
+                    single.add(new_stage)
+                    new_stage = Stage(passed_operation, [new_stage])
+            if consumers[stage] == 1:
+                single.add(new_stage)
+            moved[stage] = new_stage
+            return new_stage
+
+        return {name: visit(stage) for name, stage in outputs.items()}
+
+    @staticmethod
+    def _project_early(outputs: tp.Mapping[str, Stage]) -> dict[str, Stage]:
+        """Put KeepColumns of columns used downstream under sorts and joins"""
+        ordered: list[Stage] = []
+        visited: set[Stage] = set()
+
+        def order(stage: Stage) -> None:
+            if stage not in visited:
+                visited.add(stage)
+                for stage_input in stage.inputs:
+                    order(stage_input)
+                ordered.append(stage)
+
+        for output in outputs.values():
+            order(output)
+
+        used: dict[Stage, set[str] | None] = {output: None for output in outputs.values()}
+        needed: dict[Stage, list[set[str] | None]] = {}
+        for stage in reversed(ordered):
+            needed[stage] = _input_columns(stage, used.get(stage, set()))
+            for stage_input, columns in zip(stage.inputs, needed[stage]):
+                used[stage_input] = _union(used[stage_input], columns) if stage_input in used else columns
+
+        projected: dict[Stage, Stage] = {}
+
+        def visit(stage: Stage) -> Stage:
+            if stage not in projected:
+                operation = stage.operation
+                inputs = [visit(stage_input) for stage_input in stage.inputs]
+                if isinstance(operation, (ExternalSort, ops.Join, ops.HashJoin)):
+                    for i, columns in enumerate(needed[stage]):
+                        below = inputs[i].operation
+                        if columns is None or isinstance(below, ExternalSort) \
+                                or isinstance(below, ops.Map) and isinstance(below.mapper, ops.Project) \
+                                and set(below.mapper.columns) <= columns:
+                            continue
+                        inputs[i] = Stage(ops.Map(ops.KeepColumns(columns)), [inputs[i]])
+                projected[stage] = Stage(operation, inputs)
+            return projected[stage]
+
+        return {name: visit(stage) for name, stage in outputs.items()}
+
+    def _rewrite(self, stage: Stage, inputs: list[Stage], consumers: tp.Mapping[Stage, int],
+                 consumer_of: tp.Mapping[Stage, Stage]) -> Stage:
+        operation = stage.operation
+
+        if isinstance(operation, ExternalSort) and not operation.reverse \
+                and _is_prefix(operation.keys, self.order(inputs[0])):
+            return inputs[0]
+
+        if isinstance(operation, ops.Join):
+            self._push_semi_join(operation, inputs, consumers)
+            build = self._build_side(operation.joiner, inputs)
+            if build is not None:
+                side = 0 if build == "left" else 1
+                if isinstance(inputs[side].operation, ExternalSort) and consumers[stage.inputs[side]] == 1:
+                    inputs[side] = inputs[side].inputs[0]
+                return Stage(ops.HashJoin(operation.joiner, operation.keys, build, self.memory_rows), inputs)
+
+        if isinstance(operation, ops.Reduce) and isinstance(operation.reducer, ops.Aggregator) \
+                and isinstance(inputs[0].operation, ExternalSort) and consumers[stage.inputs[0]] == 1 \
+                and set(inputs[0].operation.keys) == set(operation.keys) \
+                and self._reordered(stage, consumers, consumer_of) \
+                and self.estimate(inputs[0]).groups(operation.keys) <= self.memory_rows:
+            return Stage(ops.HashReduce(operation.reducer, operation.keys, self.memory_rows), inputs[0].inputs)
+
+        return Stage(operation, inputs)
+
+    def _push_semi_join(self, operation: ops.Join, inputs: list[Stage], consumers: tp.Mapping[Stage, int]) -> None:
+        """Put BloomSemiJoin by keys of smaller join side under sorts of bigger side which only feed this join"""
+        if not operation.keys:
+            return
+        left, right = (self.estimate(stage_input).rows for stage_input in inputs)
+        if isinstance(operation.joiner, ops.InnerJoiner) and left != right:
+            filtered = 0 if left > right else 1
+        elif isinstance(operation.joiner, ops.LeftJoiner):
+            filtered = 1
+        elif isinstance(operation.joiner, ops.RightJoiner):
+            filtered = 0
+        else:
+            return
+        small, large = (right, left) if filtered == 0 else (left, right)
+        if not small < large or small > self.bloom_rows:
+            return
+
+        sorts: list[ops.Operation] = []
+        target = inputs[filtered]
+        while isinstance(target.operation, ExternalSort) and target in self._origins \
+                and consumers[self._origins[target]] == 1:
+            sorts.append(target.operation)
+            target = target.inputs[0]
+        other = inputs[1 - filtered]
+        while isinstance(other.operation, ExternalSort):
+            other = other.inputs[0]
+
+        stage = Stage(ops.BloomSemiJoin(operation.keys, int(small)), [target, other])
+        for sort in reversed(sorts):
+            stage = Stage(sort, [stage])
+        inputs[filtered] = stage
+
+    def _build_side(self, joiner: ops.Joiner, inputs: list[Stage]) -> str | None:
+        left, right = (self.estimate(stage_input).rows for stage_input in inputs)
+        if isinstance(joiner, ops.InnerJoiner):
+            candidates = ["left", "right"] if left < right else ["right", "left"]
+        elif isinstance(joiner, ops.LeftJoiner):
+            candidates = ["right"]
+        elif isinstance(joiner, ops.RightJoiner):
+            candidates = ["left"]
+        else:
+            return None
+        for side in candidates:
+            if (left if side == "left" else right) <= self.memory_rows:
+                return side
+        return None
+
+    @staticmethod
+    def _reordered(stage: Stage, consumers: tp.Mapping[Stage, int], consumer_of: tp.Mapping[Stage, Stage]) -> bool:
+        """Whether the only consumer of reduce sorts by all of its keys, so order of groups doesn't matter"""
+        consumer = consumer_of.get(stage)
+        return consumers[stage] == 1 and consumer is not None and isinstance(consumer.operation, ExternalSort) \
+            and set(stage.operation.keys) <= set(consumer.operation.keys)  # type: ignore[attr-defined]
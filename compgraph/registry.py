@@ -0,0 +1,66 @@
+"""
+Process wide metrics updated by operations while they run: bytes spilled to disk, running sort processes,
+queues of running pipes and waits of consumers of read-ahead files.
+Module depends on nothing of compgraph, so every module can report to it
+"""
+import threading
+import typing as tp
+import weakref
+from collections import Counter
+
+
+class Registry:
+    """Process wide metrics updated by operations while they run, cheap enough to be always on"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.spill_bytes: Counter[str] = Counter()
+        self.sort_workers = 0
+        self.pipe_queues: weakref.WeakSet[tp.Any] = weakref.WeakSet()
+        self.read_ahead_bytes = 0
+        self.read_ahead_stalls = 0
+        self.read_ahead_stall_seconds = 0.0
+
+    def add_spill_bytes(self, kind: str, n: int) -> None:
+        """
+        :param kind: what spilled: "fork" or "term_frequency"
+        :param n: bytes written to disk
+        """
+        with self._lock:
+            self.spill_bytes[kind] += n
+
+    def spilled(self) -> dict[str, int]:
+        """Bytes spilled to disk by kind"""
+        with self._lock:
+            return dict(self.spill_bytes)
+
+    def add_sort_workers(self, n: int) -> None:
+        """
+        :param n: number of sort processes started, negative when they are finished
+        """
+        with self._lock:
+            self.sort_workers += n
+
+    def add_read_ahead(self, bytes: int = 0, stalls: int = 0, stall_seconds: float = 0.0) -> None:
+        """
+        :param bytes: bytes read by reader thread
+        :param stalls: times consumer found no block read
+        :param stall_seconds: time consumer waited for blocks
+        """
+        with self._lock:
+            self.read_ahead_bytes += bytes
+            self.read_ahead_stalls += stalls
+            self.read_ahead_stall_seconds += stall_seconds
+
+    def read_ahead_totals(self) -> dict[str, float]:
+        """Bytes, stalls and stall_seconds of all read-ahead files"""
+        with self._lock:
+            return {"bytes": self.read_ahead_bytes, "stalls": self.read_ahead_stalls,
+                    "stall_seconds": self.read_ahead_stall_seconds}
+
+    def pipe_queue_batches(self) -> int:
+        """Number of batches waiting in queues of running pipes"""
+        return sum(batches.qsize() for batches in list(self.pipe_queues))
+
+
+REGISTRY = Registry()
@@ -0,0 +1,197 @@
+import os
+import pickle
+import struct
+import typing as tp
+
+from multiprocessing import Condition, resource_tracker, shared_memory
+
+from . import operations as ops
+
+DEFAULT_CAPACITY = 8 * 1024 * 1024
+DEFAULT_BLOCK_ROWS = 1024
+
+_HEADER = struct.Struct("QQ?")  # write position, read position, writer closed
+_FRAME = struct.Struct("I?")  # payload length, more chunks follow
+_WRAP = 0xFFFFFFFF
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # type: ignore[call-arg]
+    except TypeError:
+        # Before python 3.13 every attached segment is registered in resource tracker
+        # which unlinks it when the attaching process exits
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+        return shm
+
+
+class RingBuffer:
+    """
+    Single producer / single consumer ring buffer placed in shared memory.
+    Blocks are written into the ring once and the consumer reads them through memoryview
+    without copying through the kernel like multiprocessing.Pipe does.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        """
+        :param capacity: size of data region in bytes
+        """
+        if capacity < 4 * _FRAME.size:
+            raise ValueError("Ring buffer capacity is too small")
+        self.capacity = capacity
+        self._condition = Condition()
+        self._shm = shared_memory.SharedMemory(create=True, size=_HEADER.size + capacity)
+        self._owner_pid = os.getpid()
+        _HEADER.pack_into(self._shm.buf, 0, 0, 0, False)
+
+    def __getstate__(self) -> dict[str, tp.Any]:
+        return {"capacity": self.capacity, "condition": self._condition, "name": self._shm.name}
+
+    def __setstate__(self, state: dict[str, tp.Any]) -> None:
+        self.capacity = state["capacity"]
+        self._condition = state["condition"]
+        self._shm = _attach(state["name"])
+        self._owner_pid = -1
+
+    @property
+    def _max_chunk(self) -> int:
+        return self.capacity // 2 - _FRAME.size
+
+    def _positions(self) -> tuple[int, int, bool]:
+        return _HEADER.unpack_from(self._shm.buf, 0)
+
+    def _set_write(self, position: int) -> None:
+        struct.pack_into("Q", self._shm.buf, 0, position)
+
+    def _set_read(self, position: int) -> None:
+        struct.pack_into("Q", self._shm.buf, 8, position)
+
+    def _readable(self) -> bool:
+        write, read, closed = self._positions()
+        return write != read or closed
+
+    def _write_chunk(self, chunk: memoryview, more: bool) -> None:
+        size = len(chunk)
+        with self._condition:
+            write, _, _ = self._positions()
+            offset = write % self.capacity
+            tail = self.capacity - offset
+            skip = tail if tail < _FRAME.size + size else 0
+            need = skip + _FRAME.size + size
+            self._condition.wait_for(lambda: self.capacity - (write - self._positions()[1]) >= need)
+
+        base = _HEADER.size
+        if skip:
+            if tail >= _FRAME.size:
+                _FRAME.pack_into(self._shm.buf, base + offset, _WRAP, False)
+            offset = 0
+        _FRAME.pack_into(self._shm.buf, base + offset, size, more)
+        start = base + offset + _FRAME.size
+        self._shm.buf[start:start + size] = chunk
+
+        with self._condition:
+            self._set_write(write + skip + _FRAME.size + size)
+            self._condition.notify_all()
+
+    def write(self, payload: bytes | bytearray | memoryview) -> None:
+        """
+        Write one block, blocks bigger than half of the ring are split into chunks
+        :param payload: serialized block
+        """
+        view = memoryview(payload).cast("B")
+        chunk = self._max_chunk
+        for start in range(0, max(len(view), 1), chunk):
+            self._write_chunk(view[start:start + chunk], start + chunk < len(view))
+
+    def read(self, consumer: tp.Callable[[memoryview], tp.Any]) -> tp.Any:
+        """
+        Pass next block to consumer as a view over shared memory and release it afterwards
+        :param consumer: function of block view; the view is only valid during the call
+        :return: consumer result or None when writer is closed and ring is drained
+        """
+        parts: list[bytes] = []
+        while True:
+            with self._condition:
+                self._condition.wait_for(self._readable)
+                write, read, _ = self._positions()
+                if write == read:
+                    return None
+
+            base = _HEADER.size
+            offset = read % self.capacity
+            tail = self.capacity - offset
+            skip = 0
+            if tail < _FRAME.size or _FRAME.unpack_from(self._shm.buf, base + offset)[0] == _WRAP:
+                skip, offset = tail, 0
+            size, more = _FRAME.unpack_from(self._shm.buf, base + offset)
+            start = base + offset + _FRAME.size
+
+            view = self._shm.buf[start:start + size]
+            try:
+                if more or parts:
+                    parts.append(bytes(view))
+                    result = None if more else consumer(memoryview(b"".join(parts)))
+                else:
+                    result = consumer(view)
+            finally:
+                view.release()
+
+            with self._condition:
+                self._set_read(read + skip + _FRAME.size + size)
+                self._condition.notify_all()
+            if not more:
+                return result
+
+    def close_writer(self) -> None:
+        """Mark end of stream, reader gets None after draining the ring"""
+        with self._condition:
+            struct.pack_into("?", self._shm.buf, 16, True)
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """Detach from shared memory; the creating process also frees the segment"""
+        self._shm.close()
+        if self._owner_pid == os.getpid():
+            self._shm.unlink()
+
+
+def send_rows(ring: RingBuffer, rows: ops.TRowsIterable, block_rows: int = DEFAULT_BLOCK_ROWS) -> int:
+    """
+    Serialize rows in blocks into ring and close it for writing
+    :param ring: ring to write to
+    :param rows: rows to send
+    :param block_rows: number of rows pickled together
+    :return: number of rows sent
+    """
+    count = 0
+    block: list[ops.TRow] = []
+    for row in rows:
+        block.append(row)
+        if len(block) >= block_rows:
+            write_block(ring, block)
+            count += len(block)
+            block = []
+    if block:
+        write_block(ring, block)
+        count += len(block)
+    ring.close_writer()
+    return count
+
+
+def write_block(ring: RingBuffer, block: list[ops.TRow]) -> None:
+    """
+    Serialize rows into ring as one block, read by iter_rows
+    :param ring: ring to write to
+    :param block: rows to send
+    """
+    ring.write(pickle.dumps(block, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def iter_rows(ring: RingBuffer) -> ops.TRowsGenerator:
+    """
+    Read rows sent by send_rows until the writer closes the ring
+    :param ring: ring to read from
+    """
+    while (block := ring.read(pickle.loads)) is not None:
+        yield from block
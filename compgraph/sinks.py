@@ -0,0 +1,210 @@
+"""
+Output of rows to files: rows are serialized in blocks (JSON lines or CSV), blocks are compressed
+and written by a thread per output file, so compression and disk writes overlap with running the graph
+"""
+import bz2
+import csv
+import gzip
+import io
+import json
+import lzma
+import os
+import queue
+import threading
+import typing as tp
+from dataclasses import dataclass, field
+
+from . import operations as ops
+
+SINK_BLOCK_ROWS = 4096
+SINK_QUEUE_BLOCKS = 4
+BUFFER_BYTES = 1 << 20
+
+_COMPRESSIONS: dict[str, tp.Callable[[str], tp.BinaryIO]] = {
+    "gzip": lambda path: tp.cast(tp.BinaryIO, gzip.open(path, "wb", compresslevel=6)),
+    "bz2": lambda path: tp.cast(tp.BinaryIO, bz2.open(path, "wb")),
+    "xz": lambda path: tp.cast(tp.BinaryIO, lzma.open(path, "wb")),
+}
+_EXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz"}
+
+
+@dataclass
+class WriteStats:
+    """What sink has written"""
+    rows: int = 0
+    bytes: int = 0  # serialized rows before compression
+    files: list[str] = field(default_factory=list)
+    file_bytes: int = 0  # size of written files
+
+
+class JsonLinesFormat:
+    """One JSON object per line"""
+
+    def __init__(self, columns: tp.Sequence[str] | None = None) -> None:
+        """
+        :param columns: columns to write, all columns of row if None
+        """
+        self.columns = columns
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def header(self) -> bytes:
+        return b""
+
+    def block(self, rows: list[ops.TRow]) -> bytes:
+        encode = self._encode
+        if self.columns is not None:
+            columns = self.columns
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        return "".join([encode(row) + "\n" for row in rows]).encode()
+
+
+class CsvFormat:
+    """Comma separated values with header line, columns of the first row if not given"""
+
+    def __init__(self, columns: tp.Sequence[str] | None = None) -> None:
+        """
+        :param columns: columns to write, missing values are empty
+        """
+        self.columns = columns
+
+    def start(self, row: ops.TRow) -> None:
+        """
+        :param row: the first row, gives columns if they are not set
+        """
+        if self.columns is None:
+            self.columns = list(row)
+
+    def _writer(self, buffer: io.StringIO) -> csv.DictWriter:  # type: ignore[type-arg]
+        return csv.DictWriter(buffer, tp.cast(tp.Sequence[str], self.columns), extrasaction="ignore",
+                              lineterminator="\n")
+
+    def header(self) -> bytes:
+        if self.columns is None:
+            return b""
+        buffer = io.StringIO()
+        self._writer(buffer).writeheader()
+        return buffer.getvalue().encode()
+
+    def block(self, rows: list[ops.TRow]) -> bytes:
+        buffer = io.StringIO()
+        self._writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+
+def _split_extension(filename: str) -> tuple[str, str | None]:
+    root, extension = os.path.splitext(filename)
+    if extension in _EXTENSIONS:
+        return root, _EXTENSIONS[extension]
+    return filename, None
+
+
+def _open(path: str, compression: str | None) -> tp.BinaryIO:
+    if compression is None:
+        return tp.cast(tp.BinaryIO, open(path, "wb", buffering=BUFFER_BYTES))
+    if compression not in _COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {sorted(_COMPRESSIONS)}")
+    return _COMPRESSIONS[compression](path)
+
+
+class _FileWriter(threading.Thread):
+    """Thread writing blocks from bounded queue to one file; after failure it drops blocks till the end"""
+
+    def __init__(self, path: str, compression: str | None) -> None:
+        super().__init__(daemon=True)
+        self.path = path
+        self.compression = compression
+        self.blocks: queue.Queue[bytes | None] = queue.Queue(maxsize=SINK_QUEUE_BLOCKS)
+        self.error: BaseException | None = None
+
+    def run(self) -> None:
+        try:
+            with _open(self.path, self.compression) as f:
+                while (block := self.blocks.get()) is not None:
+                    f.write(block)
+        except BaseException as e:
+            self.error = e
+            while self.blocks.get() is not None:
+                pass
+
+
+def shard_filenames(filename: str, shards: int) -> list[str]:
+    """
+    :param filename: name of output file, has to contain "{shard}" for several shards
+    :param shards: number of output files
+    """
+    if shards == 1:
+        return [filename]
+    if "{shard}" not in filename:
+        raise ValueError("Name of sharded output has to contain {shard}")
+    return [filename.format(shard=f"{shard:05d}") for shard in range(shards)]
+
+
+def write_rows(rows: ops.TRowsIterable, filename: str, format: str | None = None, compression: str | None = None,
+               shards: int = 1, columns: tp.Sequence[str] | None = None,
+               block_rows: int = SINK_BLOCK_ROWS) -> WriteStats:
+    """
+    Write rows to file or shard files, blocks of rows go to shards in turn
+    :param rows: rows to write
+    :param filename: name of output file, "{shard}" in it is replaced with shard number
+    :param format: "jsonl" or "csv", by extension of filename if None (csv for .csv, jsonl otherwise)
+    :param compression: "gzip", "bz2" or "xz", by extension of filename if None (.gz, .bz2, .xz)
+    :param shards: number of files to write in parallel
+    :param columns: columns to write, all columns of row for jsonl and columns of the first row for csv if None
+    :param block_rows: number of rows serialized together
+    """
+    root, inferred = _split_extension(filename)
+    compression = compression or inferred
+    format = format or ("csv" if os.path.splitext(root)[1] == ".csv" else "jsonl")
+    serializer: JsonLinesFormat | CsvFormat
+    if format == "jsonl":
+        serializer = JsonLinesFormat(columns)
+    elif format == "csv":
+        serializer = CsvFormat(columns)
+    else:
+        raise ValueError(f"Unknown format {format!r}, expected 'jsonl' or 'csv'")
+
+    stats = WriteStats(files=shard_filenames(filename, shards))
+    writers = [_FileWriter(path, compression) for path in stats.files]
+    for writer in writers:
+        writer.start()
+
+    def put(writer: _FileWriter, block: bytes) -> None:
+        if writer.error is not None:
+            raise writer.error
+        writer.blocks.put(block)
+        stats.bytes += len(block)
+
+    try:
+        rows = iter(rows)
+        block: list[ops.TRow] = []
+        first = next(rows, None)
+        if first is not None and isinstance(serializer, CsvFormat):
+            serializer.start(first)
+        header = serializer.header()
+        if header:
+            for writer in writers:
+                put(writer, header)
+        if first is not None:
+            block.append(first)
+        shard = 0
+        for row in rows:
+            block.append(row)
+            if len(block) >= block_rows:
+                put(writers[shard], serializer.block(block))
+                stats.rows += len(block)
+                block = []
+                shard = (shard + 1) % shards
+        if block:
+            put(writers[shard], serializer.block(block))
+            stats.rows += len(block)
+    finally:
+        for writer in writers:
+            writer.blocks.put(None)
+        for writer in writers:
+            writer.join()
+
+    for writer in writers:
+        if writer.error is not None:
+            raise writer.error
+    stats.file_bytes = sum(os.path.getsize(path) for path in stats.files)
+    return stats
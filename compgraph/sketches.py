@@ -0,0 +1,277 @@
+import base64
+import hashlib
+import math
+import operator
+import typing as tp
+from array import array
+
+
+def stable_hash(value: tp.Any) -> int:
+    """64-bit hash of value which is the same in every process (unlike hash of str)"""
+    return int.from_bytes(hashlib.blake2b(repr(value).encode(), digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    """
+    Estimation of number of distinct values in fixed memory (2 ** precision bytes)
+    with relative error about 1.04 / sqrt(2 ** precision)
+    """
+
+    def __init__(self, precision: int = 12) -> None:
+        """
+        :param precision: number of hash bits used to choose register
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError("Precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: tp.Any) -> None:
+        """
+        :param value: value to count
+        """
+        h = stable_hash(value)
+        index = h & ((1 << self.precision) - 1)
+        rest = h >> self.precision
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """
+        Sketch of union of both sets of values
+        :param other: sketch with the same precision
+        """
+        if other.precision != self.precision:
+            raise ValueError("Can not merge sketches with different precision")
+        result = HyperLogLog(self.precision)
+        result.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return result
+
+    def count(self) -> float:
+        """Estimated number of distinct values"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return estimate
+
+    def to_dict(self) -> dict[str, tp.Any]:
+        return {"precision": self.precision, "registers": base64.b64encode(bytes(self.registers)).decode()}
+
+    @staticmethod
+    def from_dict(data: tp.Mapping[str, tp.Any]) -> "HyperLogLog":
+        sketch = HyperLogLog(data["precision"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        return sketch
+
+
+class CountMinSketch:
+    """
+    Approximate counts of values in fixed memory (width * depth counters).
+    Estimates never underestimate, overestimate is at most 2 * total / width with probability 1 - 2 ** -depth
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4) -> None:
+        """
+        :param width: counters per row
+        :param depth: rows of counters, each with its own hash
+        """
+        self.width = width
+        self.depth = depth
+        self.table = [array("q", bytes(8 * width)) for _ in range(depth)]
+
+    def _indexes(self, value: tp.Any) -> tp.Iterator[int]:
+        digest = hashlib.blake2b(repr(value).encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        return ((h1 + i * h2) % self.width for i in range(self.depth))
+
+    def add(self, value: tp.Any, count: int = 1) -> int:
+        """
+        :param value: value to count
+        :param count: how many times to count it
+        :return: new estimate of value count
+        """
+        estimate = None
+        for row, index in zip(self.table, self._indexes(value)):
+            row[index] += count
+            estimate = row[index] if estimate is None else min(estimate, row[index])
+        return tp.cast(int, estimate)
+
+    def estimate(self, value: tp.Any) -> int:
+        """
+        :param value: value to get count of
+        """
+        return min(row[index] for row, index in zip(self.table, self._indexes(value)))
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        """
+        Sketch of counts of both sketches
+        :param other: sketch with the same width and depth
+        """
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Can not merge sketches of different size")
+        result = CountMinSketch(self.width, self.depth)
+        result.table = [array("q", map(operator.add, a, b)) for a, b in zip(self.table, other.table)]
+        return result
+
+    def to_dict(self) -> dict[str, tp.Any]:
+        return {"width": self.width, "depth": self.depth,
+                "table": [base64.b64encode(row.tobytes()).decode() for row in self.table]}
+
+    @staticmethod
+    def from_dict(data: tp.Mapping[str, tp.Any]) -> "CountMinSketch":
+        sketch = CountMinSketch(data["width"], data["depth"])
+        sketch.table = [array("q", base64.b64decode(row)) for row in data["table"]]
+        return sketch
+
+
+def _interpolate(x: float, x_a: float, y_a: float, x_b: float, y_b: float) -> float:
+    if x_b == x_a:
+        return y_b
+    return y_a + (y_b - y_a) * (x - x_a) / (x_b - x_a)
+
+
+class TDigest:
+    """
+    Approximate quantiles in memory proportional to compression, most accurate near the tails.
+    Values are clustered into centroids whose size is bounded by the arcsine scale function
+    """
+
+    def __init__(self, compression: float = 100) -> None:
+        """
+        :param compression: bigger value means more centroids and more accurate quantiles
+        """
+        self.compression = compression
+        self.means: list[float] = []
+        self.weights: list[float] = []
+        self.count: float = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self._buffer: list[tuple[float, float]] = []
+
+    def add(self, value: float, weight: float = 1) -> None:
+        """
+        :param value: value to add
+        :param weight: how many times to add it
+        """
+        self._buffer.append((value, weight))
+        self.count += weight
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def _scale(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0), 1) - 1)
+
+    def _compress(self) -> None:
+        if not self._buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        means, weights = [], []
+        mean, weight = points[0]
+        cumulative = 0.0
+        for next_mean, next_weight in points[1:]:
+            left, right = cumulative / self.count, (cumulative + weight + next_weight) / self.count
+            if self._scale(right) - self._scale(left) <= 1:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                cumulative += weight
+                mean, weight = next_mean, next_weight
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        """
+        Digest of values of both digests
+        :param other: digest to merge with
+        """
+        result = TDigest(self.compression)
+        result._buffer = list(zip(self.means, self.weights)) + self._buffer \
+            + list(zip(other.means, other.weights)) + other._buffer
+        result.count = self.count + other.count
+        result.minimum = min(self.minimum, other.minimum)
+        result.maximum = max(self.maximum, other.maximum)
+        result._compress()
+        return result
+
+    def quantile(self, q: float) -> float:
+        """
+        :param q: quantile level between 0 and 1
+        :return: estimated value of quantile, nan if digest is empty
+        """
+        self._compress()
+        if not self.means:
+            return math.nan
+        target = q * self.count
+        cumulative = 0.0
+        previous_center, previous_mean = 0.0, self.minimum
+        for mean, weight in zip(self.means, self.weights):
+            center = cumulative + weight / 2
+            if target < center:
+                return _interpolate(target, previous_center, previous_mean, center, mean)
+            cumulative += weight
+            previous_center, previous_mean = center, mean
+        return _interpolate(target, previous_center, previous_mean, self.count, self.maximum)
+
+    def to_dict(self) -> dict[str, tp.Any]:
+        self._compress()
+        return {"compression": self.compression, "means": self.means, "weights": self.weights,
+                "min": self.minimum, "max": self.maximum}
+
+    @staticmethod
+    def from_dict(data: tp.Mapping[str, tp.Any]) -> "TDigest":
+        digest = TDigest(data["compression"])
+        digest.means, digest.weights = list(data["means"]), list(data["weights"])
+        digest.count = sum(digest.weights)
+        digest.minimum, digest.maximum = data["min"], data["max"]
+        return digest
+
+
+class BloomFilter:
+    """Set membership test in fixed memory without false negatives"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        """
+        :param capacity: expected number of values
+        :param error_rate: probability of false positive when capacity values are added
+        """
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _indexes(self, value: tp.Any) -> tp.Iterator[int]:
+        digest = hashlib.blake2b(repr(value).encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value: tp.Any) -> None:
+        """
+        :param value: value to add
+        """
+        for index in self._indexes(value):
+            self.bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, value: tp.Any) -> bool:
+        return all(self.bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(value))
+
+    def merge(self, other: "BloomFilter") -> "BloomFilter":
+        """
+        Filter of union of both sets of values
+        :param other: filter of the same size
+        """
+        if (other.size, other.hashes) != (self.size, self.hashes):
+            raise ValueError("Can not merge filters of different size")
+        result = BloomFilter.__new__(BloomFilter)
+        result.size, result.hashes = self.size, self.hashes
+        result.bits = bytearray(a | b for a, b in zip(self.bits, other.bits))
+        return result
@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+import typing as tp
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from . import operations as ops
+from .executor import Pipe, Stage
+from .external_sort import ExternalSort
+from .sketches import HyperLogLog
+
+SAMPLE_EVERY = 8
+HISTOGRAM_SIZE = 64
+
+_SIMPLE_TYPES = (str, int, float, bool, type(None))
+
+
+@dataclass
+class Estimate:
+    """Expected size of stage output"""
+    rows: float
+    distinct: dict[tuple[str, ...], float] = field(default_factory=dict)
+
+    def groups(self, keys: tp.Sequence[str]) -> float:
+        """
+        Expected number of distinct values of keys
+        :param keys: group keys
+        """
+        if not keys:
+            return min(self.rows, 1)
+        return min(self.rows, self.distinct.get(tuple(sorted(keys)), self.rows))
+
+
+class ColumnStatistics:
+    """Min/max of numeric values and histogram of most frequent values of sampled rows"""
+
+    def __init__(self) -> None:
+        self.minimum: float | None = None
+        self.maximum: float | None = None
+        self.histogram: Counter[tp.Any] = Counter()
+
+    def sample(self, value: tp.Any) -> None:
+        """
+        :param value: value of column in sampled row
+        """
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            if self.minimum is None or value < self.minimum:
+                self.minimum = value
+            if self.maximum is None or value > self.maximum:
+                self.maximum = value
+        if isinstance(value, _SIMPLE_TYPES):
+            self.histogram[value] += 1
+            if len(self.histogram) > 2 * HISTOGRAM_SIZE:
+                self.histogram = Counter(dict(self.histogram.most_common(HISTOGRAM_SIZE)))
+
+    def to_dict(self) -> dict[str, tp.Any]:
+        return {"min": self.minimum, "max": self.maximum,
+                "histogram": [[value, count] for value, count in self.histogram.most_common(HISTOGRAM_SIZE)]}
+
+    @staticmethod
+    def from_dict(data: tp.Mapping[str, tp.Any]) -> "ColumnStatistics":
+        column = ColumnStatistics()
+        column.minimum, column.maximum = data["min"], data["max"]
+        column.histogram = Counter({value: count for value, count in data["histogram"]})
+        return column
+
+
+class StageStatistics:
+    """Row count, distinct counts of key columns and statistics of columns of stage output"""
+
+    def __init__(self, key_sets: tp.Iterable[tuple[str, ...]] = ()) -> None:
+        """
+        :param key_sets: keys to count distinct values of
+        """
+        self.rows = 0
+        self.distinct = {keys: HyperLogLog() for keys in key_sets}
+        self.columns: dict[str, ColumnStatistics] = defaultdict(ColumnStatistics)
+
+    def estimate(self) -> Estimate:
+        return Estimate(self.rows, {keys: sketch.count() for keys, sketch in self.distinct.items()})
+
+    def to_dict(self) -> dict[str, tp.Any]:
+        return {"rows": self.rows,
+                "distinct": [[list(keys), sketch.to_dict()] for keys, sketch in self.distinct.items()],
+                "columns": {name: column.to_dict() for name, column in self.columns.items()}}
+
+    @staticmethod
+    def from_dict(data: tp.Mapping[str, tp.Any]) -> "StageStatistics":
+        statistics = StageStatistics()
+        statistics.rows = data["rows"]
+        statistics.distinct = {tuple(keys): HyperLogLog.from_dict(sketch) for keys, sketch in data["distinct"]}
+        for name, column in data["columns"].items():
+            statistics.columns[name] = ColumnStatistics.from_dict(column)
+        return statistics
+
+
+class CollectStatistics(ops.Operation):
+    """Pass rows through unchanged, counting them into stage statistics"""
+
+    def __init__(self, statistics: StageStatistics, sample_every: int = SAMPLE_EVERY) -> None:
+        """
+        :param statistics: statistics to update
+        :param sample_every: rows to take column values and histograms from are every sample_every-th row
+        """
+        self.statistics = statistics
+        self.sample_every = sample_every
+
+    def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        statistics = self.statistics
+        sketches = list(statistics.distinct.items())
+        for row in rows:
+            for keys, sketch in sketches:
+                sketch.add(tuple(row.get(k) for k in keys))
+            if statistics.rows % self.sample_every == 0:
+                for column, value in row.items():
+                    statistics.columns[column].sample(value)
+            statistics.rows += 1
+            yield row
+
+
+def _describe(obj: tp.Any) -> str:
+    attributes = []
+    for name, value in sorted(vars(obj).items()):
+        if isinstance(value, (list, tuple)) and all(isinstance(item, _SIMPLE_TYPES) for item in value):
+            value = tuple(value)
+        elif not isinstance(value, _SIMPLE_TYPES):
+            continue
+        attributes.append(f"{name}={value!r}")
+    return f"{type(obj).__name__}({', '.join(attributes)})"
+
+
+def fingerprint(stage: Stage, cache: dict[Stage, str] | None = None) -> str:
+    """
+    Identity of rows set given by stage which is the same for the same graph built again.
+    Only logical content counts: sorts, dropping of unused columns, pipes and statistics collection are transparent,
+    hash and merge strategies of join and reduce are the same, joins are the same with or without semi-join filters
+    :param stage: stage to identify
+    :param cache: fingerprints of already seen stages
+    """
+    cache = {} if cache is None else cache
+    if stage in cache:
+        return cache[stage]
+
+    operation = stage.operation
+    if isinstance(operation, (ExternalSort, CollectStatistics, Pipe)) \
+            or isinstance(operation, ops.Map) and isinstance(operation.mapper, ops.KeepColumns):
+        result = fingerprint(stage.inputs[0], cache)
+    else:
+        if isinstance(operation, (ops.ReadIterFactory, ops.ReadAsyncIterFactory)):
+            description = f"Iter({operation.name!r})"
+        elif isinstance(operation, ops.Read):
+            description = f"Read({os.path.abspath(operation.filename)!r})"
+        elif isinstance(operation, ops.Map):
+            description = f"Map({_describe(operation.mapper)})"
+        elif isinstance(operation, (ops.Reduce, ops.HashReduce)):
+            description = f"Reduce({_describe(operation.reducer)}, {tuple(operation.keys)!r})"
+        elif isinstance(operation, (ops.Join, ops.HashJoin)):
+            description = f"Join({_describe(operation.joiner)}, {tuple(operation.keys)!r})"
+        else:
+            description = _describe(operation)
+        stage_inputs = stage.inputs
+        if isinstance(operation, (ops.Join, ops.HashJoin)):
+            # semi-join drops only rows without match, so join gives the same rows over its input
+            stage_inputs = [stage_input.inputs[0] if isinstance(stage_input.operation, ops.BloomSemiJoin)
+                            else stage_input for stage_input in stage_inputs]
+        inputs = ",".join(fingerprint(stage_input, cache) for stage_input in stage_inputs)
+        result = hashlib.sha1(f"{description}[{inputs}]".encode()).hexdigest()
+
+    cache[stage] = result
+    return result
+
+
+def _stages(output: Stage) -> list[Stage]:
+    stages: list[Stage] = []
+    stack, visited = [output], set()
+    while stack:
+        stage = stack.pop()
+        if stage not in visited:
+            visited.add(stage)
+            stages.append(stage)
+            stack.extend(stage.inputs)
+    return stages
+
+
+def instrument(output: Stage, sample_every: int = SAMPLE_EVERY) -> tuple[Stage, dict[str, StageStatistics]]:
+    """
+    Build DAG which collects statistics of stages output while running
+    :param output: output stage of DAG to instrument
+    :param sample_every: see CollectStatistics
+    :return: instrumented output stage and statistics by stage fingerprint, filled in during run
+    """
+    fingerprints: dict[Stage, str] = {}
+    key_sets: dict[str, set[tuple[str, ...]]] = defaultdict(set)
+    for stage in _stages(output):
+        keys = getattr(stage.operation, "keys", None)
+        if keys:
+            for stage_input in stage.inputs:
+                key_sets[fingerprint(stage_input, fingerprints)].add(tuple(sorted(keys)))
+
+    statistics: dict[str, StageStatistics] = {}
+    instrumented: dict[Stage, Stage] = {}
+
+    def visit(stage: Stage) -> Stage:
+        if stage not in instrumented:
+            new_stage = Stage(stage.operation, [visit(stage_input) for stage_input in stage.inputs])
+            key = fingerprint(stage, fingerprints)
+            if not isinstance(stage.operation, ExternalSort) and key not in statistics:
+                statistics[key] = StageStatistics(key_sets[key])
+                new_stage = Stage(CollectStatistics(statistics[key], sample_every), [new_stage])
+            instrumented[stage] = new_stage
+        return instrumented[stage]
+
+    return visit(output), statistics
+
+
+class StatisticsStore:
+    """
+    Statistics of graph runs saved in directory as json, one file per graph and identity of its input files
+    (path, size and modification time), so statistics of changed inputs are not used
+    """
+
+    def __init__(self, directory: str) -> None:
+        """
+        :param directory: directory to keep statistics in
+        """
+        self.directory = directory
+
+    def _path(self, output: Stage) -> str:
+        identities = []
+        for stage in _stages(output):
+            operation = stage.operation
+            if isinstance(operation, ops.Read) and os.path.exists(operation.filename):
+                stat = os.stat(operation.filename)
+                identities.append(f"{os.path.abspath(operation.filename)}:{stat.st_size}:{stat.st_mtime_ns}")
+        key = hashlib.sha1("|".join([fingerprint(output)] + sorted(identities)).encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, output: Stage) -> dict[str, StageStatistics]:
+        """
+        :param output: output stage of graph
+        :return: statistics by stage fingerprint saved by previous run, empty if there is none
+        """
+        path = self._path(output)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return {key: StageStatistics.from_dict(data) for key, data in json.load(f).items()}
+
+    def save(self, output: Stage, statistics: tp.Mapping[str, StageStatistics]) -> None:
+        """
+        :param output: output stage of graph
+        :param statistics: statistics by stage fingerprint
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(output)
+        with open(path + ".tmp", "w") as f:
+            json.dump({key: data.to_dict() for key, data in statistics.items()}, f)
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,68 @@
+import json
+import os
+import typing as tp
+
+import pytest
+
+from compgraph import algorithms, operations as ops
+from compgraph.distributed import file_splits, read_split, run_distributed
+from compgraph.graph import Graph
+
+
+def _write_docs(path: str, n: int) -> None:
+    words = ["Hello", "little", "world!", "Don't", "panic,", "WORLD"]
+    with open(path, "w") as f:
+        for i in range(n):
+            f.write(json.dumps({"doc_id": i, "text": " ".join(words[j % len(words)] for j in range(i % 7 + 1))}))
+            f.write("\n")
+
+
+def test_file_splits_cover_every_line_once(tmp_path: tp.Any) -> None:
+    path = os.path.join(tmp_path, "docs")
+    _write_docs(path, 50)
+    rows = [row for start, end in file_splits(path, 7) for row in read_split(path, json.loads, start, end)]
+    assert [row["doc_id"] for row in rows] == list(range(50))
+
+
+def test_word_count_by_workers(tmp_path: tp.Any) -> None:
+    path = os.path.join(tmp_path, "docs")
+    _write_docs(path, 300)
+    graph = algorithms.word_count_graph(path, "text", "count", json.loads)
+
+    result = list(run_distributed(graph, workers=3, splits_per_worker=2, block_rows=16))
+    assert result == list(graph.run())
+
+
+def test_reduce_crossing_partitions_is_rejected(tmp_path: tp.Any) -> None:
+    graph = Graph.graph_from_file(os.path.join(tmp_path, "docs"), json.loads) \
+        .sort(["text"]) \
+        .reduce(ops.Count("count"), [])
+    with pytest.raises(ValueError):
+        list(run_distributed(graph))
+
+
+def test_operation_over_all_rows_before_shuffle_is_rejected(tmp_path: tp.Any) -> None:
+    graph = Graph.graph_from_file(os.path.join(tmp_path, "docs"), json.loads) \
+        .window(ops.Count("n"), "doc_id", 2000)
+    with pytest.raises(ValueError, match="Only maps"):
+        list(run_distributed(graph))
+
+
+def test_limit_is_applied_once(tmp_path: tp.Any) -> None:
+    path = os.path.join(tmp_path, "docs")
+    _write_docs(path, 300)
+    graph = Graph.graph_from_file(path, json.loads).limit(5)
+    assert len(list(run_distributed(graph, workers=3))) == 5
+
+    graph = Graph.graph_from_file(path, json.loads).sort(["doc_id"], reverse=True).limit(5)
+    assert list(run_distributed(graph, workers=3)) == list(graph.run())
+
+
+def test_unpicklable_operation_is_rejected(tmp_path: tp.Any) -> None:
+    path = os.path.join(tmp_path, "docs")
+    _write_docs(path, 10)
+    graph = Graph.graph_from_file(path, json.loads) \
+        .map(ops.Function("text", lambda text: text.lower())) \
+        .sort(["text"])
+    with pytest.raises(ValueError, match="picklable"):
+        list(run_distributed(graph))
@@ -0,0 +1,127 @@
+import threading
+import time
+import typing as tp
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from compgraph import algorithms, operations as ops
+from compgraph.executor import CompiledPlan, Fork, Pipe, Stage
+from compgraph.graph import Graph
+
+
+def test_fork_spills_rows_of_lagging_consumer() -> None:
+    rows = [{"id": i} for i in range(100)]
+    fork = Fork(iter(rows), 2, buffer_rows=10)
+    first, second = fork.branch(), fork.branch()
+
+    assert [next(first) for _ in range(60)] == rows[:60]
+    assert [next(second) for _ in range(30)] == rows[:30]
+    assert list(first) == rows[60:]
+    assert list(second) == rows[30:]
+
+
+def test_fork_gives_copies_to_other_consumers() -> None:
+    fork = Fork(iter([{"id": 1}]), 2)
+    first, second = fork.branch(), fork.branch()
+
+    row = next(first)
+    row["id"] = 2
+    assert list(second) == [{"id": 1}]
+
+
+def test_pipe_runs_stages_before_it_on_own_thread() -> None:
+    threads = set()
+
+    def source() -> ops.TRowsGenerator:
+        for i in range(1000):
+            threads.add(threading.current_thread().name)
+            yield {"id": i}
+
+    rows = list(Pipe(batch_rows=16, depth=2)(source()))
+    assert rows == [{"id": i} for i in range(1000)]
+    assert threads == {"compgraph-pipe"}
+
+
+def test_pipe_stops_on_errors() -> None:
+    def failing() -> ops.TRowsGenerator:
+        yield {"id": 1}
+        raise KeyError("id")
+
+    with pytest.raises(KeyError):
+        list(Pipe(batch_rows=1)(failing()))
+
+    closed = threading.Event()
+
+    def endless() -> ops.TRowsGenerator:
+        try:
+            while True:
+                yield {"id": 1}
+        finally:
+            closed.set()
+
+    rows = Pipe(batch_rows=4, depth=1)(endless())
+    assert next(rows) == {"id": 1}
+    rows.close()
+    assert closed.is_set()
+
+
+def test_pipe_closes_while_source_blocks() -> None:
+    released, closed = threading.Event(), threading.Event()
+
+    def blocking() -> ops.TRowsGenerator:
+        try:
+            yield {"id": 1}
+            released.wait()
+            yield {"id": 2}
+        finally:
+            closed.set()
+
+    rows = tp.cast(ops.TRowsGenerator, Graph.graph_from_iter("rows").thread(batch_rows=1).run(rows=blocking))
+    assert next(rows) == {"id": 1}
+    start = time.perf_counter()
+    rows.close()
+    assert time.perf_counter() - start < 5
+    assert not closed.is_set()
+    released.set()
+    assert closed.wait(5)
+
+
+def test_pipelined_graph_gives_same_rows() -> None:
+    docs = [{"doc_id": i, "text": f"hello world {i % 7} little {i % 3}"} for i in range(200)]
+    graph = algorithms.word_count_graph("docs")
+    expected = list(graph.run(docs=lambda: iter(docs)))
+
+    plan = graph.pipelined(lambda stage: not stage.inputs or len(stage.inputs) > 1)
+    assert any(isinstance(stage.operation, Pipe) for stage in plan.stages())
+    assert list(plan.run(docs=lambda: iter(docs))) == expected
+
+    branches = Graph.graph_from_iter("docs").thread(batch_rows=8)
+    joined = branches.map(ops.Project(["doc_id"])).thread() \
+        .join(ops.InnerJoiner(), branches.map(ops.Project(["doc_id", "text"])).thread(), ["doc_id"])
+    result: list[tp.Any] = list(joined.run(docs=lambda: iter(docs)))
+    assert result == docs
+
+
+def test_compiled_plan_runs_concurrently() -> None:
+    plan = algorithms.word_count_graph("docs").compile()
+    inputs = [[{"doc_id": 1, "text": f"hello world {'little ' * i}"}] for i in range(20)]
+    expected = [list(algorithms.word_count_graph("docs").run(docs=lambda: iter(docs))) for docs in inputs]
+
+    def run(docs: list[ops.TRow]) -> list[ops.TRow]:
+        return list(plan.run(docs=lambda: iter(docs)))
+
+    with ThreadPoolExecutor(4) as pool:
+        assert list(pool.map(run, inputs)) == expected
+    assert plan.sources == {"docs"}
+    with pytest.raises(ValueError):
+        plan.run()
+
+
+def test_compiled_plan_shares_forked_stages() -> None:
+    branches = Graph.graph_from_iter("docs")
+    graph = branches.join(ops.InnerJoiner(), branches.map(ops.Project(["doc_id"])), ["doc_id"])
+    docs = [{"doc_id": i, "text": str(i)} for i in range(5)]
+    assert list(graph.compile().run(docs=lambda: iter(docs))) == docs
+    with pytest.raises(ValueError):
+        CompiledPlan({"result": Stage(ops.Join(ops.InnerJoiner(), ["doc_id"]), [])})
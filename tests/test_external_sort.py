@@ -0,0 +1,59 @@
+import multiprocessing
+import random
+
+import pytest
+
+from compgraph.external_sort import ExternalSort
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_parallel_sort_is_stable(reverse: bool) -> None:
+    generator = random.Random(7)
+    rows = [{"word": generator.choice("abcdefgh"), "n": generator.randrange(100), "i": i} for i in range(5000)]
+    expected = sorted(rows, key=lambda row: (row["word"], row["n"]), reverse=reverse)
+
+    result = list(ExternalSort(["word", "n"], reverse, workers=3, sample_rows=500)(iter(rows)))
+    assert result == expected
+
+
+def test_parallel_sort_of_small_input() -> None:
+    rows = [{"n": n} for n in [3, 1, 2]]
+    assert list(ExternalSort(["n"], False, workers=4)(iter(rows))) == [{"n": 1}, {"n": 2}, {"n": 3}]
+
+
+def test_parallel_sort_of_sorted_input() -> None:
+    rows = [{"n": n} for n in range(3000)]
+    assert list(ExternalSort(["n"], False, workers=2, sample_rows=100)(iter(rows))) == rows
+
+
+@pytest.mark.parametrize("transport,workers", [("pipe", 1), ("shm", 1), ("shm", 3)])
+def test_sort_with_direction_per_key(transport: str, workers: int) -> None:
+    generator = random.Random(11)
+    rows = [{"doc": generator.randrange(5), "pmi": generator.random(), "text": generator.choice("abc"), "i": i}
+            for i in range(2000)]
+    expected = sorted(sorted(sorted(rows, key=lambda row: row["text"]), key=lambda row: row["pmi"], reverse=True),
+                      key=lambda row: row["doc"])
+
+    sort = ExternalSort(["doc", "pmi", "text"], [False, True, False], transport=transport, workers=workers,
+                        sample_rows=100)
+    assert list(sort(iter(rows))) == expected
+
+
+def test_sort_directions_must_match_keys() -> None:
+    with pytest.raises(ValueError):
+        ExternalSort(["a", "b"], [True])
+
+
+def test_top_n_sort_is_stable() -> None:
+    rows = [{"a": i % 4, "b": i % 3, "id": i} for i in range(100)]
+    expected = sorted(sorted(rows, key=lambda row: row["b"], reverse=True), key=lambda row: row["a"])[:10]
+    assert list(ExternalSort(["a", "b"], reverse=[False, True], limit=10)(iter(rows))) == expected
+    assert list(ExternalSort(["a"], reverse=True, limit=5)(iter(rows))) == \
+        sorted(rows, key=lambda row: row["a"], reverse=True)[:5]
+
+
+def test_closed_sort_stops_process() -> None:
+    rows = ExternalSort(["id"], reverse=False)(iter([{"id": i} for i in range(20000, 0, -1)]))
+    assert next(rows) == {"id": 1}
+    rows.close()
+    assert not multiprocessing.active_children()
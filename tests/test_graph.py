@@ -1,7 +1,14 @@
+import asyncio
 import json
+import os
+import threading
+import time
+import typing as tp
+
+import pytest
 
 from compgraph.graph import Graph
-from compgraph import operations as ops
+from compgraph import algorithms, operations as ops
 
 
 def test_graph_from_iter() -> None:
@@ -80,3 +87,181 @@ def test_graph_join() -> None:
     graph_join = graph_a.join(ops.InnerJoiner(), graph_b, ["word"])
 
     assert list(graph_join.run(tab_a=lambda: iter(tab_a), tab_b=lambda: iter(tab_b))) == expected
+
+
+def test_graph_branches_do_not_change_parent() -> None:
+    rows = [{"word": "b", "num": 1}, {"word": "a", "num": 2}]
+    graph = Graph.graph_from_iter("rows")
+    doubled = graph.map(ops.Function("num", lambda x: x * 2))
+    graph.sort(["word"])
+
+    assert list(graph.run(rows=lambda: iter(rows))) == rows
+    assert [row["num"] for row in doubled.run(rows=lambda: iter(rows))] == [2, 4]
+
+
+def test_graph_join_of_branches_runs_prefix_once() -> None:
+    calls = []
+
+    def lower(word: str) -> str:
+        calls.append(word)
+        return word.lower()
+
+    rows = [{"word": "A"}, {"word": "b"}, {"word": "a"}]
+    words = Graph.graph_from_iter("rows").map(ops.Function("word", lower)).sort(["word"])
+    counts = words.reduce(ops.Count("count"), ["word"])
+    graph = words.join(ops.InnerJoiner(), counts, ["word"])
+
+    assert list(graph.run(rows=lambda: iter(rows))) == [
+        {"word": "a", "count": 2}, {"word": "a", "count": 2}, {"word": "b", "count": 1}
+    ]
+    assert len(calls) == len(rows)
+
+
+def test_graph_from_followed_file_reads_appended_lines(tmp_path: tp.Any) -> None:
+    filename = os.path.join(tmp_path, "log")
+    with open(filename, "w") as f:
+        f.write(json.dumps({"n": 0}) + "\n" + '{"n":')
+
+    def append() -> None:
+        time.sleep(0.05)
+        with open(filename, "a") as f:
+            f.write(" 1}\n" + json.dumps({"n": 2}) + "\n")
+
+    writer = threading.Thread(target=append)
+    writer.start()
+    graph = Graph.graph_from_followed_file(filename, json.loads, poll_interval=0.01, idle_timeout=0.3)
+    assert list(graph.run()) == [{"n": 0}, {"n": 1}, {"n": 2}]
+    writer.join()
+
+
+def test_graph_keeps_different_reads_of_same_file(tmp_path: tp.Any) -> None:
+    filename = os.path.join(tmp_path, "rows")
+    with open(filename, "w") as f:
+        f.write(json.dumps({"n": 0}) + "\n")
+
+    plain = Graph.graph_from_file(filename, json.loads)
+    for other in (Graph.graph_from_followed_file(filename, json.loads, idle_timeout=0.1),
+                  Graph.graph_from_file(filename, json.loads, read_ahead=2),
+                  Graph.graph_from_file(filename, json.loads, parse_workers=2)):
+        graph = plain.join(ops.InnerJoiner(), other, ["n"])
+        sources = [stage.operation for stage in graph.optimize().stages() if not stage.inputs]
+        assert [type(operation) for operation in sources] == [ops.Read, type(other.optimize().output.operation)]
+        assert list(graph.run()) == [{"n": 0}]
+
+
+def test_graph_window_average_speed() -> None:
+    lengths = [{"start": [37.84870228730142, 55.73853974696249], "end": [37.8490418381989, 55.73832445777953],
+                "edge_id": 1}]
+    times = [
+        {"enter_time": "20171020T090547.463000", "leave_time": "20171020T090548.939000", "edge_id": 1},
+        {"enter_time": "20171020T091000", "leave_time": "20171020T091002", "edge_id": 1},
+        {"enter_time": "20171020T112237.427000", "leave_time": "20171020T112238.723000", "edge_id": 1},
+    ]
+    graph = algorithms.yandex_maps_window_graph("travel_time", "edge_length", 3600)
+    result = list(graph.run(travel_time=lambda: iter(times), edge_length=lambda: iter(lengths)))
+
+    hour = 3600
+    start = ops.timestamp("20171020T090000")
+    assert [(row["window_start"], row["window_end"]) for row in result] == [
+        (start, start + hour), (start + 2 * hour, start + 3 * hour)
+    ]
+    # speed of the first ride is 78.107 km/h, both rides in the first hour have the same length
+    assert result[0]["speed"] == pytest.approx(78.107 * 1.476 * 2 / 3.476, rel=0.001)
+
+
+async def _async_rows(rows: list[ops.TRow]) -> tp.AsyncGenerator[ops.TRow, None]:
+    for row in rows:
+        await asyncio.sleep(0)
+        yield row
+
+
+def test_graph_from_async_iter_arun() -> None:
+    docs = [{"word": w} for w in ["b", "a", "c", "a"]]
+    expected = [{"word": "a", "count": 2}, {"word": "b", "count": 1}, {"word": "c", "count": 1}]
+
+    graph = Graph.graph_from_async_iter("docs").sort(["word"]).reduce(ops.Count("count"), ["word"])
+
+    async def collect() -> list[ops.TRow]:
+        return [row async for row in graph.arun(docs=lambda: _async_rows(docs))]
+
+    assert asyncio.run(collect()) == expected
+    assert list(graph.run(docs=lambda: _async_rows(docs))) == expected
+
+
+def test_graph_arun_with_sync_source() -> None:
+    rows = [{"word": "a", "num": i} for i in range(1000)]
+    graph = Graph.graph_from_iter("rows").map(ops.Filter(lambda row: row["num"] % 2 == 0))
+
+    async def collect() -> list[ops.TRow]:
+        return [row async for row in graph.arun(rows=lambda: iter(rows))]
+
+    assert asyncio.run(collect()) == rows[::2]
+
+
+def test_graph_arun_source_error() -> None:
+    async def broken() -> tp.AsyncGenerator[ops.TRow, None]:
+        yield {"word": "a"}
+        raise RuntimeError("queue is gone")
+
+    graph = Graph.graph_from_async_iter("docs")
+
+    async def collect() -> list[ops.TRow]:
+        return [row async for row in graph.arun(docs=broken)]
+
+    with pytest.raises(RuntimeError, match="queue is gone"):
+        asyncio.run(collect())
+
+
+def test_graph_run_many_reads_input_once() -> None:
+    docs = [
+        {"doc_id": 1, "text": "hello, my little WORLD"},
+        {"doc_id": 2, "text": "Hello, my little little hell"}
+    ]
+    reads = []
+
+    def source() -> tp.Iterator[ops.TRow]:
+        reads.append(1)
+        return iter(docs)
+
+    word_count = algorithms.word_count_graph("docs")
+    inverted_index = algorithms.inverted_index_graph("docs")
+    sink: list[ops.TRow] = []
+
+    results = Graph.run_many({"word_count": word_count, "inverted_index": inverted_index},
+                             {"inverted_index": sink.append}, docs=source)
+
+    assert len(reads) == 1
+    assert results == {"word_count": list(word_count.run(docs=lambda: iter(docs)))}
+    assert sink == list(inverted_index.run(docs=lambda: iter(docs)))
+
+
+def test_graph_run_many_shares_stages() -> None:
+    rows = [{"word": w} for w in ["b", "a", "c", "a"]]
+    calls = []
+
+    def lower(word: str) -> str:
+        calls.append(word)
+        return word.upper()
+
+    mapper = ops.Function("word", lower)
+    upper = Graph.graph_from_iter("rows").map(mapper)
+    count = Graph.graph_from_iter("rows").map(mapper).sort(["word"]).reduce(ops.Count("count"), ["word"])
+    first = Graph.graph_from_iter("rows").map(mapper).reduce(ops.FirstReducer(), [])
+
+    results = Graph.run_many({"count": count, "first": first, "all": upper}, rows=lambda: iter(rows))
+
+    assert calls == ["b", "a", "c", "a"]
+    assert results == {
+        "count": [{"word": "A", "count": 2}, {"word": "B", "count": 1}, {"word": "C", "count": 1}],
+        "first": [{"word": "B"}],
+        "all": [{"word": "B"}, {"word": "A"}, {"word": "C"}, {"word": "A"}],
+    }
+
+
+def test_limit_after_sort_is_top_n() -> None:
+    rows = [{"word": f"w{i % 10}", "count": i} for i in range(50)]
+    graph = Graph.graph_from_iter("rows").sort(["word", "count"], reverse=[False, True])
+    assert list(graph.limit(3).run(rows=lambda: iter(rows))) == \
+        [{"word": "w0", "count": 40}, {"word": "w0", "count": 30}, {"word": "w0", "count": 20}]
+    assert list(graph.run(rows=lambda: iter(rows)))[:3] == list(graph.limit(3).run(rows=lambda: iter(rows)))
+    assert len(list(Graph.graph_from_iter("rows").limit(7).run(rows=lambda: iter(rows)))) == 7
@@ -0,0 +1,48 @@
+import random
+
+from compgraph.keys import encode_key, encode_value, key_encoder, sort_rows
+
+
+def test_encoded_values_keep_order() -> None:
+    values = [-1e300, -2 ** 63, -5, -0.5, 0, 0.0, 1, True, 1.5, 2 ** 53, 2 ** 53 + 1, 2 ** 64, float("inf")]
+    encoded = [encode_value(value) for value in values]
+    assert encoded == sorted(encoded)
+    assert encode_value(0) == encode_value(-0.0) and encode_value(1) == encode_value(True)
+
+    words = ["", "a", "a\x00", "a\x00b", "ab", "b", "é", "ж"]
+    assert sorted(words, key=encode_value) == sorted(words)
+    assert encode_value(None) < encode_value(-1e300) < encode_value("")
+
+
+def test_encoded_tuples_keep_order() -> None:
+    generator = random.Random(3)
+    keys = [(generator.choice(["", "a", "ab", "b"]), generator.randrange(-3, 3)) for _ in range(200)]
+    assert sorted(keys, key=encode_key) == sorted(keys)
+
+
+def test_sort_rows_integer_keys_are_stable() -> None:
+    generator = random.Random(5)
+    rows = [{"a": generator.randrange(3), "b": generator.randrange(-2 ** 63, 2 ** 63), "i": i} for i in range(1000)]
+    rows += [dict(row, i=-row["i"]) for row in rows[:100]]
+    for reverse in (False, True):
+        expected = sorted(rows, key=lambda row: (row["a"], row["b"]), reverse=reverse)
+        result = list(rows)
+        sort_rows(result, ["a", "b"], reverse)
+        assert result == expected
+
+
+def test_sort_rows_with_direction_per_key() -> None:
+    rows = [{"a": a, "b": b, "c": c} for a in range(3) for b in ("x", "y") for c in range(2)]
+    sort_rows(rows, ["b", "a", "c"], [True, False, True])
+    assert [(row["b"], row["a"], row["c"]) for row in rows[:3]] == [("y", 0, 1), ("y", 0, 0), ("y", 1, 1)]
+
+    integers = [{"a": a % 3, "b": a} for a in range(9)]
+    sort_rows(integers, ["a", "b"], [False, True])
+    assert [row["b"] for row in integers] == [6, 3, 0, 7, 4, 1, 8, 5, 2]
+
+
+def test_key_encoder_with_direction_per_key() -> None:
+    rows = [{"a": a, "b": b} for a in ("x", "xy", "y") for b in (-1.5, 0, 2)]
+    encoder = key_encoder(["a", "b"], [False, True])
+    assert sorted(rows, key=encoder) == sorted(sorted(rows, key=lambda row: row["b"], reverse=True),
+                                               key=lambda row: row["a"])
@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+import typing as tp
+import urllib.request
+
+from compgraph import algorithms, operations as ops
+from compgraph.executor import Fork
+from compgraph.graph import Graph
+from compgraph.metrics import MetricsExporter
+from compgraph.registry import REGISTRY
+
+
+def test_metrics_endpoint_and_snapshot(tmp_path: tp.Any) -> None:
+    docs = [{"doc_id": i, "text": "hello little world"} for i in range(10)]
+    snapshot_path = str(tmp_path / "metrics.json")
+    with MetricsExporter(port=0, snapshot_path=snapshot_path, interval=0.05) as exporter:
+        graph = algorithms.word_count_graph("docs")
+        assert len(list(graph.run_with_metrics(exporter, docs=lambda: iter(docs)))) == 3
+
+        assert exporter.address is not None
+        host, port = exporter.address
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics") as response:
+            text = response.read().decode()
+    assert 'compgraph_stage_rows_total{run="0",stage="0",operation="ReadIterFactory"} 10' in text
+    assert 'operation="Map(Split)"} 30' in text
+    assert "compgraph_sort_workers 0" in text
+
+    with open(snapshot_path) as f:
+        snapshot = json.load(f)
+    stages = snapshot["runs"][0]["stages"]
+    assert [stage["rows"] for stage in stages][-1] == 3
+    assert all(stage["state"] == "finished" for stage in stages)
+
+
+def test_reading_metrics_keeps_recent_rates() -> None:
+    docs = [{"doc_id": i, "text": "hello little world"} for i in range(10)]
+    exporter = MetricsExporter()
+    list(algorithms.word_count_graph("docs").run_with_metrics(exporter, docs=lambda: iter(docs)))
+    assert exporter.address is None
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("compgraph-metrics")]
+    exporter.sample()
+
+    first = exporter.snapshot()
+    text = exporter.prometheus()
+    second = exporter.snapshot()
+    recent = [stage["recent_rows_per_second"] for stage in first["runs"][0]["stages"]]
+    assert recent[0] > 0
+    assert recent == [stage["recent_rows_per_second"] for stage in second["runs"][0]["stages"]]
+    assert f'compgraph_stage_recent_rows_per_second{{run="0",stage="0",operation="ReadIterFactory"}} ' \
+           f'{recent[0]:.3f}' in text
+
+
+def test_registry_counts_spilled_bytes() -> None:
+    before = REGISTRY.spilled().get("fork", 0)
+    fork = Fork(iter([{"id": i} for i in range(10)]), 2, buffer_rows=2)
+    first, second = fork.branch(), fork.branch()
+    assert len(list(first)) == 10 and len(list(second)) == 10
+    assert REGISTRY.spilled().get("fork", 0) > before
+
+    before = REGISTRY.spilled().get("term_frequency", 0)
+    rows = [{"text": f"w{i}"} for i in range(10)]
+    list(ops.TermFrequency("text", max_words=2)((), iter(rows)))
+    assert REGISTRY.spilled().get("term_frequency", 0) > before
+
+
+def test_read_ahead_stalls_are_published(tmp_path: tp.Any) -> None:
+    filename = str(tmp_path / "docs.jsonl")
+    with open(filename, "w") as f:
+        f.write("\n".join(json.dumps({"doc_id": i, "text": "hello little world"}) for i in range(100)))
+
+    before = REGISTRY.read_ahead_totals()
+    rows = list(Graph.graph_from_file(filename, json.loads, read_ahead=2).run())
+    after = REGISTRY.read_ahead_totals()
+    assert len(rows) == 100
+    assert after["bytes"] - before["bytes"] == os.path.getsize(filename)
+    assert after["stalls"] >= before["stalls"] and after["stall_seconds"] >= before["stall_seconds"]
+
+    exporter = MetricsExporter()
+    assert exporter.snapshot()["read_ahead"]["bytes"] == after["bytes"]
+    assert f"compgraph_read_ahead_bytes_total {after['bytes']}" in exporter.prometheus()
+    assert "compgraph_read_ahead_stall_seconds_total" in exporter.prometheus()
@@ -1,5 +1,8 @@
 import copy
 import dataclasses
+import json
+import os
+import pickle
 import typing as tp
 
 import pytest
@@ -239,3 +242,138 @@ def test_reducer(case: ReduceCase) -> None:
     result = ops.Reduce(case.reducer, case.reducer_keys)(iter(case.data))
     assert isinstance(result, tp.Iterator)
     assert sorted(case.ground_truth, key=key_func) == sorted(result, key=key_func)
+
+
+def test_heavy_hitters() -> None:
+    words = ["a"] * 50 + ["b"] * 30 + ["c"] * 20 + [f"rare{i}" for i in range(100)]
+    rows = [{"text": word, "doc_id": i % 3} for i, word in enumerate(words)]
+    result = list(ops.HashReduce(ops.HeavyHitters("text", 3), [], max_groups=10)(iter(rows)))
+    assert [(row["text"], row["count"]) for row in result] == [("a", 50), ("b", 30), ("c", 20)]
+
+
+def test_approx_count_distinct_per_word() -> None:
+    rows = [{"text": word, "doc_id": doc_id} for doc_id in range(300) for word in ["all", "even"][:1 + doc_id % 2]]
+    result = ops.HashReduce(ops.ApproxCountDistinct("doc_id", "docs"), ["text"], max_groups=10)(iter(rows))
+    assert sorted(result, key=lambda row: row["text"]) == [
+        {"text": "all", "docs": approx(300, rel=0.05)},
+        {"text": "even", "docs": approx(150, rel=0.05)}
+    ]
+
+
+def test_approx_quantiles_merge_partial_states() -> None:
+    reducer = ops.ApproxQuantiles("speed", {"p50": 0.5, "p90": 0.9})
+    left, right = reducer.start(), reducer.start()
+    for speed in range(1, 501):
+        left = reducer.update(left, {"hour": 1, "speed": speed})
+        right = reducer.update(right, {"hour": 1, "speed": speed + 500})
+
+    state = reducer.merge(pickle.loads(pickle.dumps(left)), pickle.loads(pickle.dumps(right)))
+    assert list(reducer.finish(("hour",), {"hour": 1}, state)) == [
+        {"hour": 1, "p50": approx(500, rel=0.02), "p90": approx(900, rel=0.02)}
+    ]
+
+
+def test_tokenize_same_as_mapper_chain() -> None:
+    rows = [{"doc_id": 1, "text": "Hello, my little WORLD! Don't", "title": "a"}, {"doc_id": 2, "text": "..."}]
+    chain = [ops.FilterPunctuation("text"), ops.LowerCase("text"), ops.Split("text")]
+    expected: list[ops.TRow] = [dict(row) for row in rows]
+    for mapper in chain:
+        expected = [new_row for row in expected for new_row in mapper(row)]
+
+    result = [new_row for row in rows for new_row in ops.Tokenize("text", ["doc_id"])(dict(row))]
+    assert result == [{"doc_id": row["doc_id"], "text": row["text"]} for row in expected]
+
+
+def test_tokenize_options() -> None:
+    tokenize = ops.Tokenize("text", result_column="bigram", fold_unicode=True, stopwords=["the"], min_length=2,
+                            ngrams=2)
+    assert list(tokenize({"text": "The Café is a nice café"})) == [
+        {"bigram": "cafe is"}, {"bigram": "is nice"}, {"bigram": "nice cafe"}
+    ]
+
+
+def test_window_tumbling_emits_by_watermark() -> None:
+    window = ops.Window(ops.Count("n"), "t", 10, keys=["k"])
+    rows = [{"t": 1, "k": "a"}, {"t": 4, "k": "b"}, {"t": 3, "k": "a"}, {"t": 12, "k": "a"}, {"t": 25, "k": "a"}]
+
+    result = window(iter(rows))
+    assert next(result) == {"n": 2, "k": "a", "window_start": 0, "window_end": 10}
+    assert list(result) == [
+        {"n": 1, "k": "b", "window_start": 0, "window_end": 10},
+        {"n": 1, "k": "a", "window_start": 10, "window_end": 20},
+        {"n": 1, "k": "a", "window_start": 20, "window_end": 30}
+    ]
+
+
+def test_window_sliding_with_lateness() -> None:
+    window = ops.Window(ops.Sum("v"), "t", 10, slide=5, allowed_lateness=5)
+    rows = [{"t": 6, "v": 1}, {"t": 11, "v": 2}, {"t": 9, "v": 4}, {"t": 16, "v": 8}, {"t": 2, "v": 16}]
+    assert [(row["window_start"], row["v"]) for row in window(iter(rows))] == [
+        (0, 1), (0, 5), (5, 7), (10, 10), (15, 8)
+    ]
+
+
+def test_term_frequency_spills_words() -> None:
+    rows = [{"doc_id": 1, "text": f"w{i % 7}", "count": 1 + i % 3} for i in range(100)]
+    expected = list(ops.TermFrequency("text", count_column="count")((), iter(rows)))
+    result = list(ops.TermFrequency("text", count_column="count", max_words=3)((), iter(rows)))
+    assert [row["text"] for row in result] == sorted(row["text"] for row in expected)
+    assert sorted(result, key=lambda row: row["text"]) == approx(sorted(expected, key=lambda row: row["text"]))
+
+
+def test_read_parallel_keeps_order(tmp_path: tp.Any) -> None:
+    filename = str(tmp_path / "rows.jsonl")
+    rows = [{"doc_id": i, "text": f"word {i}"} for i in range(1000)]
+    with open(filename, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+    assert list(ops.ReadParallel(filename, json.loads, workers=2, block_lines=7, read_ahead=3)()) == rows
+    reader = ops.ReadParallel(filename, json.loads, workers=2, block_lines=10)()
+    assert next(reader) == rows[0]
+    reader.close()
+
+
+def test_read_ahead_splits_blocks_into_lines(tmp_path: tp.Any) -> None:
+    filename = str(tmp_path / "rows.jsonl")
+    rows = [{"doc_id": i, "text": "слово " * (i % 5)} for i in range(300)]
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write("\n".join(json.dumps(row, ensure_ascii=False) for row in rows))
+
+    reader = ops.ReadAhead(filename, json.loads, block_bytes=17, depth=2)
+    assert list(reader()) == rows
+    read_rows, stats = reader.run_with_stats()
+    other_rows, other_stats = reader.run_with_stats()
+    assert list(read_rows) == rows
+    assert stats.bytes == os.path.getsize(filename)
+    assert stats.blocks == -(-stats.bytes // 17)
+    assert other_stats.bytes == 0
+    other_rows.close()
+
+    rows_iter = reader()
+    assert next(rows_iter) == rows[0]
+    rows_iter.close()
+
+
+def test_key_getter_is_shared_by_keys() -> None:
+    row = {"a": 1, "b": "x", "c": None}
+    assert ops.key_getter(["a", "b"]) is ops.key_getter(("a", "b"))
+    assert ops.key_getter(["a", "b"])(row) == (1, "x")
+    assert ops.key_getter(["b"])(row) == "x"
+    assert ops.key_getter([])(row) == ()
+    assert pickle.loads(pickle.dumps(ops.key_getter(["a", "c"])))(row) == (1, None)
+
+
+def test_limit_closes_input() -> None:
+    closed = []
+
+    def source() -> ops.TRowsGenerator:
+        try:
+            for i in range(100):
+                yield {"id": i}
+        finally:
+            closed.append(True)
+
+    assert list(ops.Limit(3)(source())) == [{"id": 0}, {"id": 1}, {"id": 2}]
+    assert closed == [True]
+    assert list(ops.Limit(0)(iter([{"id": 0}]))) == []
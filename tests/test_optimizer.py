@@ -0,0 +1,175 @@
+import typing as tp
+from itertools import count, islice
+
+from compgraph import algorithms, operations as ops
+from compgraph.executor import Plan, Stage
+from compgraph.external_sort import ExternalSort
+from compgraph.graph import Graph
+from compgraph.optimizer import Planner
+from compgraph.statistics import Estimate
+
+
+def _operations(plan: Plan) -> list[tp.Any]:
+    return [stage.operation for stage in plan.stages()]
+
+
+def test_word_count_hash_aggregation() -> None:
+    docs = [
+        {"doc_id": 1, "text": "hello, my little WORLD"},
+        {"doc_id": 2, "text": "Hello, my little little hell"}
+    ]
+    graph = algorithms.word_count_graph("docs")
+    plan = graph.optimize(statistics={"docs": Estimate(2, {("text",): 5})})
+
+    operations = _operations(plan)
+    assert any(isinstance(operation, ops.HashReduce) for operation in operations)
+    assert sum(isinstance(operation, ExternalSort) for operation in operations) == 1
+    assert list(plan.run(docs=lambda: iter(docs))) == list(graph.run(docs=lambda: iter(docs)))
+
+
+def test_unknown_sizes_keep_plan() -> None:
+    graph = algorithms.word_count_graph("docs")
+    operations = _operations(graph.optimize())
+    assert not any(isinstance(operation, (ops.HashReduce, ops.HashJoin)) for operation in operations)
+
+
+def test_hash_join_drops_build_side_sort() -> None:
+    rows_a = [{"key": k, "a": i} for i, k in enumerate([3, 1, 2, 1])]
+    rows_b = [{"key": k, "b": i} for i, k in enumerate([2, 1, 4])]
+    graph = Graph.graph_from_iter("a").sort(["key"]) \
+        .join(ops.InnerJoiner(), Graph.graph_from_iter("b").sort(["key"]), ["key"])
+
+    plan = graph.optimize(size_hints={"a": 1000, "b": 3})
+
+    operations = _operations(plan)
+    assert [operation.build for operation in operations if isinstance(operation, ops.HashJoin)] == ["right"]
+    assert sum(isinstance(operation, ExternalSort) for operation in operations) == 1
+    kwargs = {"a": lambda: iter(rows_a), "b": lambda: iter(rows_b)}
+    assert list(plan.run(**kwargs)) == list(graph.run(**kwargs))
+
+
+def test_sort_of_sorted_rows_is_dropped() -> None:
+    graph = Graph.graph_from_iter("rows").sort(["word"]).reduce(ops.TopN("n", 1), ["word"]).sort(["word"])
+    assert sum(isinstance(operation, ExternalSort) for operation in _operations(graph.optimize())) == 1
+
+
+def test_hash_reduce_falls_back_to_sort() -> None:
+    rows = [{"word": w, "n": 1} for w in "c a b a d c a e".split()]
+    result = ops.HashReduce(ops.Sum("n"), ["word"], max_groups=2)(iter(rows))
+    assert sorted(result, key=lambda row: row["word"]) == [
+        {"n": 3, "word": "a"}, {"n": 1, "word": "b"}, {"n": 2, "word": "c"}, {"n": 1, "word": "d"},
+        {"n": 1, "word": "e"}
+    ]
+
+
+def test_hash_join_falls_back_to_merge_join() -> None:
+    rows_a = [{"key": k, "a": i} for i, k in enumerate([1, 2, 2, 3])]
+    rows_b = [{"key": k, "b": i} for i, k in enumerate([3, 2, 1, 2])]
+    expected = list(ops.HashJoin(ops.InnerJoiner(), ["key"])(iter(rows_a), iter(rows_b)))
+    result = list(ops.HashJoin(ops.InnerJoiner(), ["key"], max_rows=1)(iter(rows_a), iter(rows_b)))
+    assert len(expected) == 6
+    assert sorted(result, key=lambda row: (row["a"], row["b"])) == \
+        sorted(expected, key=lambda row: (row["a"], row["b"]))
+
+
+def test_unbounded_hash_join_streams_endless_probe() -> None:
+    build = [{"key": k, "b": k} for k in range(5)]
+    probe = ({"key": i % 5, "a": i} for i in count())
+    result = ops.HashJoin(ops.InnerJoiner(), ["key"], max_rows=None)(probe, iter(build))
+    assert [row["a"] for row in islice(result, 10)] == list(range(10))
+
+
+def test_semi_join_filter_goes_before_sort() -> None:
+    rows_a = [{"key": k % 50, "a": k} for k in range(200)]
+    rows_b = [{"key": k, "b": k} for k in (3, 1, 7)]
+    graph = Graph.graph_from_iter("a").sort(["key"]) \
+        .join(ops.InnerJoiner(), Graph.graph_from_iter("b").sort(["key"]), ["key"])
+
+    plan = graph.optimize(size_hints={"a": 200000, "b": 3}, memory_rows=1)
+
+    stages = plan.stages()
+    semi_join = [stage for stage in stages if isinstance(stage.operation, ops.BloomSemiJoin)]
+    assert len(semi_join) == 1
+    assert isinstance(semi_join[0].inputs[0].operation, ops.ReadIterFactory)
+    assert any(isinstance(stage.operation, ExternalSort) and stage.inputs == semi_join for stage in stages)
+    kwargs = {"a": lambda: iter(rows_a), "b": lambda: iter(rows_b)}
+    assert list(plan.run(**kwargs)) == list(graph.run(**kwargs))
+
+
+def test_semi_join_matches_int_and_float_keys() -> None:
+    rows_a = [{"key": k % 50, "a": k} for k in range(200)]
+    rows_b = [{"key": k, "b": k} for k in (3.0, 1.0, 7.0)]
+    graph = Graph.graph_from_iter("a").sort(["key"]) \
+        .join(ops.InnerJoiner(), Graph.graph_from_iter("b").sort(["key"]), ["key"])
+
+    plan = graph.optimize(size_hints={"a": 200000, "b": 3}, memory_rows=1)
+
+    kwargs = {"a": lambda: iter(rows_a), "b": lambda: iter(rows_b)}
+    expected = list(graph.run(**kwargs))
+    assert len(expected) == 12
+    assert list(plan.run(**kwargs)) == expected
+
+
+def test_bloom_semi_join() -> None:
+    rows = [{"key": k} for k in range(1000)]
+    result = list(ops.BloomSemiJoin(["key"], 10)(iter(rows), iter([{"key": 5}, {"key": 500}])))
+    assert {"key": 5} in result and {"key": 500} in result
+    assert len(result) < 50
+
+
+def test_filter_moves_before_sort_and_reduce() -> None:
+    graph = algorithms.pmi_graph("docs")
+    plan = graph.optimize()
+
+    names = []
+    stage = plan.output
+    while stage.inputs:
+        names.append(type(stage.operation).__name__ if not isinstance(stage.operation, ops.Map)
+                     else type(stage.operation.mapper).__name__)
+        stage = stage.inputs[0]
+    names = [name for name in names[::-1] if name != "KeepColumns"]
+    assert names[:7] == ["FilterPunctuation", "LowerCase", "Split", "Filter", "ExternalSort", "Reduce", "Filter"]
+
+    docs = [{"doc_id": 1, "text": "hello, little world"}, {"doc_id": 2, "text": "little little hello hello"}]
+    assert list(plan.run(docs=lambda: iter(docs))) == list(graph.run(docs=lambda: iter(docs)))
+
+
+def test_filter_without_columns_stays() -> None:
+    graph = Graph.graph_from_iter("rows").sort(["word"]).map(ops.Filter(lambda row: row["word"] != "a"))
+    assert isinstance(graph.optimize().output.operation, ops.Map)
+
+
+def test_filter_stays_after_limit() -> None:
+    rows = [{"n": n} for n in range(10)]
+    graph = Graph.graph_from_iter("rows").sort(["n"]).limit(3).map(ops.Filter(lambda row: row["n"] % 2, ["n"]))
+    assert list(graph.optimize().run(rows=lambda: iter(rows))) == [{"n": 1}]
+
+    top = Stage(ExternalSort(["n"], False, limit=3), [Stage(ops.ReadIterFactory("rows"))])
+    output = Planner().optimize({"result": Stage(ops.Map(ops.Filter(lambda row: row["n"] % 2, ["n"])), [top])})
+    assert list(Plan(output["result"]).run(rows=lambda: iter(rows))) == [{"n": 1}]
+
+
+def test_unused_columns_dropped_before_sort() -> None:
+    graph = algorithms.word_count_graph("docs")
+    plan = graph.optimize()
+
+    sorts = [stage for stage in plan.stages() if isinstance(stage.operation, ExternalSort)]
+    below = sorts[0].inputs[0].operation
+    assert isinstance(below, ops.Map) and isinstance(below.mapper, ops.KeepColumns)
+    assert set(below.mapper.columns) == {"text"}
+
+    docs = [{"doc_id": 1, "text": "hello, my little WORLD", "extra": [1, 2]}, {"doc_id": 2, "text": "Hello, my"}]
+    assert list(plan.run(docs=lambda: iter(docs))) == list(graph.run(docs=lambda: iter(docs)))
+
+
+def test_join_keeps_clashing_columns() -> None:
+    left = [{"id": 1, "x": "a", "y": 1}, {"id": 2, "x": "b", "y": 2}]
+    right = [{"id": 1, "x": "c", "z": 3}, {"id": 2, "x": "d", "z": 4}]
+    graph = Graph.graph_from_iter("left") \
+        .join(ops.InnerJoiner(), Graph.graph_from_iter("right"), ["id"]) \
+        .map(ops.Project(["id", "x_1"]))
+    plan = graph.optimize()
+
+    result = list(plan.run(left=lambda: iter(left), right=lambda: iter(right)))
+    assert result == list(graph.run(left=lambda: iter(left), right=lambda: iter(right)))
+    assert result == [{"id": 1, "x_1": "a"}, {"id": 2, "x_1": "b"}]
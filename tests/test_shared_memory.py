@@ -0,0 +1,37 @@
+from multiprocessing import Process
+
+from compgraph.external_sort import ExternalSort
+from compgraph.shared_memory import RingBuffer, iter_rows, send_rows
+
+
+def _produce(ring: RingBuffer, n: int) -> None:
+    send_rows(ring, ({"id": i, "text": "x" * (i % 50)} for i in range(n)), block_rows=7)
+    ring.close()
+
+
+def test_ring_buffer_between_processes() -> None:
+    ring = RingBuffer(capacity=1024)
+    process = Process(target=_produce, args=(ring, 1000))
+    process.start()
+    result = list(iter_rows(ring))
+    process.join()
+    ring.close()
+    assert result == [{"id": i, "text": "x" * (i % 50)} for i in range(1000)]
+
+
+def test_ring_buffer_splits_big_blocks() -> None:
+    ring = RingBuffer(capacity=256)
+    rows = [{"id": 1, "text": "a" * 5000}, {"id": 2, "text": "b"}]
+    process = Process(target=send_rows, args=(ring, rows))
+    process.start()
+    result = list(iter_rows(ring))
+    process.join()
+    ring.close()
+    assert result == rows
+
+
+def test_external_sort_shared_memory_transport() -> None:
+    rows = [{"word": w, "n": i} for i, w in enumerate("the quick brown fox jumps over the lazy dog".split())]
+    expected = list(ExternalSort(["word", "n"], reverse=True)(iter(rows)))
+    assert list(ExternalSort(["word", "n"], reverse=True, transport="shm")(iter(rows))) == expected
+    assert expected[0] == {"word": "the", "n": 6}
@@ -0,0 +1,45 @@
+import csv
+import gzip
+import json
+import os
+import typing as tp
+
+import pytest
+
+from compgraph import operations as ops
+from compgraph.graph import Graph
+from compgraph.sinks import write_rows
+
+
+def test_write_to_file_jsonl(tmp_path: tp.Any) -> None:
+    rows = [{"text": "hello", "count": 2}, {"text": "мир", "count": 1}]
+    path = str(tmp_path / "out.jsonl")
+    stats = Graph.graph_from_iter("rows").write_to_file(path, rows=lambda: iter(rows))
+
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == rows
+    assert (stats.rows, stats.files) == (2, [path])
+    assert stats.bytes == stats.file_bytes == os.path.getsize(path)
+
+
+def test_write_sharded_compressed_csv(tmp_path: tp.Any) -> None:
+    rows = [{"doc_id": i, "text": f"word {i}", "extra": i} for i in range(100)]
+    graph = Graph.graph_from_iter("rows").map(ops.Project(["doc_id", "text", "extra"]))
+    stats = graph.write_to_file(str(tmp_path / "out-{shard}.csv.gz"), shards=3, columns=["doc_id", "text"],
+                                block_rows=7, rows=lambda: iter(rows))
+
+    assert stats.rows == 100 and len(stats.files) == 3
+    result = []
+    for path in stats.files:
+        with gzip.open(path, "rt") as f:
+            result.extend(csv.DictReader(f))
+    assert sorted(result, key=lambda row: int(row["doc_id"])) == \
+        [{"doc_id": str(i), "text": f"word {i}"} for i in range(100)]
+
+
+def test_write_rows_errors(tmp_path: tp.Any) -> None:
+    with pytest.raises(ValueError):
+        write_rows(iter([]), str(tmp_path / "out.jsonl"), shards=2)
+    with pytest.raises(ValueError):
+        write_rows(iter([]), str(tmp_path / "out.txt"), format="xml")
+    assert write_rows(iter([]), str(tmp_path / "empty.csv")).file_bytes == 0
@@ -0,0 +1,84 @@
+import json
+import os
+import typing as tp
+
+from pytest import approx
+
+from compgraph import algorithms, operations as ops
+from compgraph.executor import Stage
+from compgraph.external_sort import ExternalSort
+from compgraph.optimizer import Planner
+from compgraph.sketches import HyperLogLog
+from compgraph.statistics import CollectStatistics, StageStatistics, StatisticsStore, fingerprint
+
+
+def test_hyper_log_log() -> None:
+    first, second = HyperLogLog(), HyperLogLog()
+    for i in range(20000):
+        first.add(i)
+        second.add(i + 10000)
+    assert first.count() == approx(20000, rel=0.05)
+    assert first.merge(second).count() == approx(30000, rel=0.05)
+    assert HyperLogLog.from_dict(first.to_dict()).count() == first.count()
+
+
+def test_collect_statistics() -> None:
+    rows = [{"word": w, "n": i} for i, w in enumerate("a b c a b a".split())]
+    statistics = StageStatistics([("word",)])
+    assert list(CollectStatistics(statistics, sample_every=1)(iter(rows))) == rows
+
+    restored = StageStatistics.from_dict(json.loads(json.dumps(statistics.to_dict())))
+    assert restored.rows == 6
+    assert restored.estimate().groups(["word"]) == approx(3, abs=0.1)
+    assert (restored.columns["n"].minimum, restored.columns["n"].maximum) == (0, 5)
+    assert restored.columns["word"].histogram.most_common(1) == [("a", 3)]
+
+
+def test_statistics_are_used_by_next_run(tmp_path: tp.Any) -> None:
+    input_file = os.path.join(tmp_path, "docs.txt")
+    with open(input_file, "w") as f:
+        for doc_id, text in enumerate(["hello, my little WORLD", "Hello, my little little hell"]):
+            print(json.dumps({"doc_id": doc_id, "text": text}), file=f)
+    store = StatisticsStore(os.path.join(tmp_path, "statistics"))
+    graph = algorithms.word_count_graph(input_file, "text", "count", json.loads)
+
+    first = graph.optimize(statistics_store=store)
+    assert not any(isinstance(stage.operation, ops.HashReduce) for stage in first.stages())
+    expected = list(first.run())
+
+    second = graph.optimize(statistics_store=store)
+    assert any(isinstance(stage.operation, ops.HashReduce) for stage in second.stages())
+    assert list(second.run()) == expected
+
+    saved = store.load(second.output)
+    assert saved[fingerprint(second.output)].rows == 5
+    assert saved[fingerprint(first.output)].rows == 5
+
+
+def test_statistics_of_optimized_graph_are_loaded(tmp_path: tp.Any) -> None:
+    input_file = os.path.join(tmp_path, "docs.txt")
+    with open(input_file, "w") as f:
+        for doc_id, text in enumerate(["hello little world hello little", "little world hello world world"]):
+            print(json.dumps({"doc_id": doc_id, "text": text}), file=f)
+    store = StatisticsStore(os.path.join(tmp_path, "statistics"))
+    graph = algorithms.pmi_graph(input_file, "doc_id", "text", "pmi", json.loads)
+
+    first = graph.optimize(statistics_store=store)
+    expected = list(first.run())
+    loaded = store.load(first.statistics_key)
+    assert loaded
+    assert fingerprint(first.statistics_key) != fingerprint(first.output)
+
+    second = graph.optimize(statistics_store=store)
+    assert all(fingerprint(stage) in loaded for stage in second.stages()
+               if not isinstance(stage.operation, ExternalSort))
+    assert Planner(stage_statistics=loaded).estimate(second.output).rows == len(expected)
+    assert list(second.run()) == expected
+
+
+def test_fingerprint_ignores_physical_strategy() -> None:
+    source = Stage(ops.ReadIterFactory("docs"))
+    merge = Stage(ops.Reduce(ops.Count("count"), ["text"]), [Stage(ops.Read("docs", json.loads))])
+    hashed = Stage(ops.HashReduce(ops.Count("count"), ["text"], 10), [Stage(ops.Read("docs", json.loads))])
+    assert fingerprint(merge) == fingerprint(hashed)
+    assert fingerprint(source) != fingerprint(merge.inputs[0])